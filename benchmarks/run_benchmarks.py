@@ -0,0 +1,207 @@
+'''
+Benchmarks of the counting, convolution and probability kernels, and of Monte
+Carlo sampling.
+
+Run from this directory:
+    python run_benchmarks.py -o results.json
+    python run_benchmarks.py -b results.json -t 0.2 -t 'montecarlo.*=0.5'
+
+The second form compares against a previous run and exits with status 1 if any
+benchmark is slower than its baseline by more than the threshold.  Times are
+specific to the machine, so baselines should be recorded on the machine that
+runs the comparison.  Counting at k=3 on the Golay preparation circuit takes
+many minutes, and runs only with --slow.
+
+All inputs are generated from fixed seeds, and nothing is fetched from or
+saved to disk, so that every run does the same work.
+'''
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'examples', 'knill'))
+
+from knill_scheme import KnillScheme
+from qfault.circuit import location
+from qfault.circuit.location import Locations
+from qfault.counting.convolve import convolve_dict_tuples
+from qfault.counting.count_locations import count_errors_of_order_k
+from qfault.counting.key import SyndromeKeyDecoder
+from qfault.counting.probability import pr_at_least_k_failures
+from qfault.counting.sampling import sample_errors_of_order_k
+from qfault.noise import CountingNoiseModelXZ, NoiseModelXZSympy
+from qfault.qec import ed422
+from qfault.qec.encode.ancilla import ancillaZPrep
+from qfault.qec.error import Pauli, xType
+from qfault.qec.golay import GolayCode
+from qfault.sim import batch, bitsliced, sim_utils
+from qfault.sim.faults import FaultSampler
+from qfault.sim.verify import parity_checks, sample_verified
+from qfault.util import cache
+from qfault.util.benchmark import Benchmark, main
+from sympy.core.cache import clear_cache
+import collections
+import functools
+import numpy
+
+SEED = 2012
+
+# A Golay |0> preparation schedule (the first of the random circuits in
+# examples/golay/ancillaPrep.py).
+golayPrepSchedule = [[[1,0],[5,14],[9,20],[10,4],[11,19],[12,2],[13,7],[15,6],[17,16],[18,8],[21,3]],
+                     [[1,2],[5,6],[9,14],[10,22],[11,7],[12,20],[13,16],[15,19],[17,8],[18,3],[21,0]],
+                     [[1,4],[5,0],[9,19],[10,6],[11,2],[12,22],[13,20],[15,3],[17,7],[18,16],[21,8]],
+                     [[1,6],[5,2],[9,0],[10,16],[11,8],[12,4],[13,3],[15,20],[17,19],[18,14],[21,22]],
+                     [[1,8],[5,19],[9,7],[10,3],[11,0],[12,16],[13,4],[15,14],[17,2],[18,22],[21,20]],
+                     [[1,14],[5,16],[9,2],[10,8],[11,22],[12,7],[13,0],[15,4],[17,20],[18,19],[21,6]],
+                     [[1,20],[5,22],[9,3],[10,2],[11,4],[12,14],[13,8],[15,16],[17,6],[18,7],[21,19]]]
+
+def golay_prep():
+    return Locations(ancillaZPrep(golayPrepSchedule), 'golay.0')
+
+def ed412_prep():
+    return ed422.prepare(Pauli.Z, Pauli.X)
+
+
+def count_setup(prep, k):
+    locations = prep()
+    return functools.partial(count_errors_of_order_k, k, locations, CountingNoiseModelXZ())
+
+def sample_setup(k, samples):
+    locations = golay_prep()
+    return functools.partial(sample_errors_of_order_k, k, locations, CountingNoiseModelXZ(),
+                             samples=samples, rng=random.Random(SEED))
+
+def convolve_setup(size, bitlengths=(8, 8)):
+    rng = random.Random(SEED)
+    def table():
+        return {tuple(rng.getrandbits(b) for b in bitlengths): rng.randint(1, 100)
+                for _ in xrange(size)}
+    return functools.partial(convolve_dict_tuples, bitlengths, bitlengths, table(), table())
+
+def pr_setup(kMin, kMax=None):
+    locations = golay_prep()
+    clear_cache()
+    return functools.partial(pr_at_least_k_failures, kMin, locations, NoiseModelXZSympy(), kMax)
+
+def knill_count_setup(k):
+    kGood = {Pauli.X: k, Pauli.Z: k, Pauli.Y: k}
+    scheme = KnillScheme(kGood, kGood, kGood, kGood)
+    def count():
+        for component in (scheme.bellPair, scheme.ed, scheme.bellMeas):
+            for pauli in (Pauli.X, Pauli.Z, Pauli.Y):
+                component.count(scheme.defaultNoiseModels, pauli)
+    return count
+
+def knill_pr_setup(k):
+    kGood = {Pauli.Y: k}
+    scheme = KnillScheme(kGood, kGood, kGood, kGood)
+    clear_cache()
+    def pr():
+        # prEgivenAccept prints its intermediate results.
+        stdout = sys.stdout
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            scheme.prEgivenAccept(Pauli.I, Pauli.X, scheme.defaultNoiseModels)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+    return pr
+
+
+_sim_functions = {'prepX': sim_utils.prepX, 'prepZ': sim_utils.prepZ,
+                  'measX': sim_utils.measX, 'measZ': sim_utils.measZ,
+                  'rest': sim_utils.rest}
+
+def simulate(locations, errorRates, shots):
+    '''
+    Samples the given locations one shot at a time.  Returns the number of
+    shots with a non-trivial error.
+    '''
+    failures = 0
+    for _ in xrange(shots):
+        errors = {'X': collections.defaultdict(int), 'Z': collections.defaultdict(int)}
+        for loc in locations:
+            if 'cnot' == loc['type']:
+                sim_utils.cnot(errorRates, errors, loc['block1'], loc['bit1'], loc['block2'], loc['bit2'])
+            else:
+                _sim_functions[loc['type']](errorRates, errors, loc['block1'], loc['bit1'])
+        failures += any(errors['X'].values()) or any(errors['Z'].values())
+    return failures
+
+def montecarlo_setup(shots, p=0.001):
+    locations = golay_prep()
+    random.seed(SEED)
+    return functools.partial(simulate, locations, bitsliced.error_rates(p), shots)
+
+def bitsliced_setup(shots, p=0.001):
+    locations = golay_prep()
+    rng = numpy.random.RandomState(SEED)
+    return functools.partial(bitsliced.simulate, locations, bitsliced.error_rates(p), shots, rng)
+
+def _bitsliced_failures(locations, errorRates, rng, shots):
+    return int(bitsliced.simulate(locations, errorRates, shots, rng).nontrivial().sum())
+
+def batched_setup(shots, p=0.001):
+    sampler = functools.partial(_bitsliced_failures, golay_prep(), bitsliced.error_rates(p))
+    return functools.partial(batch.sample_batches, sampler, shots, SEED, batch_size=2 ** 15, use_numpy=True)
+
+def verify_setup(count, p=0.001):
+    # Two |0> ancillas, with the X errors of a0 detected by measuring a1.  The
+    # qubits are not reversed, so that the checks are those of getSyndrome().
+    locs = []
+    for name in ('a0', 'a1'):
+        locs += list(ancillaZPrep(golayPrepSchedule, name=name, reverseQubitOrder=False))
+    for bit in range(23):
+        locs += [location.cnot('a0', bit, 'a1', bit), location.meas(Pauli.Z, 'a1', bit), location.rest('a0', bit)]
+    locations = Locations(locs, 'golay.verify')
+    tests = [('a1', 'X', parity_checks(GolayCode.getSyndrome, 23))]
+    rng = numpy.random.RandomState(SEED)
+    return functools.partial(sample_verified, locations, bitsliced.error_rates(p), tests, count, rng=rng)
+
+def syndrome_setup(size):
+    patterns = [random.Random(SEED).getrandbits(23) for _ in xrange(size)]
+    return lambda: [GolayCode.getSyndrome(e) for e in patterns]
+
+def syndromes_setup(size):
+    patterns = numpy.random.RandomState(SEED).randint(0, 1 << 23, size)
+    return functools.partial(GolayCode.getSyndromes, patterns)
+
+def decode_setup(size):
+    decoder = SyndromeKeyDecoder(ed422.ED412Code(gaugeType=xType))
+    keys = numpy.random.RandomState(SEED).randint(0, 1 << 5, size)
+    return functools.partial(decoder.decodeKeys, keys)
+
+def rare_setup(shots, p=0.001):
+    sampler = FaultSampler(golay_prep(), bitsliced.error_rates(p), rng=random.Random(SEED))
+    return functools.partial(sampler.sample_counts, shots)
+
+
+benchmarks = []
+for k in (1, 2, 3):
+    benchmarks.append(Benchmark('count.ed412.k{0}'.format(k), functools.partial(count_setup, ed412_prep, k)))
+for k in (1, 2, 3):
+    benchmarks.append(Benchmark('count.golay.k{0}'.format(k), functools.partial(count_setup, golay_prep, k),
+                                repeat=(1 if k > 1 else None), slow=(3 == k)))
+benchmarks.append(Benchmark('sample.golay.k6', functools.partial(sample_setup, 6, 10000), work=10000))
+for size in (100, 300, 1000):
+    benchmarks.append(Benchmark('convolve.tuples.n{0}'.format(size), functools.partial(convolve_setup, size),
+                                work=size * size))
+benchmarks += [Benchmark('syndrome.golay.scalar', functools.partial(syndrome_setup, 10 ** 5), work=10 ** 5),
+               Benchmark('syndrome.golay.batch', functools.partial(syndromes_setup, 2 ** 20), work=2 ** 20),
+               Benchmark('decode.ed412.batch', functools.partial(decode_setup, 2 ** 20), work=2 ** 20),
+               Benchmark('probability.golay.k2', functools.partial(pr_setup, 2)),
+               Benchmark('probability.golay.k2-4', functools.partial(pr_setup, 2, 4)),
+               Benchmark('knill.count.k1', functools.partial(knill_count_setup, 1)),
+               Benchmark('knill.count.k2', functools.partial(knill_count_setup, 2)),
+               Benchmark('knill.pr_e_given_accept.k1', functools.partial(knill_pr_setup, 1), repeat=1),
+               Benchmark('montecarlo.golay.serial', functools.partial(montecarlo_setup, 2000), work=2000),
+               Benchmark('montecarlo.golay.bitsliced', functools.partial(bitsliced_setup, 2 ** 18), work=2 ** 18),
+               Benchmark('montecarlo.golay.batched', functools.partial(batched_setup, 2 ** 18), work=2 ** 18),
+               Benchmark('montecarlo.golay.verify', functools.partial(verify_setup, 2 ** 14), work=2 ** 14),
+               Benchmark('montecarlo.golay.rare', functools.partial(rare_setup, 10 ** 5), work=10 ** 5)]
+
+
+if __name__ == '__main__':
+    cache.enableFetch(False)
+    sys.exit(main(benchmarks))
@@ -37,8 +37,8 @@ class SubblockTeleport(SequentialComponent):
         
         super(SubblockTeleport, self).__init__(kGood, subcomponents=[bell_pair, cnot, discard, teleport])
         
-    def count(self, noiseModels, pauli, inputResult=None, kMax=None):
-        r = super(SubblockTeleport, self).count(noiseModels, pauli, inputResult, kMax)
+    def count(self, noiseModels, pauli, inputResult=None, kMax=None, kMin=0):
+        r = super(SubblockTeleport, self).count(noiseModels, pauli, inputResult, kMax, kMin)
         return r
         
 class BlockTeleport(SequentialComponent):
@@ -69,8 +69,8 @@ class BlockTeleport(SequentialComponent):
         
         super(BlockTeleport, self).__init__(kGood, subcomponents=[bp_cnot_parallel, cnot, discard3, meas])
         
-    def count(self, noiseModels, pauli, inputResult=None, kMax=None):
-        r = super(BlockTeleport, self).count(noiseModels, pauli, inputResult, kMax)
+    def count(self, noiseModels, pauli, inputResult=None, kMax=None, kMin=0):
+        r = super(BlockTeleport, self).count(noiseModels, pauli, inputResult, kMax, kMin)
         return r
         
         
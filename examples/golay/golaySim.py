@@ -13,6 +13,8 @@
 # Ben Reichardt, 12/28/2009
 #
 
+from qfault.qec import tables
+from qfault.qec.golay import GolayCode
 from sim.simulateUtils import cnot, measX, measZ, prepX, prepZ, rest
 from util.counterUtils import weight, etostr, readBinaryString, parity
 import golay.ancillaPrep
@@ -164,19 +166,14 @@ def getSyndrome(pattern):
     bits, when constructing the encoding table; (2) pattern = error pattern,
     when constructing the decoding table; and (3) pattern = received vector, to
     obtain its syndrome in decoding.
+    
+    The syndrome is looked up by bytes, see qfault.qec.golay.
     """
-    X22    = 1<<22                # vector representation of X^22
-    X11    = 1<<11                # vector representation of X^11
-    MASK12 = (1<<23)-(1<<11)    # auxiliary vector for testing
-    GENPOL = 0xc75                # generator polynomial, g(x) = x^11+x^10+x^6+x^5+x^4+x^2+1
-    
-    aux = X22
-    if pattern >= X11:
-        while pattern & MASK12: 
-            while not (aux & pattern): 
-                aux = aux >> 1
-            pattern ^= (aux/X11) * GENPOL
-    return pattern
+    return GolayCode.getSyndrome(pattern)
+
+def getSyndromes(patterns):
+    """Returns an array of the syndromes of an array of patterns."""
+    return GolayCode.getSyndromes(patterns)
 
 # ---------------------------------------------------------------------
 #                  Generate DECODING TABLE
@@ -212,9 +209,13 @@ class Corrector:
     
     """Class that initializes correction and decoding lookup tables, exporting corresponding functions."""
     def __init__(self):
-        self.corrections = generateCorrectionsTable()
+        # The table is built once and shared with GolayCode (see qfault.qec.tables).
+        self.corrections = tables.decoderTable('golay.corrections', GolayCode.generateCorrectionsTable)
     def correctError(self, e):
-        return self.corrections[getSyndrome(e)]
+        return int(self.corrections[getSyndrome(e)])
+    def correctErrors(self, es):
+        """Returns an array of the corrections of an array of errors."""
+        return self.corrections[getSyndromes(es)]
     def correctXError(self, e):
         return self.correctError(e)
     def correctZError(self, e):
@@ -226,7 +227,7 @@ class Corrector:
         return bool(weight(e ^ self.correctError(e), 23) % 2)
     def decodeSyndrome(self, s):
         e = self.getError(s)
-        return bool(weight(e ^ self.corrections[s & self.syndromeMask], 23) % 2)
+        return bool(weight(e ^ int(self.corrections[s & self.syndromeMask]), 23) % 2)
     def hashError(self, e, logical=False): 
         """This is the same as reduceErrorGolay, except preprocessed according to the syndrome."""
         c1 = self.correctError(e)
@@ -239,6 +240,9 @@ class Corrector:
     def getSyndrome(self, e):
         """Returns the 11-bit error syndrome."""
         return getSyndrome(e)
+    def getSyndromes(self, es):
+        """Returns an array of the 11-bit syndromes of an array of errors."""
+        return getSyndromes(es)
     def getLogicalSyndrome(self, e):
         """Returns a 12-bit error syndrome, the parity followed by the 11-bit error syndrome."""
         s = self.getSyndrome(e)
@@ -260,12 +264,12 @@ class Corrector:
         '''Returns a syndrome corresponding to the appropriate correction for the given logical syndrome.'''
         # Strip off the parity bit
         s &= self.syndromeMask
-        correction = self.corrections[s]
+        correction = int(self.corrections[s])
         return self.getLogicalSyndrome(correction)
     
     def correctSyndrome(self, s):
         s &= self.syndromeMask
-        correction = self.corrections[s]
+        correction = int(self.corrections[s])
         return self.getSyndrome(correction)
         
     
@@ -3,7 +3,9 @@ Created on 2012-08-11
 
 @author: adam
 '''
+from qfault.counting import planner
 from qfault.qec.error import Pauli
+from qfault.util import profiling
 from knill_scheme import KnillScheme
 import logging
 
@@ -25,4 +27,17 @@ if __name__ == '__main__':
     kExRec = {Pauli.Y: 1}
     
     scheme = KnillScheme(kPrep, kCnot, kEC, kExRec)
-    scheme.count()
\ No newline at end of file
+    
+    # Estimate the cost of the error-correction gadget, and configure
+    # workers and convolution accordingly.  To spill large tables to disk,
+    # pass memory=planner.available_memory().
+    plan = planner.plan(scheme.ed, scheme.defaultNoiseModels, Pauli.Y)
+    print plan
+    plan.apply()
+    
+    # Record where the time goes.  The folded stacks can be rendered with
+    # flamegraph.pl.
+    profiling.enable()
+    scheme.count()
+    profiling.write_json('knill-profile.json')
+    profiling.write_folded('knill-profile.folded')
\ No newline at end of file
@@ -5,7 +5,7 @@ Schemes based on Knill's C4/C6 error-detection and teleportation based proposals
 
 @author: adam
 '''
-from qfault.counting import probability
+from qfault.counting import probability, truncation
 from qfault.counting.component.adapter import DecodeAdapter, SyndromeAdapter
 from qfault.counting.component.base import Prep, ParallelComponent
 from qfault.counting.component.bell import BellPair, BellMeas
@@ -18,12 +18,14 @@ from qfault.counting.result import CountResult
 from qfault.qec import ed422, error
 from qfault.qec.error import Pauli
 from qfault.qec.qecc import StabilizerState, TrivialStablizerCode
+from qfault.util import trace
 from qfault.util.polynomial import SymPolyWrapper, sympoly1d
 from scheme import Scheme
 import logging
 import operator
 
 logger = logging.getLogger('scheme.knill')
+tracer = trace.get_tracer('scheme.knill')
 
 class KnillScheme(Scheme):
     '''
@@ -97,7 +99,8 @@ class KnillScheme(Scheme):
             print 'Pr[E=({0},{1}), Sin={2}](0.004)={3}'.format(eA,eB, key, pr(0.004/15))
             
         pr = sum(prTable.values())
-        logger.debug('Pr[E={0}](0.004)={1}'.format(e, pr(0.004/15)))
+        if tracer.enabled:
+            tracer.event('Pr[E=%s](0.004)=%s', e, pr(0.004/15))
                 
         # Compute Pr[E=e, ED_R accept, good | Sin=s]      
         prBad = rec.prBad(noiseModels[Pauli.Y], Pauli.Y)
@@ -143,13 +146,14 @@ class KnillScheme(Scheme):
         # TODO: hack!
         inputResult = CountResult([{s: 1}], exrec.inBlocks())
 
-        logger.debug('Counting exRec for Pr[E={0} | Sin={1}]'.format(e, s))
+        logger.debug('Counting exRec for Pr[E=%s | Sin=%s]', e, s)
         result = exrec.count(noiseModels, Pauli.Y, inputResult=inputResult)
-        counts = [{e: count.get(e,0)} for count in result.counts]
-        logger.debug('Counts for [E={0} | Sin={1}]: {2}'.format(e, s, counts))
-        prE = probability.counts_as_poly(counts, exrec.locations(), noiseModels[Pauli.Y])
+        if tracer.enabled:
+            tracer.event('Counts for [E=%s | Sin=%s]: %s', e, s, [{e: count.get(e,0)} for count in result.counts])
+        prE = probability.counts_as_poly(result.counts, exrec.locations(), noiseModels[Pauli.Y], keys=[e])
 #        logger.debug('Pr[E={0} | Sin={1}] = {2}'.format(e, s, prE))
-        logger.debug('Pr[E={0} | Sin={1}](0.004)={2}'.format(e, s, prE(0.004/15)))
+        if tracer.enabled:
+            tracer.event('Pr[E=%s | Sin=%s](0.004)=%s', e, s, prE(0.004/15))
         
         return prE
     
@@ -199,9 +203,11 @@ class KnillScheme(Scheme):
         result = rec.count(noiseModels, pauli, inputResult=inResult)
         sCounts = []
         for count in result.counts:
+            # The remainder bucket of truncated counts may contain s.
+            count, remainder = truncation.split_remainder(count)
             sA = sum(c for key,c in count.iteritems() if s == (key[0],))
             sB = sum(c for key,c in count.iteritems() if s == (key[1],))
-            sCounts.append({s: max(sA,sB)})
+            sCounts.append({s: max(sA,sB) + remainder})
         
         pr = probability.counts_as_poly(sCounts, rec.locations(pauli), noiseModels[pauli])
         pr += rec.prBad(noiseModels[pauli], pauli)
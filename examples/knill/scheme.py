@@ -3,7 +3,7 @@ Created on 2011-11-14
 
 @author: adam
 '''
-from qfault.counting import probability
+from qfault.counting import probability, truncation
 from qfault.qec import Pauli, PauliError
 from qfault.noise import NoiseModelXSympy, NoiseModelZSympy, NoiseModelXZSympy
 import logging
@@ -61,16 +61,16 @@ class Scheme(object):
         prAccept = exRec.prAccept(noiseModels)
         print 'Pr[accept]({0})'.format(p), prAccept(gamma)
         
-        # Construct a polynomial for each logical error
-        # exRec counts are indexed by [k][error]
-        # rearrange so that the index is [error][k]
-        logicalCounts = {}
-        for k, counts in enumerate(result.counts):
-            for e, count in counts.iteritems():
-                logicalCounts[e] = logicalCounts.get(e, [{e:0}]*k) + [{e:count}]
+        # Construct a polynomial for each logical error.  The remainder
+        # bucket of truncated counts may contain any logical error, so it is
+        # included in each bound (see probability.counts_as_poly).
+        logicalErrors = set()
+        for counts in result.counts:
+            counts, _ = truncation.split_remainder(counts)
+            logicalErrors.update(counts.iterkeys())
                 
-        for e, counts in logicalCounts.iteritems():
-            pr = probability.counts_as_poly(counts, locTotals, noise)
+        for e in logicalErrors:
+            pr = probability.counts_as_poly(result.counts, locTotals, noise, keys=[e])
             pr = prInput * (pr / prAccept) + prBad
             logicalProbabilities[e] = pr
             
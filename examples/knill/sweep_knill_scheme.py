@@ -0,0 +1,34 @@
+'''
+Counts the Knill error-detection gadget over a grid of fault cutoffs.
+Sub-components that are common to several grid points are counted once.
+'''
+from qfault.counting import sweep
+from qfault.qec.error import Pauli
+from qfault.util import concurrency
+from knill_scheme import KnillScheme
+import logging
+
+
+def build(params):
+    kPrep = {Pauli.Y: params['kPrep']}
+    kCnot = {Pauli.Y: params['kCnot']}
+    kEC = {Pauli.Y: params['kEC']}
+    scheme = KnillScheme(kPrep, kCnot, kEC, kEC)
+    components = {'bellPair': scheme.bellPair,
+                  'bellMeas': scheme.bellMeas,
+                  'ed': scheme.ed}
+    return components, scheme.defaultNoiseModels
+
+def report(done, total):
+    print '{0}/{1} leaf orders counted'.format(done, total)
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+
+    # Leaves are counted concurrently, and so are the subsets of each leaf.
+    concurrency.initialize_concurrency(nested=True)
+
+    points = sweep.grid(kPrep=[1, 2], kCnot=[1, 2], kEC=[1, 2])
+    for point in sweep.sweep(build, points, paulis=[Pauli.Y], progress=report):
+        result = point.results[('ed', Pauli.Y)]
+        print point.params, [len(countsK) for countsK in result.counts]
@@ -0,0 +1,559 @@
+'''
+Aggregation of (key, count) pairs into count tables.
+
+By default, count tables are ordinary dictionaries held in memory.  When a
+memory budget is set (see set_memory_budget()), count tables that grow beyond
+the budget spill sorted runs of (key, count) pairs to disk.  The runs are
+k-way merged when the table is read, so that the final counts are exactly
+the same as those of the in-memory aggregation.
+
+Runs are sorted by key hash, so keys must have hashes that do not depend on
+the process in which they were computed (e.g., integers, tuples of integers,
+PauliErrors).
+
+The runs of a spilled table are deleted when the table is garbage collected,
+so disk usage follows the tables that are still in use.  A table computed by a
+worker process is handed over to the parent process when it is pickled.  All
+other pickled copies refer to runs that they do not own, so spilled tables must
+not be persisted beyond the lifetime of the process.  Tables that are saved
+(e.g., by CountResult) are wrapped in StoredCounts, which copies their runs to
+the run store (see set_store_dir()), so that a spilled table is never
+materialized in memory to be saved.
+
+Tables that are shared with worker processes may be packed into numpy arrays
+(see pack()), so that the workers memory-map them instead of unpickling them
+(see concurrency.broadcast()).
+'''
+import atexit
+import bisect
+import cPickle
+import errno
+import hashlib
+import heapq
+import itertools
+import logging
+import multiprocessing
+import numpy
+import os
+import shutil
+import tempfile
+
+logger = logging.getLogger('counting.aggregate')
+
+__all__ = ['set_memory_budget', 'memory_budget', 'new_counts', 'finalize', 'collect', 'iterblocks',
+           'set_store_dir', 'StoredCounts', 'pack', 'PackedCounts']
+
+# Number of entries written per pickle record in a run file.
+_RECORD_SIZE = 4096
+
+_max_entries = None
+_spill_dir = None
+_spill_dirs = []
+
+# Saved tables are kept with the other fetched data (see cache.DataManager).
+_store_dir = os.path.join(os.path.pardir, 'data', 'runs')
+
+def set_memory_budget(max_entries, spill_dir=None):
+    '''
+    Sets the maximum number of entries that a count table may hold in memory.
+    Tables that exceed the budget are spilled to disk.  Use None to disable
+    spilling (the default).
+
+    Spilled tables refer to run files in a temporary directory created inside
+    spill_dir (default is the system temporary directory).  The runs of a table
+    are deleted once the table is no longer referenced.  Any remaining runs are
+    deleted at exit.
+
+    :param int max_entries: The maximum number of in-memory entries per table.
+    :param str spill_dir: (optional) The directory in which to store runs.
+    '''
+    global _max_entries, _spill_dir
+
+    # Tables that were spilled under the previous budget may still be in use,
+    # so their runs are kept.
+    _max_entries = max_entries
+    _spill_dir = None
+    if None != max_entries:
+        _spill_dir = tempfile.mkdtemp(prefix='qfault-spill-', dir=spill_dir)
+        _spill_dirs.append(_spill_dir)
+        logger.info('Spilling count tables with more than %s entries to %s', max_entries, _spill_dir)
+
+def memory_budget():
+    '''
+    Returns the maximum number of in-memory entries per table, or None
+    if spilling is disabled.
+    '''
+    return _max_entries
+
+def set_store_dir(path):
+    '''
+    Sets the directory to which the runs of saved tables are copied (see
+    StoredCounts).  Runs in the store are never deleted.
+    '''
+    global _store_dir
+    _store_dir = path
+
+def cleanup():
+    '''
+    Deletes all spilled runs.  Spilled tables may not be used afterward.
+    '''
+    global _spill_dir
+    # Worker processes inherit the list, but the directories belong to the parent.
+    if not multiprocessing.current_process().daemon:
+        for path in _spill_dirs:
+            shutil.rmtree(path, ignore_errors=True)
+    del _spill_dirs[:]
+    _spill_dir = None
+
+atexit.register(cleanup)
+
+def new_counts():
+    '''
+    Returns an empty count table suitable for aggregation, i.e., a
+    dict that supports counts[key] = counts.get(key, 0) + count.
+    The table must be passed to finalize() once aggregation is complete.
+    '''
+    if None == _max_entries:
+        return {}
+    return SpillingCounts(_max_entries, _spill_dir)
+
+def finalize(counts):
+    '''
+    Returns the aggregated count table for a table obtained from new_counts().
+    The result is either a dict or, if the table was spilled, a read-only
+    MergedCounts.
+    '''
+    try:
+        return counts.finalize()
+    except AttributeError:
+        return counts
+
+def collect(items):
+    '''
+    Aggregates (key, count) pairs into a count table.  Counts for equal keys
+    are summed.
+
+    >>> collect([('a', 1), ('b', 2), ('a', 3)]) == {'a': 4, 'b': 2}
+    True
+    '''
+    counts = new_counts()
+    for key, count in items:
+        counts[key] = counts.get(key, 0) + count
+    return finalize(counts)
+
+def iterblocks(counts, size=None):
+    '''
+    Yields the (key, count) items of a table in lists of at most size items.
+    The default size is the memory budget, or all of the items if there is
+    no budget.
+
+    >>> list(iterblocks({1: 2, 3: 4}, 1))
+    [[(1, 2)], [(3, 4)]]
+    '''
+    if None == size:
+        size = _max_entries
+    items = counts.iteritems()
+    if None == size:
+        yield list(items)
+        return
+    for block in iter(lambda: list(itertools.islice(items, size)), []):
+        yield block
+
+
+class SpillingCounts(dict):
+    '''
+    A count table that writes its contents to a sorted run on disk whenever
+    it holds more than max_entries entries.  Keys that have been spilled
+    may appear in memory again; the counts are summed when the runs are merged.
+
+    >>> counts = SpillingCounts(2, tempfile.gettempdir())
+    >>> for key in [3, 1, 2, 1, 3, 3]:
+    ...     counts[key] = counts.get(key, 0) + 1
+    >>> merged = counts.finalize()
+    >>> sorted(merged.iteritems())
+    [(1, 2), (2, 1), (3, 3)]
+    >>> merged.release()
+    '''
+
+    def __init__(self, max_entries, spill_dir):
+        super(SpillingCounts, self).__init__()
+        self._max_entries = max_entries
+        self._spill_dir = spill_dir
+        self._runs = []
+        self._indices = []
+        self._rejected = set()
+
+    def __setitem__(self, key, count):
+        dict.__setitem__(self, key, count)
+        if len(self) > self._max_entries:
+            self._spill()
+
+    def pop(self, key, *default):
+        # The key may also be present in a spilled run.
+        if self._runs:
+            self._rejected.add(key)
+        return dict.pop(self, key, *default)
+
+    def finalize(self):
+        if not self._runs:
+            return dict(self)
+
+        if len(self):
+            self._spill()
+        return MergedCounts(self._runs, self._rejected, indices=self._indices)
+
+    def _spill(self):
+        entries = sorted((hash(key), seq, key, count)
+                         for seq, (key, count) in enumerate(self.iteritems()))
+        fd, path = tempfile.mkstemp(suffix='.run', dir=self._spill_dir)
+        # The index holds the first hash and the offset of each record.
+        hashes, offsets = [], []
+        with os.fdopen(fd, 'wb') as run:
+            for i in xrange(0, len(entries), _RECORD_SIZE):
+                hashes.append(entries[i][0])
+                offsets.append(run.tell())
+                cPickle.dump(entries[i:i+_RECORD_SIZE], run, cPickle.HIGHEST_PROTOCOL)
+
+        logger.debug('Spilled %s entries to %s', len(entries), path)
+        self._runs.append(path)
+        self._indices.append((hashes, offsets))
+        self.clear()
+
+
+class MergedCounts(object):
+    '''
+    A read-only count table consisting of sorted runs on disk.  The
+    table supports iteration (iteritems() etc.) and len() efficiently.  Lookup
+    of a single key reads only the records of each run that may hold the key,
+    as given by the index of the run: the first hash and the file offset of
+    each record.
+
+    The table owns its runs, and deletes them when it is garbage collected.
+    '''
+
+    def __init__(self, runs, rejected=(), owner=True, indices=None):
+        self._runs = tuple(runs)
+        self._rejected = frozenset(rejected)
+        self._owner = owner
+        self._indices = None if None == indices else tuple(indices)
+        self._len = None
+        self._digest = None
+
+    def iteritems(self):
+        merged = heapq.merge(*[self._read_run(i, path) for i, path in enumerate(self._runs)])
+        for _, group in itertools.groupby(merged, lambda entry: entry[0]):
+            # Keys with equal hashes are adjacent, but need not be equal.
+            counts = {}
+            for entry in group:
+                key, count = entry[-2:]
+                counts[key] = counts.get(key, 0) + count
+            for key, count in counts.iteritems():
+                if key not in self._rejected:
+                    yield key, count
+
+    def iterkeys(self):
+        return (key for key, _ in self.iteritems())
+
+    def itervalues(self):
+        return (count for _, count in self.iteritems())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def get(self, key, default=None):
+        if key in self._rejected:
+            return default
+        h = hash(key)
+        found = False
+        total = 0
+        for path, (hashes, offsets) in zip(self._runs, self._index()):
+            # Entries with hash h may start in the last record that begins
+            # before h, and continue through the records that begin with h.
+            start = max(bisect.bisect_left(hashes, h) - 1, 0)
+            stop = bisect.bisect_right(hashes, h)
+            if start >= stop:
+                continue
+            with open(path, 'rb') as run:
+                run.seek(offsets[start])
+                for _ in xrange(start, stop):
+                    for entryHash, _, k, count in cPickle.load(run):
+                        if entryHash == h and k == key:
+                            total += count
+                            found = True
+        return total if found else default
+
+    def _index(self):
+        if None == self._indices:
+            self._indices = tuple(self._read_index(path) for path in self._runs)
+        return self._indices
+
+    def release(self):
+        '''
+        Deletes the runs.  The table may not be used afterward.
+        '''
+        if not self._owner:
+            return
+        for path in self._runs:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        self._runs = ()
+
+    def __getitem__(self, key):
+        count = self.get(key, self)
+        if count is self:
+            raise KeyError(key)
+        return count
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def __len__(self):
+        if None == self._len:
+            self._len = sum(1 for _ in self.iteritems())
+        return self._len
+
+    def __nonzero__(self):
+        return 0 != len(self)
+
+    def __eq__(self, other):
+        return dict(self.iteritems()) == dict(other.iteritems())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __del__(self):
+        try:
+            self.release()
+        except Exception:
+            # The os module may already be gone at interpreter exit.
+            pass
+
+    def __repr__(self):
+        # The representation identifies the content of the table, since it
+        # is used in cache keys.
+        return 'MergedCounts({0})'.format(self.digest())
+
+    def digest(self):
+        '''
+        Returns a hash of the content of the table.
+        '''
+        if None == self._digest:
+            md5 = hashlib.md5()
+            # The entries are ordered by key hash.  Entries with equal hashes
+            # are ordered by representation.
+            for _, group in itertools.groupby(self.iteritems(), lambda item: hash(item[0])):
+                for text in sorted(repr(item) for item in group):
+                    md5.update(text)
+            self._digest = md5.hexdigest()
+        return self._digest
+
+    def __getstate__(self):
+        # Ownership of the runs passes from a worker process to the parent.
+        transfer = self._owner and multiprocessing.current_process().daemon
+        if transfer:
+            self._owner = False
+        return (self._runs, self._rejected, transfer, self._indices)
+
+    def __setstate__(self, state):
+        runs, rejected, transfer, indices = state
+        self.__init__(runs, rejected, transfer and not multiprocessing.current_process().daemon, indices)
+
+    def store(self):
+        '''
+        Copies the runs to the run store, unless they are there already, and
+        returns an unowned table of the stored runs.
+        '''
+        stored = []
+        for path in self._runs:
+            # Stored runs are named by their content, so that they may be
+            # shared by all of the tables that contain them.
+            target = os.path.join(_store_dir, _file_digest(path) + '.run')
+            if not os.path.exists(target):
+                try:
+                    os.makedirs(_store_dir)
+                except OSError as e:
+                    if errno.EEXIST != e.errno:
+                        raise
+                # Copy to a temporary file and then rename it, so that a
+                # partial copy is never used.
+                fd, temp = tempfile.mkstemp(suffix='.run', dir=_store_dir)
+                os.close(fd)
+                shutil.copyfile(path, temp)
+                os.rename(temp, target)
+            stored.append(target)
+        return MergedCounts(stored, self._rejected, owner=False, indices=self._indices)
+
+    @staticmethod
+    def _read_index(path):
+        hashes, offsets = [], []
+        with open(path, 'rb') as run:
+            while True:
+                offset = run.tell()
+                try:
+                    entries = cPickle.load(run)
+                except EOFError:
+                    return hashes, offsets
+                hashes.append(entries[0][0])
+                offsets.append(offset)
+
+    @staticmethod
+    def _read_run(index, path):
+        with open(path, 'rb') as run:
+            while True:
+                try:
+                    entries = cPickle.load(run)
+                except EOFError:
+                    return
+                for h, seq, key, count in entries:
+                    # Order by hash, then run, then position within the run so
+                    # that keys are never compared directly.
+                    yield h, index, seq, key, count
+
+
+class PackedCounts(object):
+    '''
+    A read-only count table held in two numpy arrays: the integers of each key,
+    one row per entry, and the count of each entry.  The table is pickled as
+    its arrays, so that it may be memory-mapped (see concurrency.broadcast()).
+    Lookup of a single key builds a dict of the table the first time.
+
+    >>> table = pack({(0, 1): 2, (1, 1): 3})
+    >>> sorted(table.iteritems())
+    [((0, 1), 2), ((1, 1), 3)]
+    >>> table[(1, 1)], table.get((2, 2)), len(table)
+    (3, None, 2)
+    '''
+
+    def __init__(self, keys, counts):
+        self._keys = keys
+        self._counts = counts
+        self._table = None
+
+    def iteritems(self):
+        # Convert a record at a time, so that the arrays are not copied in full.
+        for start in xrange(0, len(self._counts), _RECORD_SIZE):
+            stop = start + _RECORD_SIZE
+            for key, count in itertools.izip(self._keys[start:stop].tolist(), self._counts[start:stop].tolist()):
+                yield tuple(key), count
+
+    def iterkeys(self):
+        return (key for key, _ in self.iteritems())
+
+    def itervalues(self):
+        return (count for _, count in self.iteritems())
+
+    def items(self):
+        return list(self.iteritems())
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return self._counts.tolist()
+
+    def get(self, key, default=None):
+        # Other keys (e.g., the remainder bucket, see truncation) are never packed.
+        if type(key) is not tuple or len(key) != self._keys.shape[1]:
+            return default
+        if None == self._table:
+            self._table = dict(self.iteritems())
+        return self._table.get(key, default)
+
+    def __getitem__(self, key):
+        count = self.get(key, self)
+        if count is self:
+            raise KeyError(key)
+        return count
+
+    def __contains__(self, key):
+        return self.get(key, self) is not self
+
+    def __iter__(self):
+        return self.iterkeys()
+
+    def __len__(self):
+        return len(self._counts)
+
+    def __nonzero__(self):
+        return 0 != len(self)
+
+    def __eq__(self, other):
+        return dict(self.iteritems()) == dict(other.iteritems())
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __getstate__(self):
+        return (self._keys, self._counts)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+def pack(counts):
+    '''
+    Returns the given count table as a PackedCounts, if its keys are tuples of
+    integers of equal length and its counts are integers of at most 64 bits.
+    Otherwise, returns the table itself.
+
+    >>> pack({(0,): 1.5})
+    {(0,): 1.5}
+    '''
+    if not isinstance(counts, dict) or not counts:
+        return counts
+    if not all(isinstance(count, (int, long)) for count in counts.itervalues()):
+        return counts
+    if not all(type(key) is tuple and all(isinstance(i, (int, long)) for i in key) for key in counts):
+        return counts
+    try:
+        keys = numpy.array(counts.keys(), dtype=numpy.int64)
+        values = numpy.array(counts.values(), dtype=numpy.int64)
+    except (ValueError, OverflowError):
+        # Keys of different lengths, or integers that are too large.
+        return counts
+    if 2 != keys.ndim:
+        return counts
+    return PackedCounts(keys, values)
+
+
+class StoredCounts(object):
+    '''
+    Wraps a count table that is to be saved (e.g., by cache.fetchable).  The
+    runs of a spilled table are copied to the run store (see MergedCounts.store()),
+    and only their paths are pickled, so that the table is not built in
+    memory.  Tables held in memory are pickled as they are.  Unpickling
+    returns the table itself.
+    '''
+
+    def __init__(self, counts):
+        self._counts = counts
+
+    def __reduce__(self):
+        if isinstance(self._counts, MergedCounts):
+            return (_stored_counts, (self._counts.store(),))
+        return (_stored_counts, (self._counts,))
+
+def _stored_counts(counts):
+    return counts
+
+def _file_digest(path):
+    md5 = hashlib.md5()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), ''):
+            md5.update(chunk)
+    return md5.hexdigest()
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,100 @@
+'''
+Counting with an error budget.
+
+Counting a component to order kGood is expensive, and often unnecessary.  If
+the probability of more than k faults is already below the required precision
+at every noise strength of interest, then counting orders above k cannot change
+the resulting bounds meaningfully.  count_to_budget() finds the smallest such k
+and counts the component to order k only.
+'''
+from qfault.counting import probability
+import logging
+
+logger = logging.getLogger('counting.budget')
+
+__all__ = ['BudgetedResult', 'count_to_budget']
+
+
+class BudgetedResult(object):
+    '''
+    The result of count_to_budget().
+
+    :ivar result: The CountResult, containing orders 0 through k.
+    :ivar k: The largest fault order counted (i.e., the effective kGood).
+    :ivar converged: True if the tail bound met the budget, False if counting
+                     stopped at kMax instead.
+    :ivar contributions: The contribution of each order to the failure probability,
+                         maximized over the noise range.
+    :ivar tail: An upper bound on the probability of more than k faults,
+                maximized over the noise range.
+    '''
+
+    def __init__(self, result, k, converged, contributions, tail):
+        self.result = result
+        self.k = k
+        self.converged = converged
+        self.contributions = contributions
+        self.tail = tail
+
+    def __repr__(self):
+        return 'BudgetedResult(k={0}, converged={1}, tail={2})'.format(self.k, self.converged, self.tail)
+
+
+def count_to_budget(component, noiseModels, pauli, budget, gammas, inputResult=None, kMax=None):
+    '''
+    Counts the component up to the smallest fault order k for which the
+    probability of more than k faults is at most budget, at each of the given
+    noise strengths.  Higher orders could change the failure probability by no
+    more than that.
+
+    The bound (see probability.pr_at_least_k_failures()) depends only on the
+    locations of the component, so k is found before counting, and the
+    component is counted once.  Sub-components must have a kGood of at least
+    kMax for the counts to be complete up to the order that is reached.
+
+    The tail bound covers the locations of the component only.  Faults carried
+    in by inputResult are not included, so when an input is given, budget should
+    allow for the probability of more than k input faults as well.
+
+    :param component: The component to count.
+    :param dict noiseModels: A dictionary, indexed by Pauli error, of noise models.
+    :param pauli: The error type to count.
+    :param budget: The largest acceptable contribution of the orders that are not counted.
+    :param gammas: The noise strengths (e.g., the ends of the noise range) at which to
+                   evaluate the bounds.
+    :param inputResult: (optional) The input to the component.
+    :param int kMax: (optional) The largest order to count.  Default is component.kGood[pauli].
+    :rtype: :class:`BudgetedResult`
+    '''
+    if None == kMax:
+        kMax = component.kGood[pauli]
+
+    noise = noiseModels[pauli]
+    locations = component.locations(pauli)
+
+    for k in range(kMax + 1):
+        tail = _max_over(probability.pr_at_least_k_failures(k+1, locations, noise), gammas)
+        logger.info('%s: Pr[K > %s] <= %s', component, k, tail)
+        if tail <= budget:
+            logger.info('%s: reached budget %s at k=%s', component, budget, k)
+            converged = True
+            break
+    else:
+        logger.warning('%s: budget %s not reached by k=%s (tail=%s)', component, budget, kMax, tail)
+        converged = False
+
+    result = component.count(noiseModels, pauli, inputResult, k)
+
+    # The contribution of each order alone.
+    contributions = []
+    for j, countsJ in enumerate(result.counts):
+        counts = [{}] * j + [countsJ]
+        contributions.append(_max_over(probability.counts_as_poly(counts, locations, noise), gammas))
+
+    return BudgetedResult(result, k, converged, contributions, tail)
+
+def _max_over(pr, gammas):
+    # Probabilities may be constants (e.g., there are fewer than k locations).
+    if not callable(pr):
+        return pr
+    return max(pr(gamma) for gamma in gammas)
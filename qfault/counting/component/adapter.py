@@ -17,6 +17,8 @@ class IdealDecoder(Filter):
     '''
     An ideal decoder.
     Input syndrome keys are decoded to syndrome keys for the trivial code.
+    The remainder bucket of truncated counts is not decoded, i.e., it
+    is treated as a possible logical error (see truncation).
     TODO: should the keys be decoded directly to Paulis?
     '''
     
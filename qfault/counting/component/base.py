@@ -10,25 +10,27 @@ etc., and a few simple concrete classes such as Empty, and Prep.
 
 @author: adam
 '''
-from copy import copy
 from qfault.circuit.block import Block
 from qfault.circuit.location import Locations
-from qfault.counting import probability
+from qfault.counting import probability, truncation
 from qfault.counting.convolve import convolve_dict_tuples, convolve_counts
-from qfault.counting.count_locations import map_counts, count_errors_of_order_k
+from qfault.counting.count_locations import count_errors_of_order_k
 from qfault.counting.key import KeyManipulator, SyndromeKeyGenerator, \
-    IdentityManipulator, KeyMerger
-from qfault.counting.result import CountResult
+    IdentityManipulator, KeyMerger, block_permutation
+from qfault.counting.result import CountResult, CountResultBuilder
 from qfault.qec.error import Pauli
 from qfault.qec.qecc import ConcatenatedCode
-from qfault.util import listutils
-from qfault.util.cache import fetchable, memoize
+from qfault.util import cache
+from qfault.util.cache import fetchable, fetchableOrders, memoize
+from qfault.util.profiling import profiled
+from qfault.util import trace
 from qfault.util.polynomial import SymPolyWrapper, sympoly1d
 import hashlib
 import logging
 import functools
 
 logger = logging.getLogger('counting.component')
+tracer = trace.get_tracer('counting.component')
 
 
 class Component(object):
@@ -71,7 +73,7 @@ class Component(object):
         
         self._id = hashlib.md5(self._hashStr())
         
-        self._log(logging.DEBUG, 'kGood={0}'.format(kGood))
+        self._log(logging.DEBUG, 'kGood=%s', kGood)
     
         
 #################
@@ -80,13 +82,15 @@ class Component(object):
 
 
     #@fetchable
-    def count(self, noiseModels, pauli, inputResult=None, kMax=None):
+    def count(self, noiseModels, pauli, inputResult=None, kMax=None, kMin=0):
         '''
         Counts errors in the component.
         Returns a CountResult. 
         
         :param dict noiseModels: A dictionary, indexed by Pauli error, of noise models.
         :param pauli: The error type to count.  Use Pauli.Y to count X and Z errors together.
+        :param int kMin: (optional) Orders below kMin are not needed by the caller.  Components
+                         may leave them empty, or count them anyway.
         '''
         
         # TODO: use a template method pattern, instead.
@@ -186,24 +190,30 @@ class Component(object):
         '''
         return self._subs
     
-    def propagateCounts(self, inputResult):
+    def estimated(self):
+        '''
+        Returns True if the counts of any countable sub-component were
+        seeded with estimates (see CountableComponent.seedOrders()).
+        '''
+        return any(sub.estimated() for sub in self.subcomponents())
+    
+    def propagateCounts(self, inputResult, drop_rejected=False):
         '''
         Propagates the given counts through the component.
         
-        :param dict counts: Counts indexed by [k][key][count]
-        :param keyMeta: The key metadata for counts.
-        :rtype tuple: The propagated counts and corresponding key metadata
+        :param inputResult: The counts to propagate.
+        :param bool drop_rejected: (optional) Remove counts rejected by the propagator.
+        :rtype: :class:`CountResult`
         '''
         propagator = self.keyPropagator()
         # TODO: could/should verify that the inputResult blocks match the
         # expected input blocks.
-        propagated = map_counts(inputResult.counts, propagator)
         
         # Blocks in the input space of the component are converted to the output space.
         # Other input blocks are unchanged.
         blocks = self.outBlocks() + tuple(inputResult.blocks[len(self.inBlocks()):])
                 
-        return CountResult(propagated, blocks)
+        return inputResult.map_keys(propagator, blocks, drop_rejected)
     
     def keyPropagator(self, subPropagator=IdentityManipulator()):
         '''
@@ -222,9 +232,22 @@ class Component(object):
     def __getitem__(self, name):
         return self._subs[name]
         
+    def _checkExact(self):
+        # Counts are fetched and saved as exact counts, so counting with
+        # estimates is refused while fetching is enabled.  This is checked
+        # before counting, since fetched results skip the sub-components.
+        if cache.fetchEnabled and self.estimated():
+            raise RuntimeError('Estimated counts of {0} would be saved as exact counts.  '
+                               'Disable fetching or clear the seeds.'.format(self))
+        
     def _log(self, level, msg, *args, **kwargs):
         classname = self.__class__.__name__
         logger.log(level, ''.join([classname, ': ', msg]), *args, **kwargs)
+        
+    def _trace(self, msg, *args):
+        # Callers should test tracer.enabled first.
+        classname = self.__class__.__name__
+        tracer.event(''.join([classname, ': ', msg]), *args)
     
     def descriptor(self):
         rep = str(self.__class__.__name__)
@@ -239,7 +262,13 @@ class Component(object):
         return self.__repr__()
     
     def __repr__(self):
-        return ''.join([self.descriptor(), '.', self.identifier().hexdigest()])
+        # The representation identifies the component in memo and fetch keys.
+        # Counts depend on the truncation policy, so the policy is included.
+        rep = ''.join([self.descriptor(), '.', self.identifier().hexdigest()])
+        policy = truncation.truncation_policy()
+        if None != policy:
+            rep += '.' + repr(policy)
+        return rep
     
 class CountableComponent(Component):
     '''
@@ -254,45 +283,100 @@ class CountableComponent(Component):
         self._locations = locations
         self._location_block_order = tuple(locations.blocknames())
         
+        # Counts supplied by seedOrders(), and whether they are exact, for
+        # each noise model and Pauli.
+        self._seeded = {}
+        
         super(CountableComponent, self).__init__(kGood)
 
-    def count(self, noiseModels, pauli, inputResult=None, kMax=None):        
-        result = self._count(noiseModels, pauli)
+    @profiled
+    def count(self, noiseModels, pauli, inputResult=None, kMax=None, kMin=0):        
+        # Orders above kMax cannot contribute to the result, so they are
+        # not counted.
+        kCount = self.kGood[pauli]
+        if None != kMax:
+            kCount = min(kCount, kMax)
+            
+        self._checkExact()
+            
+        # The cached counts are never truncated, so that they do not
+        # depend on the truncation policy.
+        policy = truncation.truncation_policy()
+        result = self._count(noiseModels, pauli, kCount).truncate(policy)
         
         if None == inputResult:
             return result
         
-        # Avoid altering caller's data.
-        inputResult = copy(inputResult)
         inputResult = self.propagateCounts(inputResult)
         # TODO: more robust way of getting key lengths?
         keyLengths = [len(SyndromeKeyGenerator(block.get_code()).parityChecks()) for block in result.blocks]
         inKeyLengths = [len(SyndromeKeyGenerator(block.get_code()).parityChecks()) for block in inputResult.blocks]
         convolve = functools.partial(convolve_dict_tuples, inKeyLengths, keyLengths)
-        result.counts = convolve_counts(inputResult.counts, 
-                                        result.counts, 
-                                        k_max=kMax, 
-                                        convolve_fcn=convolve)
-        
-        result.blocks = inputResult.blocks
-        
-        return result
+        counts = convolve_counts(inputResult.counts, 
+                                 result.counts, 
+                                 k_max=kMax, 
+                                 convolve_fcn=convolve,
+                                 k_min=kMin)
+        
+        return CountResult(counts, inputResult.blocks).truncate(policy)
+    
+    @fetchableOrders
+    def _count(self, noiseModels, pauli, kMax, previous=None):
+        # Count the internal locations.  Orders that have already been
+        # counted, by an equivalent component whose counts were fetched, or
+        # elsewhere (see seedOrders()), are reused.
+        seeded, _ = self._seeded.get((str(noiseModels), pauli), (None, True))
+        if None != seeded and len(seeded) > kMax:
+            return seeded.up_to(kMax)
+        if None == previous or (None != seeded and len(seeded) > len(previous)):
+            previous = seeded
+            
+        counts = []
+        if None != previous:
+            counts = list(previous.counts)
+        counts += [self._countOrder(noiseModels, pauli, k) for k in range(len(counts), kMax + 1)]
+        return CountResult(counts, self.outBlocks())
     
-    @fetchable
-    def _count(self, noiseModels, pauli):
-        # Count the internal locations.
-        locations = self.locations(pauli)
-        blocks = self.outBlocks()
+    def _countOrder(self, noiseModels, pauli, k):
+        '''
+        Counts the internal locations for exactly k faults.
+        '''
+        return count_errors_of_order_k(*self.orderArguments(noiseModels, pauli, k))
+    
+    def orderArguments(self, noiseModels, pauli, k):
+        '''
+        Returns the arguments of count_errors_of_order_k() for counting the
+        internal locations for exactly k faults.  The arguments can be pickled,
+        so that orders may be counted in another process (see sweep).
+        '''
         key_generators = [SyndromeKeyGenerator(block.get_code())
-                          for block in blocks]
-        counts = [count_errors_of_order_k(k, 
-                                          locations, 
-                                          noiseModels[pauli],
-                                          self._location_block_order, 
-                                          key_generators)
-                  for k in range(self.kGood[pauli] + 1)]
-        
-        return CountResult(counts, blocks)
+                          for block in self.outBlocks()]
+        return (k, 
+                self.locations(pauli), 
+                noiseModels[pauli],
+                self._location_block_order, 
+                key_generators)
+    
+    def seedOrders(self, noiseModels, pauli, counts, exact=True):
+        '''
+        Supplies counts that were computed elsewhere.  counts[k] is the
+        count for exactly k faults, as returned by _countOrder().  The counts
+        are held until clearSeeds() is called.
+        
+        Counts that are not exact (e.g., sampled estimates) are never saved,
+        so counting with them fails while fetching is enabled.
+        '''
+        self._seeded[(str(noiseModels), pauli)] = (CountResult(list(counts), self.outBlocks()), exact)
+        
+    def clearSeeds(self):
+        '''
+        Discards the counts supplied by seedOrders().
+        '''
+        self._seeded.clear()
+        
+    def estimated(self):
+        return any(not exact for _, exact in self._seeded.values()) or \
+            super(CountableComponent, self).estimated()
                 
     def locations(self, pauli=Pauli.Y):
         # Eliminate locations that won't produce errors of the specified Pauli
@@ -308,31 +392,67 @@ class CountableComponent(Component):
     def _hashStr(self):
         return super(CountableComponent, self)._hashStr() + str(self._locations.list)
     
+    def _cacheName(self):
+        # The counts for each order do not depend on kGood, so
+        # the cached counts can be shared by components with different kGood.
+        blocks = str(self.outBlocks()) + str(self._location_block_order)
+        name = hashlib.md5(blocks + str(self._locations.list))
+        return self.__class__.__name__ + '.' + name.hexdigest()
+    
     
 class CompositeComponent(Component):
     
-    @fetchable
-    def count(self, noiseModels, pauli, inputResult=None, kMax=None):
+    @profiled
+    def count(self, noiseModels, pauli, inputResult=None, kMax=None, kMin=0):
         '''
         Counts errors in the component.
         Returns a CountResult. 
         
         :param dict noiseModels: A dictionary, indexed by Pauli error, of noise models.
         :param pauli: The error type to count.  Use Pauli.Y to count X and Z errors together.
+        :param int kMin: (optional) Orders below kMin are left empty.  Such results are not cached.
         '''
+        self._checkExact()
         
         if None == inputResult:
             inputs = tuple([0]*len(self.inBlocks()))
             inputCounts = [{inputs: 1}]
             inputResult = CountResult(inputCounts, self.inBlocks())
             
-        k_in = len(inputResult.counts) - 1
-        k_lim = self.kGood[pauli] + k_in
+        k_lim = self.kGood[pauli] + len(inputResult) - 1
         if None != kMax:
             k_lim = min(k_lim, kMax)
             
+        if 0 < kMin:
+            return self._countOrders(noiseModels, pauli, inputResult, k_lim, kMin)
+        return self._countTo(noiseModels, pauli, inputResult, k_lim)
+    
+    @fetchableOrders
+    def _countTo(self, noiseModels, pauli, inputResult, k_lim, previous=None):
+        '''
+        Counts errors in the component up to order k_lim.  Cached results for
+        a larger k_lim are truncated.  A cached result for a smaller k_lim
+        (previous) is extended by counting only the orders that it lacks.
+        The intermediate results of the sub-components are still counted in
+        full, but the last convolution of each chain skips the orders of
+        previous, and the sub-components extend their own cached results.
+        '''
+        if None == previous:
+            return self._countOrders(noiseModels, pauli, inputResult, k_lim)
+        
+        kMin = len(previous)
+        result = self._countOrders(noiseModels, pauli, inputResult, k_lim, kMin)
+        return CountResult(list(previous.counts) + list(result.counts[kMin:]), previous.blocks)
+    
+    def _countOrders(self, noiseModels, pauli, inputResult, k_lim, kMin=0):
+        '''
+        Counts errors in the component up to order k_lim.  Orders below kMin
+        may be left empty.
+        '''
+        k_in = len(inputResult) - 1
+            
         try:
-            self._log(logging.INFO, 'Counting: ' + str(pauli) + ' k=' + str(kMax))
+            self._log(logging.INFO, 'Counting: %s k=%s', pauli, k_lim)
             
 #            if not self.ValidateResult(inputResult):
 #                raise RuntimeError('Invalid input result')
@@ -346,25 +466,26 @@ class CompositeComponent(Component):
             # counted up to the correct fault order (no overcounting).
             
             # TODO: optimize
-            results = []
+            builder = CountResultBuilder(k_lim+1)
             for k in range(min(k_lim, k_in) + 1):
                 counts = [inputResult.counts[k]]
                 result = CountResult(counts, inputResult.blocks)
                 
-                result = self._countInputOrderZero(noiseModels, pauli, result, max(k_lim-k, 0))
-                    
-                result.counts = [{} for _ in range(k)] + result.counts + [{} for _ in range(k_lim+1 - len(result.counts) - k)]
-                results.append(result)
+                result = self._countInputOrderZero(noiseModels, pauli, result, max(k_lim-k, 0), max(kMin-k, 0))
+                
+                builder.add_counts(result.counts, shift=k)
+                builder.blocks = result.blocks
     
-            resultCounts = [listutils.addDicts(*[r.counts[k] for r in results]) for k in range(k_lim+1)]
-            result = CountResult(resultCounts, results[0].blocks)
+            result = builder.build()
             
-            self._log(logging.DEBUG, 'counts=%s', result.counts)        
+            if tracer.enabled:
+                self._trace('counts=%s', result.counts)
         except:
             self._log(logging.ERROR, 'Error while counting')
             raise
 
-        self._log(logging.DEBUG, "result={0}".format(result))
+        if tracer.enabled:
+            self._trace('result=%s', result)
         
 #        expNumBlocks = len(self.outBlocks()) - len(self.inBlocks()) + nblocksIn
 #        self._log(logging.INFO, "expected={0}".format(expNumBlocks))
@@ -372,12 +493,24 @@ class CompositeComponent(Component):
 #            raise RuntimeError('Invalid output result')
         return result
     
-    def _countInputOrderZero(self, noiseModels, pauli, inputResult, kMax):
+    def _countInputOrderZero(self, noiseModels, pauli, inputResult, kMax, kMin=0):
         '''
         Count the sub-components with an input that has only order-zero counts.
+        Orders below kMin may be left empty.
         '''
         raise NotImplementedError
     
+    def _lastFaulty(self):
+        '''
+        Returns the index of the last sub-component that may add faults.  The
+        sub-components that follow it (filters) preserve the order of each count.
+        '''
+        subs = self.subcomponents()
+        for i in reversed(range(len(subs))):
+            if not isinstance(subs[i], (Filter, Empty)):
+                return i
+        return 0
+    
 class SequentialComponent(CompositeComponent):
     '''
     A component for which sub-components are ordered sequentially in time.
@@ -414,6 +547,7 @@ class SequentialComponent(CompositeComponent):
         return self[-1].outBlocks()
     
     @fetchable
+    @profiled
     def prAccept(self, noiseModels, inputResult=None, kMax=None):
         pr_accept = super(SequentialComponent, self).prAccept(noiseModels)
         
@@ -423,7 +557,7 @@ class SequentialComponent(CompositeComponent):
             inputResult = CountResult(inputCounts, self.inBlocks())
             
             
-        k_lim = self.kGood[Pauli.Y] + len(inputResult.counts) - 1
+        k_lim = self.kGood[Pauli.Y] + len(inputResult) - 1
         if None != kMax:
             k_lim = min(k_lim, kMax)
             
@@ -435,15 +569,22 @@ class SequentialComponent(CompositeComponent):
             result = sub.count(noiseModels, Pauli.Y, result, k_lim)
         return pr_accept
     
-    def _countInputOrderZero(self, noiseModels, pauli, inputResult, kMax):
+    def _countInputOrderZero(self, noiseModels, pauli, inputResult, kMax, kMin=0):
         kMaxSub = min(self.kGood[pauli], kMax)
+        last = self._lastFaulty()
         result = inputResult
-        for sub in self.subcomponents():
+        for i, sub in enumerate(self.subcomponents()):
             subNBlocksIn = len(result.blocks)
             subExpNumBlocks = len(sub.outBlocks()) - len(sub.inBlocks()) + subNBlocksIn 
                 
-            result = sub.count(noiseModels, pauli, result, kMaxSub)
-            self._log(logging.DEBUG, "sub {0} result={1}".format(sub, result))
+            # Only the last sub-component that adds faults may skip the
+            # orders below kMin.  The others contribute to every order.
+            if last == i:
+                result = sub.count(noiseModels, pauli, result, kMaxSub, kMin)
+            else:
+                result = sub.count(noiseModels, pauli, result, kMaxSub)
+            if tracer.enabled:
+                self._trace('sub %s result=%s', sub, result)
             
             if not result.is_valid(subExpNumBlocks):
                 raise RuntimeError('Invalid output result for sub {0}'.format(sub))
@@ -527,7 +668,8 @@ class Empty(Component):
     def inBlocks(self):
         return (self._block,)
     
-    def count(self, noiseModels, pauli, inputResult=None, kMax=None):
+    @profiled
+    def count(self, noiseModels, pauli, inputResult=None, kMax=None, kMin=0):
         if None == inputResult:
             inputs = tuple([0]*len(self.inBlocks()))
             inputCounts = [{inputs: 1}]
@@ -561,10 +703,12 @@ class Filter(Component):
     def __init__(self):
         super(Filter, self).__init__({})
         
-    def count(self, noiseModels=None, pauli=None, inputResult=None, kMax=None):
+    @profiled
+    def count(self, noiseModels=None, pauli=None, inputResult=None, kMax=None, kMin=0):
         self._log(logging.INFO, "Filtering")
         result = self.propagateCounts(inputResult)
-        self._log(logging.DEBUG, "Filter result: {0}".format(result))
+        if tracer.enabled:
+            self._trace('Filter result: %s', result)
         return result
 
     def keyPropagator(self, subPropagator=IdentityManipulator()):
@@ -583,15 +727,18 @@ class PostselectionFilter(Filter):
         super(PostselectionFilter, self).__init__()
         self._pauliDependency = pauliDependency
 
-    def count(self, noiseModels, pauli, inputResult=None, kMax=None):
-        result = super(PostselectionFilter, self).count(noiseModels, pauli, inputResult, kMax)
+    @profiled
+    def count(self, noiseModels, pauli, inputResult=None, kMax=None, kMin=0):
+        self._log(logging.INFO, "Filtering")
         
-        # Remove the rejected counts
-        for count in result.counts:
-            count.pop(None, None)
-            
+        # Remove the rejected counts as they are propagated.  The remainder
+        # bucket of truncated counts may contain accepted keys, so it is kept.
+        result = self.propagateCounts(inputResult, drop_rejected=True)
+        if tracer.enabled:
+            self._trace('Filter result: %s', result)
         return result
 
+    @profiled
     def prAccept(self, noiseModels, inputResult, kMax):
         '''
         Computes a lower bound on the acceptance probability using upper bounds on the
@@ -606,12 +753,16 @@ class PostselectionFilter(Filter):
     
         propagated = self.propagateCounts(inputResult)
         
-        rejected = [{None: count.get(None, 0)} for count in propagated.counts]
+        # The remainder bucket of truncated counts may contain rejected keys.
+        rejected = [{None: count.get(None, 0) + count.get(truncation.REMAINDER, 0)} 
+                    for count in propagated.counts]
         
         prBad = self.prBad(noiseModels[pauli], pauli, kMax)
-        locTotals = self.locations(pauli).getTotals()
         
-        prAccept = 1 - probability.upperBoundPoly(rejected, prBad, locTotals, noiseModels[pauli])
+        # The filter has no locations of its own.  Omitting the prefactor
+        # for the locations of the input makes the bound only larger.
+        prRejected = probability.counts_as_poly(rejected, self.locations(pauli), noiseModels[pauli])
+        prAccept = 1 - (prRejected + prBad)
         self._log(logging.DEBUG, 'Pr[accept] = %s', prAccept)
         
         return prAccept# * prSubs
@@ -702,45 +853,32 @@ class ParallelComponent(CompositeComponent):
 #        
 #        return result
         
-    @fetchable
-    def count(self, noiseModels, pauli, inputResult=None, kMax=None):
-
+    def _countOrders(self, noiseModels, pauli, inputResult, k, kMin=0):
         # The idea here is to count each of the sub-components sequentially, but
         # permuting the input blocks at each step.
-            
-        if None == inputResult:
-            inputs = tuple([0]*len(self.inBlocks()))
-            inputCounts = [{inputs: 1}]
-            inputResult = CountResult(inputCounts, self.inBlocks())
-            
-        k = self.kGood[pauli] + len(inputResult.counts) - 1
-        if None != kMax:
-            k = min(k, kMax)
         
-        result = copy(inputResult)
+        result = inputResult
         
         if not inputResult.is_valid():
             raise RuntimeError('Invalid input result')
         
-        for sub in self:
-            result = sub.count(noiseModels, pauli, result, k)
-            self._log(logging.DEBUG, "sub {0} result={1}".format(sub, result))
-            if 0 == len(result.counts):
-                print 'foo?'
+        last = self._lastFaulty()
+        for i, sub in enumerate(self):
+            if last == i:
+                result = sub.count(noiseModels, pauli, result, k, kMin)
+            else:
+                result = sub.count(noiseModels, pauli, result, k)
+            if tracer.enabled:
+                self._trace('sub %s result=%s', sub, result)
             
             # Shift the input blocks for the next component into place.
-            rotator = self.TupleRotator(len(sub.outBlocks()))
-            result.counts = map_counts(result.counts, rotator)
-            result.blocks = rotator(result.blocks)
+            # Only the block order is updated here; the keys are reordered
+            # by the next sub-component as they are propagated.
+            result = result.rotate(len(sub.outBlocks()))
             
         # It is possible that the inputResult space is larger than the output space
         # of the parallel component.
-        rotator = self.TupleRotator(-len(self.outBlocks()))
-        result.counts = map_counts(result.counts, rotator)
-        result.blocks = rotator(result.blocks)
-        
-        if 0 == len(result.counts):
-            print 'foo?'
+        result = result.rotate(-len(self.outBlocks()))
             
 #        expNumBlocks = len(self.outBlocks()) - len(self.inBlocks()) + len(inputResult.blocks)
 #        if not self.ValidateResult(result, expNumBlocks):
@@ -748,6 +886,7 @@ class ParallelComponent(CompositeComponent):
         return result
     
     @fetchable
+    @profiled
     def prAccept(self, noiseModels, inputResult=None, kMax=None):
         pr_accept = super(ParallelComponent, self).prAccept(noiseModels)
         
@@ -756,7 +895,7 @@ class ParallelComponent(CompositeComponent):
             inputCounts = [{inputs: 1}]
             inputResult = CountResult(inputCounts, self.inBlocks())
             
-        k_lim = self.kGood[Pauli.Y] + len(inputResult.counts) - 1
+        k_lim = self.kGood[Pauli.Y] + len(inputResult) - 1
         if None != kMax:
             k_lim = min(k_lim, kMax)
         
@@ -766,9 +905,7 @@ class ParallelComponent(CompositeComponent):
             result = sub.count(noiseModels, Pauli.Y, result, k_lim)
             
             # Shift the input blocks for the next component into place.
-            rotator = self.TupleRotator(len(sub.outBlocks()))
-            result.counts = mapCounts(result.counts, rotator)
-            result.blocks = rotator(result.blocks)
+            result = result.rotate(len(sub.outBlocks()))
             
         return pr_accept
     
@@ -788,6 +925,12 @@ class ParallelComponent(CompositeComponent):
         def _manipulate(self, tup):
             return tup[self.rotation:] + tup[:self.rotation]
         
+        def block_permutation(self, nblocks):
+            inner = block_permutation(self._manipulator, nblocks)
+            if None == inner:
+                return None
+            return self._manipulate(inner)
+        
 
     
     
\ No newline at end of file
@@ -6,7 +6,6 @@ Rectangle and Extended Rectangle components.
 @author: adam
 '''
 from qfault.counting.component.base import SequentialComponent
-from qfault.util.cache import fetchable
 
 class ExRec(SequentialComponent):
     
@@ -14,17 +13,8 @@ class ExRec(SequentialComponent):
         subs = (lec, gadget, tec)
         super(ExRec, self).__init__(kGood, subcomponents=subs)
         
-    @fetchable
-    def count(self, noiseModels, pauli, inputResult=None, kMax=None):
-        return super(ExRec, self).count(noiseModels, pauli, inputResult, kMax)                    
-        
 class Rectangle(SequentialComponent):
     
     def __init__(self, kGood, lec, gadget):
         subs = (lec, gadget)
         super(Rectangle, self).__init__(kGood, subcomponents=subs)
-        
-    @fetchable
-    def count(self, noiseModels, pauli, inputResult=None, kMax=None):
-        return super(Rectangle, self).count(noiseModels, pauli, inputResult, kMax)                    
-    
\ No newline at end of file
@@ -5,21 +5,20 @@ Teleportation-based components.
 
 @author: adam
 '''
-from copy import copy
 from qfault.circuit.block import Block
 from qfault.counting import key
 from qfault.counting.component.base import PostselectionFilter, Empty, \
-    ParallelComponent, SequentialComponent
+    ParallelComponent, SequentialComponent, tracer
 from qfault.counting.component.block import BlockDiscard, BlockInsert
 from qfault.counting.component.transversal import TransRest
 from qfault.counting.convolve import convolve_dict_tuples, convolve_counts
-from qfault.counting.count_locations import map_counts
 from qfault.counting.key import keyForBlock, KeyExtender, KeyManipulator, \
     KeyCopier, IdentityManipulator, SyndromeKeyGenerator, KeyRemover
-from qfault.counting.result import TrivialResult
+from qfault.counting.result import CountResult, TrivialResult
 from qfault.qec.error import xType, zType, Pauli
 from qfault.util import bits
 from qfault.util.cache import memoize
+from qfault.util.profiling import profiled
 import functools
 import logging
 
@@ -74,7 +73,8 @@ class TeleportWithMeas(SequentialComponent):
     def inBlocks(self):
         return (self.subcomponents()[1].inBlocks()[0],)
     
-    def count(self, noiseModels, pauli, inputResult=None, kMax=None):
+    @profiled
+    def count(self, noiseModels, pauli, inputResult=None, kMax=None, kMin=0):
         # First, extend the input to all three blocks.
         # TODO: there are two input extension functions.  This is because there seems to be a problem
         # when trying to propagate the input through the Bell Pair (which is only necessary when using
@@ -95,7 +95,8 @@ class TeleportWithMeas(SequentialComponent):
         # Now count normally.
         result = self._countInternal(noiseModels, pauli, kMax)
         
-        self._log(logging.DEBUG, "internal result: {0}".format(result))
+        if tracer.enabled:
+            self._trace('internal result: %s', result)
   
         
         # TODO: this pattern of memoizing some internal result and then convolving is
@@ -103,26 +104,29 @@ class TeleportWithMeas(SequentialComponent):
         # TODO: more robust way of getting key lengths?
         keyLengths = [len(SyndromeKeyGenerator(block.get_code()).parityChecks()) for block in result.blocks]
         inKeyLengths = [len(SyndromeKeyGenerator(block.get_code()).parityChecks()) for block in extendedInput.blocks]
-        self._log(logging.DEBUG, "keyLengths={0}, inKeyLengths={1}".format(keyLengths, inKeyLengths))
+        self._log(logging.DEBUG, 'keyLengths=%s, inKeyLengths=%s', keyLengths, inKeyLengths)
         convolve = functools.partial(convolve_dict_tuples, inKeyLengths, keyLengths)
-        result.counts = convolve_counts(extendedInput.counts, 
-                                        result.counts, 
-                                        k_max=kMax, 
-                                        convolve_fcn=convolve)
+        counts = convolve_counts(extendedInput.counts, 
+                                 result.counts, 
+                                 k_max=kMax, 
+                                 convolve_fcn=convolve)
+        result = CountResult(counts, extendedInput.blocks)
         
-        self._log(logging.DEBUG, "result before corrections: {0}".format(result))
+        if tracer.enabled:
+            self._trace('result before corrections: %s', result)
         
         # Finally, make the logical corrections necessary for teleportation.
         inBlock = self.inBlocks()[0]
         code = inBlock.get_code()
         corrector = self._corrector(code)
-        result.counts = map_counts(result.counts, corrector)
-        result.blocks = extendedInput.blocks
+        result = result.map_keys(corrector)
         
-        self._log(logging.DEBUG, "result after corrections: {0}".format(result))
+        if tracer.enabled:
+            self._trace('result after corrections: %s', result)
         
         return result
     
+    @profiled
     def prAccept(self, noiseModels, inputResult=None, kMax=None):
         # The Bell-pair preparation may be non-deterministic, but we don't
         # expect the Bell measurement to be non-deterministic.
@@ -247,6 +251,7 @@ class TeleportED(SequentialComponent):
 #        self.inBlocks = teleport.inBlocks
 #        self.outBlocks = edFilter.outBlocks
         
+    @profiled
     def prAccept(self, noiseModels, inputResult, kMax):
         inputResult = self[0].count(noiseModels, Pauli.Y, inputResult, kMax)
         return self[1].prAccept(noiseModels, inputResult, kMax)
@@ -365,7 +370,8 @@ class EDInputFilter(SequentialComponent):
     def outBlocks(self):
         return self.inBlocks()
         
-    def count(self, noiseModels, pauli, inputResult=None, kMax=None):
+    @profiled
+    def count(self, noiseModels, pauli, inputResult=None, kMax=None, kMin=0):
         ed = self[0]
         numBlocks = len(ed.inBlocks())
         
@@ -375,17 +381,14 @@ class EDInputFilter(SequentialComponent):
         copier = KeyExtender(IdentityManipulator(), numBlocks, numBlocks)
         for block in range(numBlocks):
             copier = KeyCopier(copier, block, block+numBlocks)
-        extendedInput = copy(inputResult)
-        extendedInput.counts = map_counts(inputResult.counts, copier)
-        extendedInput.blocks = inputResult.blocks[:numBlocks] + inputResult.blocks
+        extendedInput = inputResult.map_keys(copier, inputResult.blocks[:numBlocks] + inputResult.blocks)
         
-        result = super(EDInputFilter, self).count(noiseModels, pauli, extendedInput, kMax)
+        result = super(EDInputFilter, self).count(noiseModels, pauli, extendedInput, kMax, kMin)
         
         # Now remove the output blocks of the ED.  We only want to keep the original
         # input.
         numBlocks = len(ed.outBlocks())
         remover = KeyRemover(IdentityManipulator(), range(numBlocks))
-        result.counts = map_counts(result.counts, remover)
-        result.blocks = result.blocks[numBlocks:]
+        result = result.map_keys(remover, result.blocks[numBlocks:])
         
         return result
\ No newline at end of file
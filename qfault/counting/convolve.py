@@ -3,14 +3,50 @@ Created on 2011-10-23
 
 @author: adam
 '''
-from qfault.counting import count_locations
-from qfault.util import bits
+from qfault.counting import aggregate, count_locations, truncation
+from qfault.util import bits, concurrency, profiling, trace
 from qfault.util.concurrency import mapreduce_concurrent
 from qfault.util.iteration import PartitionIterator
 import logging
+import numpy
 import operator
 
 logger = logging.getLogger('counting.convolve')
+tracer = trace.get_tracer('counting.convolve')
+
+_backend = 'sparse'
+
+# The dense backend allocates arrays of 2**bits entries.
+_DENSE_MAX_BITS = 22
+
+# Dense convolution is done with 64-bit integers.  Larger totals are
+# convolved sparsely to avoid overflow.
+_DENSE_MAX_COUNT = 2**62
+
+def set_convolution_backend(backend):
+    '''
+    Selects the algorithm used by convolve_dict_tuples().
+    
+    'sparse' (the default) combines every pair of keys.  'dense' stores one
+    of the tables as an array indexed by key, and combines each key of the
+    other table with the entire array at once.  The dense algorithm is
+    faster when the key space is small compared to the tables.  Tables
+    that do not fit the dense algorithm (large key spaces, non-integer or
+    very large counts) are always convolved sparsely.
+    
+    :param str backend: Either 'sparse' or 'dense'.
+    '''
+    global _backend
+    if backend not in ('sparse', 'dense'):
+        raise ValueError('Unknown convolution backend {0}'.format(backend))
+    _backend = backend
+    logger.info('Convolution backend: %s', backend)
+
+def convolution_backend():
+    '''
+    Returns the name of the current convolution backend.
+    '''
+    return _backend
 
 def convolve_dict(counts1, 
                   counts2, 
@@ -32,9 +68,22 @@ def convolve_dict(counts1,
     >>> b = {0: 1, 2: 3}
     >>> convolve_dict(a, b)
     {0: 1, 1: 2, 2: 3, 3: 6}
+    
+    If counts1 is not a dict (e.g., it is spilled to disk or packed, see
+    aggregate), counts2 is read in blocks that fit the memory budget, and
+    counts1 is read once for each block, rather than once for each key of counts2.
     '''
-    counts = {}
-    logger.debug('convolving dictionaries {0}x{1}'.format(len(counts2), len(counts1)))
+    counts = aggregate.new_counts()
+    if tracer.enabled:
+        tracer.event('convolving dictionaries %sx%s', len(counts2), len(counts1))
+    if not isinstance(counts1, dict):
+        for block2 in aggregate.iterblocks(counts2):
+            for key1, count1 in counts1.iteritems():
+                for key2, count2 in block2:
+                    key = keyOp(key1, key2)
+                    counts[key] = countAdd(counts.get(key, nullCount), countMul(count1, count2))
+        return aggregate.finalize(counts)
+    
     for key2, count2 in counts2.iteritems():
         for key1, count1 in counts1.iteritems():
             key = keyOp(key1, key2)
@@ -43,10 +92,45 @@ def convolve_dict(counts1,
             # of counts.get()
             counts[key] = countAdd(counts.get(key, nullCount), countMul(count1, count2))
     
-    return counts
+    return aggregate.finalize(counts)
 
 
+def convolve_dict_dense(counts1, counts2, nbits):
+    '''
+    Convolve counts from two dictionaries with integer keys of at most nbits
+    bits.  Keys are combined by XOR.  Equivalent to convolve_dict(counts1, counts2),
+    except that keys with a count of zero are omitted.  Falls back to
+    convolve_dict() for counts that are not (small enough) integers.
+    
+    >>> a = {0: 1, 1: 2}
+    >>> b = {0: 1, 2: 3}
+    >>> convolve_dict_dense(a, b, 2)
+    {0: 1, 1: 2, 2: 3, 3: 6}
+    '''
+    if len(counts1) > len(counts2):
+        counts1, counts2 = counts2, counts1
+        
+    integral = lambda counts: all(isinstance(c, (int, long)) for c in counts.itervalues())
+    if not (integral(counts1) and integral(counts2)) or \
+       sum(counts1.itervalues()) * sum(counts2.itervalues()) >= _DENSE_MAX_COUNT:
+        return convolve_dict(counts1, counts2)
+        
+    dense2 = numpy.zeros(1 << nbits, dtype=numpy.int64)
+    dense2[numpy.fromiter(counts2.iterkeys(), numpy.int64)] = numpy.fromiter(counts2.itervalues(), numpy.int64)
+    
+    indices = numpy.arange(1 << nbits, dtype=numpy.int64)
+    dense = numpy.zeros(1 << nbits, dtype=numpy.int64)
+    for key1, count1 in counts1.iteritems():
+        dense += count1 * dense2[indices ^ key1]
+        
+    keys = numpy.flatnonzero(dense)
+    return dict(zip(keys.tolist(), dense[keys].tolist()))
+
 class ConvolveCaller(object):
+    '''
+    Convolves order k1 of counts1 with order k2 of counts2.  The counts
+    may be given as Broadcast handles (see concurrency.broadcast()).
+    '''
     
     def __init__(self, counts1, counts2, convolve_fcn):
         self._counts1 = counts1
@@ -55,20 +139,43 @@ class ConvolveCaller(object):
         
     def __call__(self, k1k2):
         k1, k2 = k1k2
-        results = self._convolve_fcn(self._counts1[k1], self._counts2[k2])
-        return self._convolve_fcn(self._counts1[k1], self._counts2[k2])
+        counts1 = concurrency.broadcast_value(self._counts1)[k1]
+        counts2 = concurrency.broadcast_value(self._counts2)[k2]
+        counts1, remainder1 = truncation.split_remainder(counts1)
+        counts2, remainder2 = truncation.split_remainder(counts2)
+        counts = self._convolve_fcn(counts1, counts2)
+        if remainder1 or remainder2:
+            # The key of any combination involving a remainder bucket is unknown.
+            remainder = (remainder1 * sum(counts2.itervalues()) + 
+                         sum(counts1.itervalues()) * remainder2 + 
+                         remainder1 * remainder2)
+            counts = truncation.add_remainder(counts, remainder)
+        return counts
 
 def convolve_counts(counts1, 
                     counts2, 
                     k0_max=None, 
                     k1_max=None, 
                     k_max=None, 
-                    convolve_fcn=convolve_dict):
+                    convolve_fcn=convolve_dict,
+                    k_min=0):
     '''
     >>> counts1 = [{0: 1, 1: 2}, {0: 3, 2: 1}]
     >>> counts2 = [{0: 1, 2: 3}]
     >>> convolve_counts(counts1, counts2)
     [{0: 1, 1: 2, 2: 3, 3: 6}, {0: 6, 2: 10}]
+
+    Orders below k_min are not computed, and are left empty.
+
+    >>> convolve_counts(counts1, counts2, k_min=1)
+    [{}, {0: 6, 2: 10}]
+
+    Remainder buckets of truncated counts (see truncation) are convolved
+    conservatively.
+    
+    >>> from qfault.counting.truncation import REMAINDER
+    >>> convolve_counts([{0: 1, REMAINDER: 2}], [{0: 1, 1: 3}]) == [{0: 1, 1: 3, REMAINDER: 8}]
+    True
     '''
     
     if None == k0_max:
@@ -79,16 +186,30 @@ def convolve_counts(counts1,
         k_max = k0_max + k1_max
         
     k_max = min(k_max, len(counts1) + len(counts2) - 2)
+    
+    if profiling.enabled():
+        profiling.record('convolutions')
+        profiling.record('convolution_products', 
+                         sum(len(counts1[k1]) * len(counts2[k2])
+                             for k1 in range(min(k0_max, k_max, len(counts1)-1)+1)
+                             for k2 in range(max(k_min-k1, 0), min(k1_max, k_max-k1, len(counts2)-1)+1)))
 
-    # Distribute the work
-    convolved = []
-    map_func = ConvolveCaller(counts1, counts2, convolve_fcn)
-    for k in range(k_max+1):        
-        convolved.append(mapreduce_concurrent(map_func, 
-                                         count_locations.merge_counts, 
-                                         PartitionIterator(k, 2, [k0_max, k1_max])))
+    # Distribute the work.  The counts are shared with the workers once,
+    # rather than with each task, and are packed so that the workers
+    # memory-map them.
+    convolved = [{} for _ in range(min(k_min, k_max+1))]
+    with concurrency.broadcast(list(counts1), share=_pack_counts) as shared1, \
+         concurrency.broadcast(list(counts2), share=_pack_counts) as shared2:
+        map_func = ConvolveCaller(shared1, shared2, convolve_fcn)
+        for k in range(k_min, k_max+1):        
+            convolved.append(mapreduce_concurrent(map_func, 
+                                                  count_locations.merge_counts, 
+                                                  PartitionIterator(k, 2, [k0_max, k1_max])))
     
     return convolved
+
+def _pack_counts(counts):
+    return [aggregate.pack(countsK) for countsK in counts]
     
 def convolve_dict_tuples(bitlengths1, bitlengths2, counts1, counts2):
     '''
@@ -108,7 +229,7 @@ def convolve_dict_tuples(bitlengths1, bitlengths2, counts1, counts2):
     
     >>> counts1 = {(0,1): 1, (1,0): 1}
     >>> counts2 = {(1,1): 1, (2,0): 2}
-    >>> convolve_dict_tuples(counts1, counts2, [2, 1], [2, 1])
+    >>> convolve_dict_tuples([2, 1], [2, 1], counts1, counts2)
     {(3, 0): 2, (0, 1): 1, (1, 0): 1, (2, 1): 2}
     '''
     
@@ -123,12 +244,26 @@ def convolve_dict_tuples(bitlengths1, bitlengths2, counts1, counts2):
     if bitlengths1[:min_tuple_len] != bitlengths2[:min_tuple_len]:
         raise Exception('Incompatible key lengths {0}, {1}'.format(bitlengths1, bitlengths2))
 
+    if None != aggregate.memory_budget():
+        # Keep the intermediate tables within the memory budget, too.
+        counts1 = aggregate.collect((bits.concatenate(key, bitlengths1, reverse=True), count) 
+                                    for key, count in counts1.iteritems())
+        counts2 = aggregate.collect((bits.concatenate(key, bitlengths2, reverse=True), count) 
+                                    for key, count in counts2.iteritems())
+        counts = convolve_dict(counts1, counts2)
+        return aggregate.collect((bits.split(key, bitlengths, reverse=True), count) 
+                                 for key, count in counts.iteritems())
+    
     counts1 = {bits.concatenate(key, bitlengths1, reverse=True): count 
                for key, count in counts1.iteritems()}
     counts2 = {bits.concatenate(key, bitlengths2, reverse=True): count 
                for key, count in counts2.iteritems()}
     
-    counts = convolve_dict(counts1, counts2)
+    nbits = sum(bitlengths)
+    if 'dense' == _backend and nbits <= _DENSE_MAX_BITS:
+        counts = convolve_dict_dense(counts1, counts2, nbits)
+    else:
+        counts = convolve_dict(counts1, counts2)
     
     return {bits.split(key, bitlengths, reverse=True): count 
             for key, count in counts.iteritems()}
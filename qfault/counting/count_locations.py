@@ -5,8 +5,9 @@ Functions counting error propagation within a given set of (physical) locations.
 @author: adam
 '''
 
+from qfault.counting import aggregate, truncation
 from qfault.qec.error import Pauli
-from qfault.util import listutils, concurrency
+from qfault.util import listutils, concurrency, profiling
 import logging
 import itertools
 from copy import copy
@@ -190,14 +191,20 @@ def count_errors_of_order_k(k,
 
     propagated_errors = propagate_location_errors(locations)
     location_index_sets = tuple(itertools.combinations(range(len(locations)), k))
-    counts = concurrency.mapreduce_concurrent(functools.partial(_count_func,
-                                                                locations,
-                                                                propagated_errors,
-                                                                noise_model,
-                                                                block_order,
-                                                                block_error_maps),
-                                              merge_counts,
-                                              location_index_sets)
+    profiling.record('k_subsets', len(location_index_sets))
+    
+    # The locations and propagated errors are needed by every task, so they
+    # are sent to each worker once rather than with each task.
+    with concurrency.broadcast(locations) as shared_locations, \
+         concurrency.broadcast(propagated_errors) as shared_errors:
+        counts = concurrency.mapreduce_concurrent(functools.partial(_count_func,
+                                                                    shared_locations,
+                                                                    shared_errors,
+                                                                    noise_model,
+                                                                    block_order,
+                                                                    block_error_maps),
+                                                  merge_counts,
+                                                  location_index_sets)
                 
     return counts
 
@@ -222,7 +229,7 @@ def count_location_set(propagated_errors,
     :rtype dict:  A dictionary of counts, indexed by error key.
     '''
 
-    counts = {}
+    counts = aggregate.new_counts()
         
     for error_config in itertools.product(*error_weights):
         errors = [ec[0] for ec in error_config]
@@ -238,7 +245,7 @@ def count_location_set(propagated_errors,
 #        print 'blockErrors=', blockErrors, 'key=', errorKey, 'weight=', total_weight
         counts[error_key] = counts.get(error_key, 0) + total_weight
 
-    return counts
+    return aggregate.finalize(counts)
 
 #def count_blocks_by_syndrome(locations, blocks, noise, kMax):
 #    counterUtils.propagateAllErrors(locations)
@@ -249,22 +256,55 @@ def count_location_set(propagated_errors,
 #    
 #    return counts
 
-def map_counts(counts, keymap):
+# Tables with at least this many entries are mapped concurrently.
+CONCURRENT_MAP_MIN = 50000
+
+def map_counts(counts, keymap, drop_rejected=False):
     '''
     Map count keys according to keymap.
     If two keys map to the same new key, the
-    counts are summed.
+    counts are summed.  If drop_rejected is True, keys that
+    are mapped to None (i.e., rejected) are removed.  The remainder
+    bucket of truncated counts (see truncation) is not mapped.
+    Large tables are mapped concurrently, so keymap must be picklable.
+    Lambdas and closures are pickled by value (see concurrency.ByValue).
+    
+    >>> map_counts([{(1,): 2, (2,): 3, (3,): 4}], lambda key: key[0] % 2 and key or None, True) == [{(1,): 2, (3,): 4}]
+    True
     '''
     newCounts = []
+    slots = concurrency.slot_count()
     for countsK in counts:
-        newCountsK = {}
-        for key,count in countsK.iteritems():
-            mappedKey = keymap(key)
-            newCountsK[mappedKey] = newCountsK.get(mappedKey, 0) + count
-            
-        newCounts.append(newCountsK)
+        mapper = _KeyMapper(truncation.preserve_remainder(keymap, countsK), drop_rejected)
+        if 1 < slots and CONCURRENT_MAP_MIN <= len(countsK):
+            items = countsK.iteritems()
+            size = -(-len(countsK) // slots)
+            chunks = iter(lambda: list(itertools.islice(items, size)), [])
+            newCounts.append(concurrency.mapreduce_concurrent(concurrency.ByValue(mapper), merge_counts, chunks))
+        else:
+            newCounts.append(mapper(countsK.iteritems()))
         
     return newCounts
+
+class _KeyMapper(object):
+    '''
+    Maps the keys of an iterable of (key, count) items.  See map_counts().
+    '''
+    
+    def __init__(self, keymap, drop_rejected):
+        self._keymap = keymap
+        self._drop_rejected = drop_rejected
+        
+    def __call__(self, items):
+        newCountsK = aggregate.new_counts()
+        for key,count in items:
+            mappedKey = self._keymap(key)
+            newCountsK[mappedKey] = newCountsK.get(mappedKey, 0) + count
+        
+        if self._drop_rejected:
+            newCountsK.pop(None, None)
+            
+        return aggregate.finalize(newCountsK)
 #
 #def maxCount(*countss):
 #    '''
@@ -290,6 +330,8 @@ def _count_func(locations,
                 block_order,
                 block_error_maps,
                 indices):
+    locations = concurrency.broadcast_value(locations)
+    propagated_errors = concurrency.broadcast_value(propagated_errors)
     locs = [locations[i] for i in indices]
     prop_errs = [propagated_errors[i] for i in indices]
     
@@ -303,8 +345,22 @@ def _count_func(locations,
                               block_error_maps)
     
 def merge_counts(counts):
-    master = copy(counts[0])
-    for count in counts[1:]:
+    '''
+    Merges an iterable of count dictionaries into a single dictionary.
+    
+    >>> merge_counts(iter([{0: 1, 1: 2}, {1: 3}]))
+    {0: 1, 1: 5}
+    '''
+    counts = iter(counts)
+    if None != aggregate.memory_budget():
+        return aggregate.collect(item for count in counts 
+                                      for item in count.iteritems())
+    
+    master = {}
+    for count in counts:
+        if not master and isinstance(count, dict):
+            master = copy(count)
+            continue
         for key, val in count.iteritems():
             master[key] = master.get(key, 0) + val
             
@@ -10,10 +10,10 @@ More work is needed to come up with a satisfactory solution.
 '''
 from qfault.counting.convolve import convolve_dict
 from qfault.qec.error import xType, zType
-from qfault.qec.qecc import StabilizerCode
-from qfault.util import listutils, bits
-from qfault.util.cache import memoize
+from qfault.qec.qecc import ParityCheckMatrix
+from qfault.util import listutils, bits, concurrency
 import logging
+import numpy
 
 logger = logging.getLogger('counting.key')
 
@@ -69,16 +69,21 @@ class SyndromeKeyGenerator(object):
 
         self.code = code
         self._parityChecks = parityChecks
+        self._matrix = ParityCheckMatrix(parityChecks)
         self.nStabs = nStabs
         
     def parityChecks(self):
         return self._parityChecks
     
-    @memoize
     def get_key(self, e):       
-        key = StabilizerCode.Syndrome(e, self.parityChecks())
-        #print 'e=', e, 'parityChecks=', self.parityChecks(), 'key={0:b}'.format(key)
-        return key
+        return self._matrix.syndrome(e)
+    
+    def get_keys(self, xbits, zbits):
+        '''
+        Returns an array of the keys of errors given by arrays of their X and
+        Z parts (see ParityCheckMatrix.syndromes()).
+        '''
+        return self._matrix.syndromes(xbits, zbits)
     
     def __call__(self, error):
         return self.get_key(error)
@@ -151,7 +156,26 @@ def keyForBlock(key, block):
 # 
 #####
     
-identity = lambda key: key
+def identity(key):
+    # A named function, so that manipulators can be pickled by reference.
+    return key
+
+def block_permutation(keymap, nblocks):
+    '''
+    Returns the block permutation (in one-line notation) performed by keymap on
+    keys with nblocks blocks, or None if keymap does anything other than reorder
+    blocks.
+
+    >>> block_permutation(KeyPermuter(IdentityManipulator(), [1, 0]), 3)
+    [1, 0, 2]
+    >>> block_permutation(KeyRemover(IdentityManipulator(), [0]), 3)
+    '''
+    if identity is keymap:
+        return range(nblocks)
+    try:
+        return keymap.block_permutation(nblocks)
+    except AttributeError:
+        return None
 
 class KeyManipulator(object):
     
@@ -164,10 +188,25 @@ class KeyManipulator(object):
     def _manipulate(self, key):
         raise NotImplementedError
     
+    # Several manipulators are defined within component classes.
+    __reduce_ex__ = concurrency.reduce_nested
+    
+    def block_permutation(self, nblocks):
+        '''
+        Returns the block permutation performed by this manipulator, or None
+        if the manipulator does anything other than reorder blocks.
+        Subclasses which only reorder blocks should override this method so
+        that the reordering can be done without rewriting count tables.
+        '''
+        return None
+    
 class IdentityManipulator(KeyManipulator):
     
     def _manipulate(self,key):
         return key
+
+    def block_permutation(self, nblocks):
+        return block_permutation(self._manipulator, nblocks)
     
 class KeyExtender(KeyManipulator):
     
@@ -215,6 +254,13 @@ class KeyPermuter(KeyManipulator):
         
     def _manipulate(self, key):
         return tuple(listutils.permute(key[:len(self.permutation)], self.permutation)) + key[len(self.permutation):]
+
+    def block_permutation(self, nblocks):
+        inner = block_permutation(self._manipulator, nblocks)
+        if None == inner:
+            return None
+        permutation = list(self.permutation) + range(len(self.permutation), nblocks)
+        return listutils.permute(inner, permutation)
     
 class KeyConcatenator(KeyManipulator):
     
@@ -375,21 +421,34 @@ class SyndromeKeyDecoder(object):
         return key >> len(self._normalizers)
         
     def decode(self, key):
-#        logicalError = Pauli.I
         nNorms = len(self._normalizers)
         logicalChecks = key & ((1 << nNorms) - 1)
         syndrome = key >> nNorms
         
-        e = self._code.syndromeCorrection(syndrome)
-        
-        commutations = [not e.commutesWith(check) for check in self._normalizers]
-        commutations = bits.listToBits(commutations)
-        decoded = logicalChecks ^ commutations
+        decoded = logicalChecks ^ int(self._flipTable()[syndrome])
         
-        logger.debug('correction=%s, normalizers=%s', e, self._normalizers)
         logger.debug('key=%s, decoded key=%s', key, decoded)
         return decoded
-        
+    
+    def decodeKeys(self, keys):
+        '''
+        Returns an array of the decoded keys of an array of keys (e.g., the
+        keys of a count table), as for decode().
+        '''
+        keys = numpy.asarray(keys, dtype=numpy.int64)
+        nNorms = len(self._normalizers)
+        return (keys & ((1 << nNorms) - 1)) ^ self._flipTable()[keys >> nNorms]
+    
+    def _flipTable(self):
+        # The normalizer checks that anti-commute with the correction of
+        # each syndrome (see StabilizerCode.correctionTable()).
+        try:
+            return self._flips
+        except AttributeError:
+            corrections = self._code.correctionTable()
+            normalizers = ParityCheckMatrix(self._normalizers)
+            self._flips = normalizers.syndromes(corrections[:, 0], corrections[:, 1])
+            return self._flips
         
     def asPauli(self, key):
         nNorms = len(self._normalizers)
@@ -0,0 +1,404 @@
+'''
+Cost model and execution planner for counting.
+
+The planner walks a component tree in the same order as Component.count()
+and estimates, for each step:
+
+- the number of location subsets C(n,k) and error configurations visited
+  by count_errors_of_order_k(),
+- the size of each count table, bounded by the key space of the blocks
+  (see SyndromeKeyGenerator.parityChecks()),
+- the number of key pairs combined by convolve_counts(),
+- CPU time, memory, and whether the step is a repeat of an earlier
+  (and therefore cached) step.
+
+Based on these estimates, the plan selects the number of worker processes,
+whether count tables should be spilled to disk (see aggregate), and the
+convolution backend (see convolve.set_convolution_backend()).
+
+Components that override count() with custom logic are estimated as
+sequential compositions of their sub-components.  The estimates are upper
+bounds on the table sizes, so they tend to be pessimistic.
+
+Typical use:
+
+>>> plan = planner.plan(exRec, noiseModels, Pauli.Y)  # doctest: +SKIP
+>>> print plan                                          # doctest: +SKIP
+>>> plan.apply()                                        # doctest: +SKIP
+
+or, equivalently, planner.count(exRec, noiseModels, Pauli.Y).
+'''
+from qfault.counting import aggregate, convolve, truncation
+from qfault.counting.component.base import CountableComponent, ParallelComponent
+from qfault.counting.key import SyndromeKeyGenerator
+from qfault.util import cache, concurrency
+import logging
+import multiprocessing
+import operator
+
+logger = logging.getLogger('counting.planner')
+
+__all__ = ['Rates', 'Plan', 'plan', 'count', 'available_memory']
+
+
+class Rates(object):
+    '''
+    Single-core execution rates used by the cost model, in seconds per operation.
+    The defaults were measured with CPython 2.7 on a contemporary x86 core.
+
+    :param subset: Time per location subset visited by count_errors_of_order_k().
+    :param config: Time per error configuration counted by count_location_set().
+    :param pair: Time per pair of keys combined by sparse convolution.
+    :param dense: Time per array element updated by dense convolution.
+    :param key: Time per key mapped by a key propagator.
+    :param entry_bytes: Memory per count table entry.
+    '''
+
+    def __init__(self, subset=1e-5, config=2.5e-5, pair=5e-7, dense=6e-9, key=2e-6, entry_bytes=200):
+        self.subset = subset
+        self.config = config
+        self.pair = pair
+        self.dense = dense
+        self.key = key
+        self.entry_bytes = entry_bytes
+
+
+class Step(object):
+    '''
+    The estimated cost of counting (or propagating through) a single component.
+    '''
+
+    def __init__(self, name, kind, sizes, seconds=0, dense_seconds=None,
+                 entries=0, configs=0, pairs=0, cached=False):
+        self.name = name
+        self.kind = kind
+        self.sizes = sizes
+        self.seconds = seconds
+        self.dense_seconds = dense_seconds
+        self.entries = entries
+        self.configs = configs
+        self.pairs = pairs
+        self.cached = cached
+
+    def __repr__(self):
+        return 'Step({0}, {1}, {2})'.format(self.name, self.kind, self.sizes)
+
+
+class Plan(object):
+    '''
+    An execution plan for counting a component.  The plan lists the estimated
+    cost of each step, and the selected worker count, convolution backend and
+    spill budget.  Use apply() to configure the counting modules accordingly.
+    '''
+
+    # Jobs shorter than this are not worth the cost of starting worker processes.
+    _MIN_PARALLEL_SECONDS = 10
+
+    def __init__(self, component, pauli, steps, rates, memory=None, cpus=None):
+        '''
+        :param component: The component to be counted.
+        :param pauli: The error type to be counted.
+        :param list steps: The estimated steps.
+        :param rates: The Rates used for the estimates.
+        :param int memory: (optional) Available memory in bytes.  Default is unlimited.
+        :param int cpus: (optional) The number of CPUs.  Default is all CPUs.
+        '''
+        self.component = component
+        self.pauli = pauli
+        self.steps = steps
+        self.rates = rates
+        self.memory = memory
+
+        if None == cpus:
+            cpus = multiprocessing.cpu_count()
+
+        sparse_seconds = sum(step.seconds for step in steps if None != step.dense_seconds)
+        dense_seconds = sum(step.dense_seconds for step in steps if None != step.dense_seconds)
+        if dense_seconds < sparse_seconds:
+            self.backend = 'dense'
+            self.cpu_seconds = self._total(steps, lambda step: step.dense_seconds)
+        else:
+            self.backend = 'sparse'
+            self.cpu_seconds = self._total(steps, lambda step: None)
+
+        self.peak_entries = max([step.entries for step in steps] + [0])
+        self.cache_hits = sum(1 for step in steps if step.cached)
+
+        if self.cpu_seconds < self._MIN_PARALLEL_SECONDS:
+            self.workers = 0
+        else:
+            self.workers = cpus
+            if None != memory:
+                # Each worker may hold its own copy of the largest tables.
+                per_worker = max(1, self.peak_entries * rates.entry_bytes)
+                self.workers = max(1, min(cpus, memory // per_worker))
+
+        self.spill_entries = None
+        slots = max(1, self.workers)
+        if None != memory and self.peak_entries * rates.entry_bytes * slots > memory:
+            # Tables are held by the master and by each worker.
+            self.spill_entries = max(1, memory // (2 * slots * rates.entry_bytes))
+
+    @staticmethod
+    def _total(steps, dense):
+        total = 0
+        for step in steps:
+            seconds = dense(step)
+            total += step.seconds if None == seconds else seconds
+        return total
+
+    @property
+    def seconds(self):
+        '''
+        The estimated wall-clock time, in seconds.
+        '''
+        return self.cpu_seconds / max(1, self.workers)
+
+    @property
+    def peak_bytes(self):
+        '''
+        The estimated peak memory of the largest step, in bytes.
+        '''
+        return self.peak_entries * self.rates.entry_bytes
+
+    def apply(self):
+        '''
+        Configures concurrency, spilling and convolution according to the plan.
+        '''
+        logger.info('Applying plan: workers=%s, backend=%s, spill=%s',
+                    self.workers, self.backend, self.spill_entries)
+        # Workers inherit these settings when they are started, so the pool
+        # must be created last.
+        aggregate.set_memory_budget(self.spill_entries)
+        convolve.set_convolution_backend(self.backend)
+        concurrency.initialize_concurrency(self.workers)
+
+    def __str__(self):
+        lines = ['Plan for {0} ({1})'.format(self.component.__class__.__name__, self.pauli)]
+        row = '{0:<48} {1:>9} {2:>12} {3:>12} {4:>10}  {5}'
+        lines.append(row.format('step', 'kind', 'configs', 'pairs', 'seconds', 'table sizes'))
+        for step in self.steps:
+            kind = step.kind + (' (cached)' if step.cached else '')
+            lines.append(row.format(step.name[-48:], kind, step.configs, step.pairs,
+                                    '{0:.3g}'.format(step.seconds), step.sizes))
+
+        lines.append('estimated CPU time: {0:.3g} s, wall time: {1:.3g} s'.format(self.cpu_seconds, self.seconds))
+        lines.append('estimated peak memory: {0:.3g} MB ({1} entries)'.format(self.peak_bytes / 1e6, self.peak_entries))
+        lines.append('cached steps: {0}{1}'.format(self.cache_hits, '' if cache.fetchEnabled else ' (fetching disabled)'))
+        lines.append('workers: {0}, convolution: {1}, spill: {2}'.format(self.workers,
+                                                                        self.backend,
+                                                                        self.spill_entries or 'no'))
+        return '\n'.join(lines)
+
+
+def plan(component, noiseModels, pauli, inputResult=None, kMax=None, memory=None, cpus=None, rates=None):
+    '''
+    Returns a Plan with cost estimates for component.count(noiseModels, pauli, inputResult, kMax).
+
+    :param component: The component to be counted.
+    :param dict noiseModels: A dictionary, indexed by Pauli error, of noise models.
+    :param pauli: The error type to count.
+    :param inputResult: (optional) The input to the component.
+    :param int kMax: (optional) The maximum number of faults to count.
+    :param int memory: (optional) Available memory in bytes.  Default is unlimited, i.e., no
+                       spilling.  The table sizes are pessimistic estimates, so a plan for the
+                       available system memory (see available_memory()) may spill unnecessarily.
+    :param int cpus: (optional) The number of CPUs.  Default is all CPUs.
+    :param rates: (optional) The Rates to use.
+    '''
+    if None == rates:
+        rates = Rates()
+
+    estimator = _Estimator(noiseModels[pauli], pauli, rates)
+    if None == inputResult:
+        estimator.walk(component, component.__class__.__name__, None, None, kMax)
+    else:
+        sizes = [len(countsK) for countsK in inputResult.counts]
+        estimator.walk(component, component.__class__.__name__, tuple(inputResult.blocks), sizes, kMax)
+
+    return Plan(component, pauli, estimator.steps, rates, memory, cpus)
+
+def count(component, noiseModels, pauli, inputResult=None, kMax=None, **kwargs):
+    '''
+    Plans the count, prints the plan, applies it and then counts the component.
+    Additional keyword arguments are passed to plan().
+    '''
+    execution = plan(component, noiseModels, pauli, inputResult, kMax, **kwargs)
+    print execution
+    execution.apply()
+    return component.count(noiseModels, pauli, inputResult, kMax)
+
+
+class _Estimator(object):
+
+    def __init__(self, noise, pauli, rates):
+        self.noise = noise
+        self.pauli = pauli
+        self.rates = rates
+        self.steps = []
+        self._counted = {}
+        self._bits = {}
+
+    def walk(self, component, name, blocks, sizes, kMax):
+        '''
+        Estimates the steps for counting the component with input counts of
+        the given table sizes.  Returns the blocks and table sizes of the output.
+        '''
+        if isinstance(component, CountableComponent):
+            return self._countable(component, name, blocks, sizes, kMax)
+
+        subs = component.subcomponents()
+        if not subs:
+            return self._propagate(component, name, blocks, sizes)
+
+        if None == sizes:
+            blocks, sizes = tuple(component.inBlocks()), [1]
+
+        k = component.kGood[self.pauli] + len(sizes) - 1
+        if None != kMax:
+            k = min(k, kMax)
+
+        parallel = isinstance(component, ParallelComponent)
+        for i, sub in enumerate(subs):
+            subname = '{0}/{1}[{2}]'.format(name, sub.__class__.__name__, i)
+            blocks, sizes = self.walk(sub, subname, blocks, sizes, k)
+            if parallel:
+                blocks = _rotate(blocks, len(sub.outBlocks()))
+
+        if parallel:
+            blocks = _rotate(blocks, -len(component.outBlocks()))
+
+        return blocks, sizes
+
+    def _countable(self, component, name, blocks, sizes, kMax):
+        rates = self.rates
+        locations = component.locations(self.pauli)
+        n = len(locations)
+        # As for CountableComponent.count(), orders above kMax are not counted.
+        kCount = component.kGood[self.pauli]
+        if None != kMax:
+            kCount = min(kCount, kMax)
+        outBlocks = tuple(component.outBlocks())
+
+        configs = _elementary_symmetric([len(self.noise.errorList(loc)) for loc in locations], kCount)
+        subsets = [_binomial(n, k) for k in range(kCount + 1)]
+        space = 2 ** self._key_bits(outBlocks)
+        own = [1] + [min(space, c) for c in configs[1:]]
+        own = self._truncated(own)
+
+        # Leaves extend the orders that they have already counted, so only
+        # the orders above those are enumerated again.
+        key = (component.identifier().hexdigest(), self.pauli)
+        kCounted = self._counted.get(key, -1)
+        cached = kCount <= kCounted
+        self._counted[key] = max(kCounted, kCount)
+        start = max(kCounted, 0) + 1
+        seconds = sum(subsets[start:]) * rates.subset + sum(configs[start:]) * rates.config
+        self.steps.append(Step(name, 'count', own, seconds, entries=sum(own),
+                               configs=sum(configs[start:]), cached=cached))
+
+        if None == sizes:
+            return outBlocks, own
+
+        blocks, sizes = self._propagate(component, name, blocks, sizes)
+        nbits = self._key_bits(blocks)
+        space = 2 ** nbits
+
+        kOut = len(sizes) + len(own) - 2
+        if None != kMax:
+            kOut = min(kOut, kMax)
+
+        out = []
+        pairs = 0
+        dense_elements = 0
+        for k in range(kOut + 1):
+            pairsK = [(sizes[k1], own[k - k1]) for k1 in range(k + 1)
+                      if k1 < len(sizes) and k - k1 < len(own)]
+            pairs += sum(a * b for a, b in pairsK)
+            dense_elements += sum(min(a, b) * space for a, b in pairsK)
+            out.append(min(space, sum(a * b for a, b in pairsK)))
+        out = self._truncated(out)
+
+        dense_seconds = None
+        if nbits <= convolve._DENSE_MAX_BITS:
+            dense_seconds = dense_elements * rates.dense
+        self.steps.append(Step(name, 'convolve', out, pairs * rates.pair, dense_seconds,
+                               entries=sum(sizes) + sum(own) + sum(out), pairs=pairs))
+        return blocks, out
+
+    def _propagate(self, component, name, blocks, sizes):
+        '''
+        Estimates the cost of propagating keys through the component.
+        '''
+        if None == sizes:
+            blocks, sizes = tuple(component.inBlocks()), [1]
+
+        blocks = tuple(component.outBlocks()) + tuple(blocks[len(component.inBlocks()):])
+        space = 2 ** self._key_bits(blocks)
+        propagated = [min(space, size) for size in sizes]
+        self.steps.append(Step(name, 'propagate', propagated, sum(sizes) * self.rates.key,
+                               entries=sum(sizes) + sum(propagated)))
+        return blocks, propagated
+
+    def _key_bits(self, blocks):
+        bits = 0
+        for block in blocks:
+            code = block.get_code()
+            if code not in self._bits:
+                self._bits[code] = len(SyndromeKeyGenerator(code).parityChecks())
+            bits += self._bits[code]
+        return bits
+
+    @staticmethod
+    def _truncated(sizes):
+        policy = truncation.truncation_policy()
+        if isinstance(policy, truncation.TopN):
+            # The kept keys plus the remainder bucket.
+            return [min(size, policy.n + 1) for size in sizes]
+        return sizes
+
+
+def _rotate(blocks, rotation):
+    return blocks[rotation:] + blocks[:rotation]
+
+def _binomial(n, k):
+    '''
+    >>> _binomial(5, 2)
+    10
+    '''
+    if k < 0 or k > n:
+        return 0
+    return reduce(operator.mul, range(n - k + 1, n + 1), 1) // reduce(operator.mul, range(1, k + 1), 1)
+
+def _elementary_symmetric(values, kMax):
+    '''
+    Returns the elementary symmetric polynomials e_0, ..., e_kMax of the values.
+    Entry k is the number of ways of choosing k of the locations, and one of
+    the values[i] errors at each chosen location i.
+
+    >>> _elementary_symmetric([3, 3, 15], 3)
+    [1, 21, 99, 135]
+    '''
+    e = [1] + [0] * kMax
+    for v in values:
+        for k in range(kMax, 0, -1):
+            e[k] += e[k - 1] * v
+    return e
+
+def available_memory():
+    '''
+    Returns the available system memory in bytes, or None if it is unknown.
+    '''
+    try:
+        with open('/proc/meminfo') as meminfo:
+            for line in meminfo:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) * 1024
+    except IOError:
+        pass
+    return None
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -4,6 +4,7 @@ Created on 2010-06-17
 @author: adam
 '''
 
+from qfault.counting import truncation
 from qfault.noise import Bound
 from qfault.util import concurrency
 from qfault.util.iteration import PartitionIterator
@@ -19,13 +20,32 @@ __all__ = ['counts_as_poly',
 
 logger = logging.getLogger('counting.probability')
 
-def counts_as_poly(counts, locations, noise, bound=Bound.UpperBound):
+def counts_as_poly(counts, locations, noise, bound=Bound.UpperBound, keys=None):
     '''
     Convert weighted error likelihood counts into a polynomial that
     gives the (possibly un-normalized) failure probability as a function
     of the original error strength.
+    
+    The remainder bucket of truncated counts (see truncation) may contain
+    any key.  It is included in upper bounds and excluded from lower bounds.
+    
+    :param counts: Counts indexed by [k][key].
+    :param locations: The locations to which the counts correspond.
+    :param noise: The noise model.
+    :param bound: (optional) The type of bound, either UpperBound or LowerBound.
+    :param keys: (optional) The keys to include.  Default is all keys.
     '''
-    coeffs = [sum(countsK.values()) for countsK in counts]
+    coeffs = []
+    for countsK in counts:
+        countsK, remainder = truncation.split_remainder(countsK)
+        if None == keys:
+            coeff = sum(countsK.itervalues())
+        else:
+            coeff = sum(countsK.get(key, 0) for key in keys)
+        if Bound.UpperBound == bound:
+            coeff += remainder
+        coeffs.append(coeff)
+        
     return summed_counts_as_poly(coeffs, locations, noise, bound)
 
 def summed_counts_as_poly(summed_counts, locations, noise, bound=Bound.UpperBound):
@@ -163,10 +183,7 @@ def pr_at_least_k_failures(kMin, locations, noiseModel, kMax=None):
     
     loc_types, loc_totals = _location_totals_by_type(locations)
     
-    logger.debug('Computing Pr[{0} <= k < {1}] for {2}, {3}'.format(kMin, 
-                                                                    kMax, 
-                                                                    loc_totals, 
-                                                                    noiseModel))
+    logger.debug('Computing Pr[%s <= k < %s] for %s, %s', kMin, kMax, loc_totals, noiseModel)
     
     loc_type_weight = lambda loc_type: sum(noiseModel.getWeight(loc_type, e, boundType) 
                                            for e in noiseModel.errorList(loc_type))
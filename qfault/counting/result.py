@@ -2,50 +2,338 @@
 Created on 2011-10-22
 
 @author: adam
-'''    
+'''
 
-from qfault.counting import key
+from qfault.counting import aggregate, key, truncation
+from qfault.counting.count_locations import map_counts
+from qfault.util import trace
+import operator
 import logging
 
 logger = logging.getLogger('counting.result')
 
 class CountResult(object):
-    ''' 
+    '''
     Container for counting results.
+
+    CountResult objects are immutable.  The count tables of a result may be
+    shared with other results and with caches, so they must not be modified
+    in place.  Use a CountResultBuilder (see builder()) to construct modified
+    counts.
+
+    The blocks of a result may be reordered without rewriting the count tables.
+    Reordering is recorded as a logical-to-physical block index map, and is
+    applied to the keys only when the counts are read (or fused into the next
+    key mapping, see map_keys()).
+
+    >>> result = CountResult([{(1, 2, 3): 1}], ('a', 'b', 'c'))
+    >>> rotated = result.rotate(1)
+    >>> rotated.blocks
+    ('b', 'c', 'a')
+    >>> rotated.counts
+    [{(2, 3, 1): 1}]
+    >>> result.counts
+    [{(1, 2, 3): 1}]
     '''
-    
-    def __init__(self, counts, blocks):                    
-        self.blocks = blocks
-        self.counts = counts
-        
+
+    def __init__(self, counts, blocks, permutation=None):
+        '''
+        :param list counts: Counts indexed by [k][key]
+        :param blocks: The blocks corresponding to each key entry.
+        :param permutation: (optional) The logical-to-physical block index map.
+                            Logical block i of each key is stored at index permutation[i].
+                            None means no permutation.
+        '''
+        self._blocks = blocks
+        self._counts = counts
+        self._permutation = permutation
+
+    @property
+    def blocks(self):
+        return self._blocks
+
+    @property
+    def counts(self):
+        '''
+        The counts, indexed by [k][key].  The returned list cannot be modified,
+        and the tables that it contains are shared, so they must not be
+        modified either.
+
+        >>> CountResult([{(0,): 1}], ('a',)).counts.append({})
+        Traceback (most recent call last):
+            ...
+        TypeError: count tables are read-only
+        '''
+        if None != self._permutation:
+            # Materialize the pending block permutation.  This does not change
+            # the logical content of the result.
+            self._counts = map_counts(self._counts, _PhysicalToLogical(self._permutation))
+            self._permutation = None
+        return ReadOnlyList(self._counts)
+
+    def builder(self):
+        '''
+        Returns a CountResultBuilder initialized with a copy of this result.
+
+        >>> result = CountResult([{(0,): 1}], ('a',))
+        >>> builder = result.builder()
+        >>> builder.add(0, (1,), 2)
+        >>> builder.build().counts
+        [{(0,): 1, (1,): 2}]
+        >>> result.counts
+        [{(0,): 1}]
+        '''
+        builder = CountResultBuilder(len(self), self.blocks)
+        builder.add_counts(self.counts)
+        return builder
+
+    def permute(self, permutation):
+        '''
+        Returns a result in which the blocks are permuted according to the given
+        permutation (one-line notation, see listutils.permute).  Blocks beyond
+        len(permutation) are unchanged.  The count tables are shared, not copied.
+
+        >>> result = CountResult([{(1, 2, 3): 1}], ('a', 'b', 'c'))
+        >>> result.permute([1, 0]).counts
+        [{(2, 1, 3): 1}]
+        '''
+        nblocks = len(self.blocks)
+        permutation = list(permutation) + range(len(permutation), nblocks)
+        blocks = tuple(self.blocks[p] for p in permutation)
+        return self._permuted(permutation, blocks)
+
+    def rotate(self, rotation):
+        '''
+        Returns a result in which the blocks are rotated left by the given
+        number of indices.  The count tables are shared, not copied.
+
+        >>> result = CountResult([{(1, 2, 3): 1}], ('a', 'b', 'c'))
+        >>> result.rotate(-1).blocks
+        ('c', 'a', 'b')
+        '''
+        indices = range(len(self.blocks))
+        return self.permute(indices[rotation:] + indices[:rotation])
+
+    def map_keys(self, keymap, blocks=None, drop_rejected=False):
+        '''
+        Returns a new result for which each key has been mapped according to keymap.
+        Any pending block permutation is applied in the same pass.  Key maps that only
+        reorder blocks (see KeyManipulator.block_permutation) do not touch the counts.
+
+        :param keymap: A function (or KeyManipulator) to apply to each key.
+        :param blocks: (optional) The blocks of the new result.  Default is unchanged.
+        :param bool drop_rejected: (optional) Remove keys that are mapped to None.
+        '''
+        if None == blocks:
+            blocks = self.blocks
+
+        permutation = key.block_permutation(keymap, len(self.blocks))
+        if None != permutation:
+            return self._permuted(permutation, blocks)
+
+        if None != self._permutation:
+            keymap = _ComposedKeyMap(keymap, _PhysicalToLogical(self._permutation))
+        return CountResult(map_counts(self._counts, keymap, drop_rejected), blocks)
+
+    def up_to(self, kMax):
+        '''
+        Returns a result containing only orders 0 through kMax.
+        The count tables are shared, not copied.
+
+        >>> CountResult([{(0,): 1}, {(1,): 2}], ('a',)).up_to(0).counts
+        [{(0,): 1}]
+        '''
+        if kMax + 1 >= len(self):
+            return self
+        return CountResult(self._counts[:kMax + 1], self.blocks, self._permutation)
+
+    def truncate(self, policy):
+        '''
+        Returns a result in which each count table is truncated according to
+        the given policy (see truncation).  The counts of the dropped keys are
+        merged into the remainder bucket.  If policy is None, the result is
+        returned unchanged.
+
+        >>> result = CountResult([{(0,): 1}, {(1,): 5, (2,): 3, (3,): 1}], ('a',))
+        >>> result.truncate(truncation.TopN(2)).counts[1] == {(1,): 5, (2,): 3, truncation.REMAINDER: 1}
+        True
+        '''
+        if None == policy:
+            return self
+
+        # Truncation does not depend on the block order, so any pending
+        # permutation is kept as-is.
+        counts = truncation.truncate_counts(self._counts, policy)
+        return CountResult(counts, self.blocks, self._permutation)
+
     def is_valid(self, expNumBlocks=None):
         nblocks = len(self.blocks)
-        
-        logger.debug("nblocks={0}, expected={1}".format(nblocks, expNumBlocks))
+
+        logger.debug("nblocks=%s, expected=%s", nblocks, expNumBlocks)
         if None != expNumBlocks and nblocks != expNumBlocks:
             logger.error('nblocks={0}, expNumBlocks={1}'.format(nblocks, expNumBlocks))
             return False
-        for count in self.counts:
+
+        # Key lengths are invariant under block permutations, so the
+        # physical counts can be checked directly.
+        for count in self._counts:
+            count, _ = truncation.split_remainder(count)
             if any(nblocks - len(key) for key in count.keys()):
-                logger.error('nblocks={0}, key lengths={1}'.format(nblocks, 
+                logger.error('nblocks={0}, key lengths={1}'.format(nblocks,
                                                                    [len(key) for key in count.keys()]))
-                logger.debug('count={0}'.format(count))
+                logger.debug('count=%s', trace.summarize(count))
                 return False
-            
+
         return True
 
-        
+    def _permuted(self, permutation, blocks):
+        # Compose the new permutation with the pending one.
+        if None != self._permutation:
+            permutation = [self._permutation[p] for p in permutation]
+        permutation = tuple(permutation)
+        if permutation == tuple(range(len(permutation))):
+            permutation = None
+        return CountResult(self._counts, blocks, permutation)
+
+    def __len__(self):
+        '''
+        Returns the number of fault orders in the result.
+        '''
+        return len(self._counts)
+
     def __get__(self, k):
         return self.counts[k]
 
+    def __copy__(self):
+        # Immutable, so there is no need to copy.
+        return self
+
+    def __getstate__(self):
+        # Always store the logical counts so that the pickled form
+        # does not depend on the in-memory block ordering.
+        # The runs of spilled tables do not outlive the process, so they are
+        # copied to the run store, rather than read into memory (see aggregate).
+        counts = [aggregate.StoredCounts(countsK) for countsK in self.counts]
+        return {'counts': counts, 'blocks': self.blocks}
+
+    def __setstate__(self, state):
+        self._blocks = state['blocks']
+        self._counts = state['counts']
+        self._permutation = None
+
     def __str__(self):
         return self.__repr__()
 
     def __repr__(self):
         return str(self.counts) + str(self.blocks)
 
+class CountResultBuilder(object):
+    '''
+    Accumulates counts for a new CountResult.  The builder owns its count
+    tables until build() is called, at which point they are handed over
+    to the result without copying.  The tables spill to disk when a memory
+    budget is set (see aggregate).
+
+    >>> builder = CountResultBuilder(3, ('a',))
+    >>> builder.add_counts([{(0,): 1}, {(1,): 1}], shift=1)
+    >>> builder.add_counts([{(1,): 2}])
+    >>> builder.build().counts
+    [{(1,): 2}, {(0,): 1}, {(1,): 1}]
+    '''
+
+    def __init__(self, num_orders, blocks=None):
+        '''
+        :param int num_orders: The number of fault orders (i.e., kMax + 1).
+        :param blocks: (optional) The blocks of the result.
+        '''
+        self.blocks = blocks
+        self._counts = [aggregate.new_counts() for _ in range(num_orders)]
+
+    def add(self, k, key, count):
+        '''
+        Adds count to the order-k count for key.
+        '''
+        countsK = self._counts[k]
+        countsK[key] = countsK.get(key, 0) + count
+
+    def add_counts(self, counts, shift=0):
+        '''
+        Adds the given counts so that counts[k] is added to order k+shift.
+        Orders beyond the capacity of the builder are ignored.
+        '''
+        for k, countsK in enumerate(counts[:len(self._counts) - shift], shift):
+            target = self._counts[k]
+            if not target and dict is type(target) and isinstance(countsK, dict):
+                target.update(countsK)
+                continue
+            for key, count in countsK.iteritems():
+                target[key] = target.get(key, 0) + count
+
+    def discard(self, key):
+        '''
+        Removes the given key from all orders.
+        '''
+        for countsK in self._counts:
+            countsK.pop(key, None)
+
+    def build(self):
+        '''
+        Returns the CountResult.  The builder may not be used afterward.
+        '''
+        result = CountResult([aggregate.finalize(countsK) for countsK in self._counts], self.blocks)
+        self._counts = None
+        return result
+
+class ReadOnlyList(list):
+    '''
+    A list that cannot be modified.  It compares equal to a list with the
+    same elements.
+    '''
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError('count tables are read-only')
+
+    __setitem__ = __delitem__ = __setslice__ = __delslice__ = _read_only
+    __iadd__ = __imul__ = _read_only
+    append = extend = insert = pop = remove = reverse = sort = _read_only
+
+    def __reduce__(self):
+        return (list, (list(self),))
+
+class _PhysicalToLogical(object):
+    '''
+    Reorders a physically ordered key into logical block order.
+    '''
+
+    def __init__(self, permutation):
+        self._permutation = permutation
+        self._getter = operator.itemgetter(*permutation)
+
+    def __call__(self, key):
+        # Permutations always have at least two elements, so itemgetter returns a tuple.
+        return self._getter(key)
+
+    def __getstate__(self):
+        return self._permutation
+
+    def __setstate__(self, permutation):
+        self.__init__(permutation)
+
+class _ComposedKeyMap(object):
+
+    def __init__(self, outer, inner):
+        self._outer = outer
+        self._inner = inner
+
+    def __call__(self, key):
+        return self._outer(self._inner(key))
+
 
 def TrivialResult(blocks):
     inputs = tuple([0]*len(blocks))
     counts = [{inputs: 1}]
-    return CountResult(counts, blocks)
\ No newline at end of file
+    return CountResult(counts, blocks)
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,195 @@
+'''
+Estimates of high-order counts by sampling.
+
+Counting k faults enumerates all C(n,k) subsets of n locations, and every
+combination of errors at the locations of each subset, which is infeasible for
+large k.  Instead, sample_errors_of_order_k() draws a subset uniformly and
+then one error for each of its locations, with probability proportional to
+the weight of the error.  The sampled errors are propagated and keyed exactly
+as by count_errors_of_order_k(), and the sample is given the weight
+C(n,k) * W, in which W is the product over the locations of the sum of their
+error weights.  The mean of the sampled weights of each key is then an unbiased
+estimate of its count.
+
+estimate_orders() combines the two: low orders of the countable components
+(leaves) of a component are counted exactly, and higher orders are sampled.
+The leaves are seeded with both (as in sweep), so that count() combines
+the exact and sampled orders of every leaf.
+'''
+from qfault.counting import count_locations
+from qfault.counting.sweep import countable_leaves
+from qfault.util import cache, concurrency, listutils
+import bisect
+import gmpy
+import logging
+import random
+
+logger = logging.getLogger('counting.sampling')
+
+__all__ = ['OrderEstimate', 'sample_errors_of_order_k', 'estimate_orders']
+
+# The default number of samples for each order.
+SAMPLES = 10000
+
+# The number of standard errors on each side of 95% confidence intervals.
+Z95 = 1.96
+
+
+class OrderEstimate(object):
+    '''
+    Estimated counts for exactly k faults.
+
+    :ivar k: The number of faults.
+    :ivar counts: The estimated counts, indexed by key.
+    :ivar stderr: The standard errors of the counts, indexed by key.
+    :ivar total: The estimated total count.
+    :ivar total_stderr: The standard error of the total.
+    :ivar samples: The number of samples.  Orders that were counted exactly have
+                   no samples, and standard errors of zero.
+    '''
+
+    def __init__(self, k, counts, stderr, total, total_stderr, samples):
+        self.k = k
+        self.counts = counts
+        self.stderr = stderr
+        self.total = total
+        self.total_stderr = total_stderr
+        self.samples = samples
+
+    @classmethod
+    def exact(cls, k, counts):
+        return cls(k, counts, dict.fromkeys(counts, 0), sum(counts.itervalues()), 0, 0)
+
+    def interval(self, z=Z95):
+        '''
+        Returns the (normal approximation) confidence interval of the total, with
+        z standard errors on each side.
+        '''
+        return (self.total - z * self.total_stderr, self.total + z * self.total_stderr)
+
+    def __repr__(self):
+        return 'OrderEstimate(k={0}, total={1:.6g} +/- {2:.3g}, samples={3})'.format(self.k,
+                                                                                 float(self.total),
+                                                                                 float(self.total_stderr),
+                                                                                 self.samples)
+
+def _mean_stderr(weights, squares, samples):
+    mean = weights / float(samples)
+    variance = max(squares / float(samples) - mean ** 2, 0) * samples / max(samples - 1, 1)
+    return mean, (variance / samples) ** .5
+
+def sample_errors_of_order_k(k,
+                             locations,
+                             noise_model,
+                             block_order=None,
+                             block_error_maps=None,
+                             samples=SAMPLES,
+                             rng=random):
+    '''
+    Estimates the counts of count_errors_of_order_k() from the given number of
+    samples.  Orders with no more subsets than samples are counted exactly.
+    Returns an OrderEstimate.
+
+    :param rng: (optional) A random.Random instance, for repeatable estimates.
+    '''
+    subsets = long(gmpy.comb(len(locations), k))
+    if subsets <= samples:
+        counts = count_locations.count_errors_of_order_k(k, locations, noise_model,
+                                                         block_order, block_error_maps)
+        return OrderEstimate.exact(k, counts)
+
+    if None == block_order:
+        block_order = locations.blocknames()
+    if None == block_error_maps:
+        block_error_maps = [concurrency.Noop()] * len(block_order)
+
+    propagated = count_locations.propagate_location_errors(locations)
+
+    # The errors of each location, and their cumulative weights.
+    errors = []
+    for loc in locations:
+        errorList = list(noise_model.errorList(loc))
+        cumulative = []
+        total = 0
+        for e in errorList:
+            total += noise_model.getWeight(loc, e)
+            cumulative.append(total)
+        errors.append((errorList, cumulative))
+
+    weights = {}
+    squares = {}
+    total_weight = total_squares = 0
+    keys = {}
+    population = range(len(locations))
+    for _ in xrange(samples):
+        indices = rng.sample(population, k)
+        weight = subsets
+        sampled = []
+        for i in indices:
+            errorList, cumulative = errors[i]
+            if not errorList:
+                weight = 0
+                break
+            weight *= cumulative[-1]
+            sampled.append(propagated[i][errorList[bisect.bisect(cumulative, rng.random() * cumulative[-1])]])
+        if not weight:
+            continue
+
+        block_errors = tuple(listutils.mul(err[name] for err in sampled) for name in block_order)
+        try:
+            key = keys[block_errors]
+        except KeyError:
+            key = keys[block_errors] = tuple(emap(error) for emap, error in zip(block_error_maps, block_errors))
+
+        weights[key] = weights.get(key, 0) + weight
+        squares[key] = squares.get(key, 0) + weight ** 2
+        total_weight += weight
+        total_squares += weight ** 2
+
+    counts = {}
+    stderr = {}
+    for key in weights:
+        counts[key], stderr[key] = _mean_stderr(weights[key], squares[key], samples)
+    total, total_stderr = _mean_stderr(total_weight, total_squares, samples)
+    return OrderEstimate(k, counts, stderr, total, total_stderr, samples)
+
+def estimate_orders(component, noiseModels, pauli, kExact, samples=SAMPLES, rng=random):
+    '''
+    Counts orders up to kExact of each leaf of the component exactly, and
+    estimates the higher orders (up to kGood of the leaf) by sampling.  The
+    leaves are seeded with the counts, so that a subsequent call of
+    component.count(noiseModels, pauli) combines them.
+
+    Estimated counts must not be stored as if they were exact, so fetching
+    must be disabled (see cache.enableFetch()), and counting the component
+    fails while fetching is enabled.  To count exactly again, call
+    clearSeeds() on each leaf (see countable_leaves()), and cache.clearMemos()
+    to discard the memos that hold the estimates.
+
+    Returns the estimates of each distinct leaf, as a list of OrderEstimate
+    (one for each order), indexed by the cache name of the leaf.
+    '''
+    if cache.fetchEnabled:
+        raise RuntimeError('Estimated counts would be fetched as exact counts.  Disable fetching.')
+
+    # Estimate each distinct leaf once, up to the largest kGood of its instances.
+    instances = {}
+    for leaf in countable_leaves(component):
+        instances.setdefault(leaf._cacheName(), []).append(leaf)
+
+    estimates = {}
+    for name, leaves in sorted(instances.iteritems()):
+        args = leaves[0].orderArguments(noiseModels, pauli, 0)[1:]
+        orders = []
+        for k in range(max(leaf.kGood[pauli] for leaf in leaves) + 1):
+            if k <= kExact:
+                orders.append(OrderEstimate.exact(k, count_locations.count_errors_of_order_k(k, *args)))
+            else:
+                orders.append(sample_errors_of_order_k(k, *args, samples=samples, rng=rng))
+            logger.info('%s %s: %s', name, pauli, orders[-1])
+        estimates[name] = orders
+        for leaf in leaves:
+            leaf.seedOrders(noiseModels, pauli, [order.counts for order in orders[:leaf.kGood[pauli] + 1]],
+                            exact=kExact >= leaf.kGood[pauli])
+
+    return estimates
@@ -0,0 +1,169 @@
+'''
+Parameter sweeps over fault cutoffs and noise models.
+
+Counting a scheme at each point of a grid separately repeats most of the work,
+since grid points typically share sub-components.  For example, every point
+of a sweep over kExRec contains the same preparation and CNOT components.
+sweep() collects the countable (leaf) components of every grid point, and
+counts each distinct leaf, for each fault order, exactly once.  The order
+counts are distributed over the process pool (see concurrency.map_unordered())
+and then supplied to every grid point that contains the leaf.
+
+Only the leaves are shared below the named components of a grid point.  Each
+distinct named component (by repr()) is counted once, but a composite
+sub-component that occurs in several distinct named components is counted
+for each of them, unless its counts are fetched (see cache.fetchableOrders).
+'''
+from qfault.counting.component.base import CountableComponent
+from qfault.counting.count_locations import count_errors_of_order_k
+from qfault.qec.error import Pauli
+from qfault.util import concurrency
+import itertools
+import logging
+import time
+
+logger = logging.getLogger('counting.sweep')
+
+__all__ = ['grid', 'SweepPoint', 'sweep', 'countable_leaves']
+
+
+def grid(**axes):
+    '''
+    Returns the Cartesian product of the given parameter axes, as a list of
+    parameter dictionaries.
+
+    >>> grid(kEC=[1, 2], kPrep=[3])
+    [{'kEC': 1, 'kPrep': 3}, {'kEC': 2, 'kPrep': 3}]
+    '''
+    names = sorted(axes)
+    return [dict(zip(names, values)) for values in itertools.product(*[axes[name] for name in names])]
+
+
+class SweepPoint(object):
+    '''
+    The counts for a single grid point.
+
+    :ivar params: The parameters of the grid point.
+    :ivar components: The named components of the grid point.
+    :ivar noiseModels: The noise models of the grid point.
+    :ivar results: The CountResults, indexed by (name, pauli).
+    '''
+
+    def __init__(self, params, components, noiseModels):
+        self.params = params
+        self.components = components
+        self.noiseModels = noiseModels
+        self.results = {}
+
+    def __repr__(self):
+        return 'SweepPoint({0})'.format(self.params)
+
+
+def sweep(build, points, paulis=(Pauli.X, Pauli.Z, Pauli.Y), progress=None):
+    '''
+    Counts the components of each grid point.  Named components that are equal
+    (by repr()) are counted once, even if they belong to different grid points.
+
+    :param build: A function which, given the parameters of a grid point, returns a
+                  tuple (components, noiseModels) in which components is a dictionary
+                  of named components to count.
+    :param list points: The parameters of each grid point (see grid()).
+    :param paulis: (optional) The error types to count.
+    :param progress: (optional) A function progress(done, total), called each time
+                     a leaf order has been counted.
+    :rtype: list of :class:`SweepPoint`
+    '''
+    sweepPoints = []
+    for params in points:
+        components, noiseModels = build(params)
+        sweepPoints.append(SweepPoint(params, components, noiseModels))
+
+    leaves = _collect_leaves(sweepPoints, paulis)
+    counts = _count_leaves(leaves, progress)
+
+    # Hand the counts to every instance of each leaf.  The leaves hold the
+    # counts only until the grid points have been counted.
+    for key, (_, noiseModels, pauli, _, instances) in leaves.iteritems():
+        for leaf, leafNoiseModels in instances:
+            leaf.seedOrders(leafNoiseModels, pauli, counts[key][:leaf.kGood[pauli] + 1])
+
+    try:
+        results = {}
+        for point in sweepPoints:
+            for name, component in sorted(point.components.iteritems()):
+                for pauli in paulis:
+                    key = (repr(component), pauli, str(point.noiseModels[pauli]))
+                    if key not in results:
+                        logger.info('%s: counting %s %s', point, name, pauli)
+                        results[key] = component.count(point.noiseModels, pauli)
+                    point.results[(name, pauli)] = results[key]
+    finally:
+        for _, _, _, _, instances in leaves.itervalues():
+            for leaf, _ in instances:
+                leaf.clearSeeds()
+
+    return sweepPoints
+
+def _collect_leaves(sweepPoints, paulis):
+    '''
+    Returns the distinct countable components of all grid points, indexed by
+    (cache name, pauli, noise model).  Each entry is a list [leaf, noiseModels,
+    pauli, kMax, instances], where leaf is a representative, kMax is the largest
+    order needed by any instance, and instances is a list of (leaf, noiseModels).
+    '''
+    leaves = {}
+    for point in sweepPoints:
+        for component in point.components.itervalues():
+            for leaf in countable_leaves(component):
+                for pauli in paulis:
+                    key = (leaf._cacheName(), pauli, str(point.noiseModels[pauli]))
+                    entry = leaves.setdefault(key, [leaf, point.noiseModels, pauli, 0, []])
+                    entry[3] = max(entry[3], leaf.kGood[pauli])
+                    entry[4].append((leaf, point.noiseModels))
+    return leaves
+
+def countable_leaves(component):
+    '''
+    Iterates over the countable components (leaves) of the given component.
+    Leaves that occur more than once are repeated.
+    '''
+    if isinstance(component, CountableComponent):
+        yield component
+    for sub in component.subcomponents():
+        for leaf in countable_leaves(sub):
+            yield leaf
+
+def _count_leaves(leaves, progress):
+    '''
+    Counts each order of each distinct leaf on the process pool.  Returns the
+    order counts, indexed like leaves.
+    '''
+    tasks = []
+    for key, (leaf, noiseModels, pauli, kMax, _) in leaves.iteritems():
+        for k in range(kMax + 1):
+            tasks.append((key, leaf.orderArguments(noiseModels, pauli, k)))
+
+    # Start with the largest orders so that the pool is not left waiting
+    # on a single large task at the end.
+    tasks.sort(key=lambda task: (task[1][0], len(task[1][1])), reverse=True)
+
+    counts = {key: [None] * (entry[3] + 1) for key, entry in leaves.iteritems()}
+    logger.info('Counting %s orders of %s distinct components', len(tasks), len(leaves))
+    start = time.time()
+    results = concurrency.map_unordered(_count_order, (args for _, args in tasks))
+    for done, (i, countsK) in enumerate(results, 1):
+        key, args = tasks[i]
+        counts[key][args[0]] = countsK
+        logger.info('[%s/%s] %s %s k=%s (%.1fs)', done, len(tasks), key[0], key[1], args[0], time.time() - start)
+        if None != progress:
+            progress(done, len(tasks))
+
+    return counts
+
+def _count_order(args):
+    return count_errors_of_order_k(*args)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,220 @@
+'''
+Truncation of count tables.
+
+A truncated count table keeps only its heaviest keys.  The total count of
+all other keys is merged into a single remainder bucket, stored under the
+key REMAINDER.  The key of the bucket is unknown, so it must be handled
+conservatively:
+
+- key maps (see count_locations.map_counts()) pass the bucket through unchanged,
+- convolution of the bucket with anything else yields the bucket,
+- filters treat the bucket as accepted when counting and as rejected when
+  bounding the acceptance probability, and
+- upper bounds on probabilities (see probability.counts_as_poly()) include
+  the bucket, whereas lower bounds exclude it.
+
+The total count of each table is preserved by truncation and by convolution.
+'''
+from qfault.counting import aggregate
+import itertools
+import logging
+import operator
+import sys
+
+logger = logging.getLogger('counting.truncation')
+
+__all__ = ['REMAINDER',
+           'TopN',
+           'WeightFraction',
+           'MemoryBudget',
+           'truncate_counts',
+           'set_truncation_policy',
+           'truncation_policy']
+
+
+class _Remainder(object):
+    '''
+    The key of the remainder bucket.  There is exactly one instance, REMAINDER.
+    '''
+
+    def __hash__(self):
+        # Spilled runs are sorted by hash, so the hash must not depend on the process.
+        return hash('REMAINDER')
+
+    def __reduce__(self):
+        # Unpickle to the module-level instance, so that identity tests work
+        # across processes.
+        return 'REMAINDER'
+
+    def __repr__(self):
+        return 'REMAINDER'
+
+REMAINDER = _Remainder()
+
+
+class TopN(object):
+    '''
+    Keeps the n heaviest keys of each table.
+
+    >>> TopN(2).num_kept([('a', 5), ('b', 3), ('c', 1)])
+    2
+    '''
+
+    def __init__(self, n):
+        self.n = n
+
+    def num_kept(self, items):
+        return min(self.n, len(items))
+
+    def __repr__(self):
+        return 'TopN({0})'.format(self.n)
+
+
+class WeightFraction(object):
+    '''
+    Keeps the heaviest keys of each table such that the total count of the
+    remaining keys is at most the given fraction of the total count.
+
+    >>> WeightFraction(0.2).num_kept([('a', 5), ('b', 3), ('c', 1), ('d', 1)])
+    2
+    '''
+
+    def __init__(self, fraction):
+        self.fraction = fraction
+
+    def num_kept(self, items):
+        limit = self.fraction * sum(count for _, count in items)
+        dropped = 0
+        kept = len(items)
+        while kept and dropped + items[kept-1][1] <= limit:
+            kept -= 1
+            dropped += items[kept][1]
+        return kept
+
+    def __repr__(self):
+        return 'WeightFraction({0})'.format(self.fraction)
+
+
+class MemoryBudget(object):
+    '''
+    Keeps the heaviest keys of each table such that the (estimated)
+    memory used by the table is at most max_bytes.
+
+    >>> MemoryBudget(0).num_kept([((0, 1), 5), ((1, 1), 3)])
+    0
+    '''
+
+    # Approximate size of a single dict slot (hash, key pointer, value pointer),
+    # including the unused slots of a typical dict.
+    _SLOT_BYTES = 3 * 3 * 8
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+
+    def num_kept(self, items):
+        if not items:
+            return 0
+        key, count = items[0]
+        entry_bytes = sys.getsizeof(key) + sys.getsizeof(count) + self._SLOT_BYTES
+        return min(self.max_bytes // entry_bytes, len(items))
+
+    def __repr__(self):
+        return 'MemoryBudget({0})'.format(self.max_bytes)
+
+
+_policy = None
+
+def set_truncation_policy(policy):
+    '''
+    Sets the policy used to truncate the counts of countable components.
+    Use None to disable truncation (the default).
+
+    :param policy: A truncation policy, i.e., TopN, WeightFraction or MemoryBudget.
+    '''
+    global _policy
+    _policy = policy
+    logger.info('Count truncation policy: %s', policy)
+
+def truncation_policy():
+    '''
+    Returns the current truncation policy, or None.
+    '''
+    return _policy
+
+def truncate_counts(counts, policy):
+    '''
+    Truncates each of the given count tables according to policy.  Tables that
+    do not need to be truncated are returned as-is.
+
+    >>> counts = [{(0,): 1}, {(1,): 5, (2,): 3, (3,): 1}]
+    >>> truncate_counts(counts, TopN(1)) == [{(0,): 1}, {(1,): 5, REMAINDER: 4}]
+    True
+    '''
+    return [_truncate_table(countsK, policy) for countsK in counts]
+
+def _truncate_table(countsK, policy):
+    table, remainder = split_remainder(countsK)
+    items = sorted(table.iteritems(), key=operator.itemgetter(1), reverse=True)
+    kept = policy.num_kept(items)
+    if kept >= len(items):
+        return countsK
+
+    truncated = dict(items[:kept])
+    truncated[REMAINDER] = remainder + sum(count for _, count in items[kept:])
+    return truncated
+
+def split_remainder(countsK):
+    '''
+    Returns a tuple (counts, remainder) in which counts is the given table
+    without the remainder bucket, and remainder is the count of the bucket.
+
+    >>> split_remainder({(1,): 2, REMAINDER: 3})
+    ({(1,): 2}, 3)
+    '''
+    if isinstance(countsK, dict):
+        if REMAINDER not in countsK:
+            return countsK, 0
+        table = dict(countsK)
+        remainder = table.pop(REMAINDER)
+    else:
+        # A single scan of the table.
+        remainder = countsK.get(REMAINDER)
+        if None == remainder:
+            return countsK, 0
+        table = aggregate.collect(item for item in countsK.iteritems()
+                                       if item[0] is not REMAINDER)
+    return table, remainder
+
+def add_remainder(countsK, remainder):
+    '''
+    Adds the given count to the remainder bucket of countsK.  The table
+    may be modified in place, so it must not be shared.
+    '''
+    if isinstance(countsK, dict):
+        countsK[REMAINDER] = countsK.get(REMAINDER, 0) + remainder
+        return countsK
+    return aggregate.collect(itertools.chain(countsK.iteritems(), [(REMAINDER, remainder)]))
+
+def preserve_remainder(keymap, countsK):
+    '''
+    Returns a key map that is equivalent to keymap, except that the remainder
+    bucket (if it could be present in countsK) is mapped to itself.
+    '''
+    if isinstance(countsK, dict) and REMAINDER not in countsK:
+        return keymap
+    return _RemainderPreserver(keymap)
+
+class _RemainderPreserver(object):
+
+    def __init__(self, keymap):
+        self._keymap = keymap
+
+    def __call__(self, key):
+        if key is REMAINDER:
+            return key
+        return self._keymap(key)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
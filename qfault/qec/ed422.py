@@ -6,7 +6,7 @@ Created on 2011-09-09
 from qfault.circuit.location import Locations
 from encode.ancilla import ancillaZPrep
 from error import Pauli
-from qecc import CssCode
+from qecc import CssCode, correctionArray
 import error as error
 from qfault.util.cache import memoize
 
@@ -74,6 +74,14 @@ class ED412Code(CssCode):
         #print 's=', s, 'corr=', corr
         return corr
     
+    def correctionTable(self):
+        return self._correctionArray(self._gaugeType)
+    
+    @staticmethod
+    @memoize
+    def _correctionArray(gaugeType):
+        return correctionArray(ED412Code._syndromeCorrectionTable(gaugeType))
+    
     @staticmethod
     @memoize
     def _syndromeCorrectionTable(gaugeType):
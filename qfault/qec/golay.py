@@ -5,20 +5,49 @@ Created on 2010-04-16
 '''
 from error import Pauli
 from qecc import CssCode
+from qfault.qec import tables
 from qfault.util import bits, iteration
 from qfault.util.bits import weight
 from qfault.util.cache import fetchable
 import logging
+import numpy
 
 logger = logging.getLogger('Golay')
 
+def divideByGenerator(pattern):
+    '''
+    Returns the remainder after dividing the pattern by the generator
+    polynomial of the Golay code, one bit at a time.  See GolayCode.getSyndrome().
+    '''
+    X22    = 1<<22                # vector representation of X^22
+    X11    = 1<<11                # vector representation of X^11
+    MASK12 = (1<<23)-(1<<11)    # auxiliary vector for testing
+    GENPOL = 0xc75                # generator polynomial, g(x) = x^11+x^10+x^6+x^5+x^4+x^2+1
+    
+    aux = X22
+    if pattern >= X11:
+        while pattern & MASK12: 
+            while not (aux & pattern): 
+                aux = aux >> 1
+            pattern ^= (aux/X11) * GENPOL
+    return pattern
+
+# The syndromes of each value of bytes 0, 1 and 2 (bits 16 to 22) of a pattern.
+_syndromeTables = [[divideByGenerator(b << shift) for b in range(1 << min(8, 23 - shift))]
+                   for shift in (0, 8, 16)]
+_syndromeArrays = [numpy.array(table, dtype=numpy.int64) for table in _syndromeTables]
+
 class GolayCode(CssCode):
     
     def __init__(self):
         super(GolayCode, self).__init__('Golay', 23, 1, 7)
         
-        # TODO: really should make this static        
-        self.corrections = GolayCode.generateCorrectionsTable()
+    @property
+    def corrections(self):
+        '''
+        The correction of each syndrome, shared by all instances (see tables).
+        '''
+        return tables.decoderTable('golay.corrections', GolayCode.generateCorrectionsTable)
     
     def hashError(self, e, eType, logical=False):
     
@@ -28,14 +57,15 @@ class GolayCode(CssCode):
         syndrome = self.getSyndrome(e)
         # TODO is there an existing package that does bit counting/manipulation?
         parity = bits.parity(e, 23)
-        eMin = minErrors[syndrome][parity]
+        minErrors = minErrorsTable()
+        eMin = int(minErrors[syndrome][parity])
         if not logical: 
             return eMin
         
         # The logical X/Z operator effectively measures the parity of the error.
         # If it is included in the stabilizer, then even/odd parity errors with
         # the same syndrome are equivalent.
-        eMinL = minErrors[syndrome][parity^1]
+        eMinL = int(minErrors[syndrome][parity^1])
         
         w1 = bits.weight(eMin, 23)
         w2 = bits.weight(eMinL, 23)
@@ -43,7 +73,7 @@ class GolayCode(CssCode):
         
     def getCorrection(self, e, eType):
         reduced = self.hashError(e, eType)        
-        return self.corrections[self.getSyndrome(reduced)]
+        return int(self.corrections[self.getSyndrome(reduced)])
     
     def decodeError(self, e, eType):
         # We have a logical error if the result of the correction anti-commutes
@@ -64,22 +94,28 @@ class GolayCode(CssCode):
         bits, when constructing the encoding table; (2) pattern = error pattern,
         when constructing the decoding table; and (3) pattern = received vector, to
         obtain its syndrome in decoding.
-        """
         
-        #TODO Generalize for any stabilizer code with a generator polynomial
+        The remainder is linear in the pattern, so it is the XOR of the
+        remainders of each byte of the pattern, which are looked up in tables.
         
-        X22    = 1<<22                # vector representation of X^22
-        X11    = 1<<11                # vector representation of X^11
-        MASK12 = (1<<23)-(1<<11)    # auxiliary vector for testing
-        GENPOL = 0xc75                # generator polynomial, g(x) = x^11+x^10+x^6+x^5+x^4+x^2+1
+        >>> GolayCode.getSyndrome(0b110101101010011001011) == divideByGenerator(0b110101101010011001011)
+        True
+        """
+        return (_syndromeTables[0][pattern & 0xff] ^ 
+                _syndromeTables[1][(pattern >> 8) & 0xff] ^ 
+                _syndromeTables[2][pattern >> 16])
+        
+    @staticmethod
+    def getSyndromes(patterns):
+        """Returns an array of the syndromes of an array of 23-bit patterns.
         
-        aux = X22
-        if pattern >= X11:
-            while pattern & MASK12: 
-                while not (aux & pattern): 
-                    aux = aux >> 1
-                pattern ^= (aux/X11) * GENPOL
-        return pattern
+        >>> list(GolayCode.getSyndromes([0, 1 << 11, 3 << 20]))
+        [0, 1141, 1193]
+        """
+        patterns = numpy.asarray(patterns, dtype=numpy.int64)
+        return (_syndromeArrays[0][patterns & 0xff] ^ 
+                _syndromeArrays[1][(patterns >> 8) & 0xff] ^ 
+                _syndromeArrays[2][patterns >> 16])
     
     @staticmethod
     def generateCorrectionsTable(): 
@@ -156,39 +192,31 @@ def calcMinErrors():
     >>> mins[syndrome][parity]
     3189
     '''
-    # A list of error pairs (even-parity error, odd-parity error), indexed by syndrome.
-    # Each pair contains a tuple that records the pattern and weight of the 
-    # minimum weight error for that syndrome.
-    #minWeightForSyndrome = [[(None,24),(None,24)]] * (1<<11)
-    minWeightForSyndrome = [[24, 24] for _ in range (1<<11)]
-    minErrorForSyndrome = [[None, None] for _ in range (1<<11)] 
-    
     logger.info('Calculating minimum weight error for each syndrome')
-    onePercent = (1<<23)/100
-    percentComplete = 0
     
-    for error in range(1<<23):
-        
-        if not(error % onePercent):            
-            logger.info(str(percentComplete) + ' percent done.')
-            percentComplete += 1
-            
-        rawWeight = weight(error, 23)
-        parity = rawWeight % 2
-        syndrome = GolayCode.getSyndrome(error)
-        
-        #print 'error={0:b} weight={1} parity={2} syndrome={3:b}\n'.format(error, rawWeight, parity, syndrome)
-        
-        currentMin = minWeightForSyndrome[syndrome][parity] 
-        
-        if(currentMin > rawWeight):
-            minWeightForSyndrome[syndrome][parity] = rawWeight
-            minErrorForSyndrome[syndrome][parity] = error                
+    # The errors are sorted by syndrome, parity, weight and then pattern, in a
+    # single key, so that the first error of each (syndrome, parity) has
+    # minimum weight (and, of those, the smallest pattern).
+    errors = numpy.arange(1 << 23, dtype=numpy.int64)
+    weights = numpy.zeros(len(errors), dtype=numpy.int64)
+    byteWeights = numpy.array([weight(b) for b in range(1 << 8)], dtype=numpy.int64)
+    for shift in (0, 8, 16):
+        weights += byteWeights[(errors >> shift) & 0xff]
+    keys = (((GolayCode.getSyndromes(errors) << 1) | (weights & 1)) << 28) | (weights << 23) | errors
+    del weights
+    keys.sort()
+    
+    groups = keys >> 28
+    first = numpy.flatnonzero(numpy.concatenate(([True], groups[1:] != groups[:-1])))
+    minErrorForSyndrome = [[None, None] for _ in range (1<<11)]
+    for group, error in zip(groups[first], keys[first] & ((1 << 23) - 1)):
+        minErrorForSyndrome[group >> 1][group & 1] = int(error)
     
     return minErrorForSyndrome
 
-#
-# Module Initialization
-#
-# Load/Pre-Compute the minimum weight error for each syndrome.
-#minErrors = calcMinErrors()
\ No newline at end of file
+def minErrorsTable():
+    '''
+    Returns the minimum weight errors of calcMinErrors(), as a table indexed by
+    syndrome and then by parity, shared by all instances (see tables).
+    '''
+    return tables.decoderTable('golay.minErrors', calcMinErrors.func)
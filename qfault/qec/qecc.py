@@ -5,7 +5,12 @@ Created on Mar 3, 2010
 '''
 from error import Pauli, PauliError
 import error as error
-from qfault.util import bits, listutils
+from qfault.qec import tables
+from qfault.util import bits, concurrency, listutils
+import gmpy
+import hashlib
+import itertools
+import numpy
 
 class Qecc(object):
     '''
@@ -56,6 +61,182 @@ class QeccNone(Qecc):
         super(self.__class__, self).__init__('QeccNone', n, n, 0)
              
     
+class ParityCheckMatrix(object):
+    '''
+    A compiled list of parity checks (e.g., stabilizer generators).  Each
+    check is stored as a single bit mask of its Z and X parts, so that the
+    syndrome bit of an error is the parity of the error (packed as its X and
+    Z parts) masked by the check.  Syndromes are given in descending check
+    order, as for StabilizerCode.Syndrome().
+    
+    >>> checks = ParityCheckMatrix([Pauli.X+Pauli.X, Pauli.Z+Pauli.Z, Pauli.Y+Pauli.Z])
+    >>> str('{0:b}'.format(checks.syndrome(Pauli.Y + Pauli.X)))
+    '101'
+    >>> list(checks.syndromes([0b11, 0b10], [0b10, 0b00]))
+    [5, 3]
+    '''
+    
+    def __init__(self, checks):
+        checks = list(checks)
+        self.length = max([len(check) for check in checks] + [0])
+        self._rows = [(check.ebits[error.zType] << self.length) | check.ebits[error.xType] for check in checks]
+        self._xRows = [check.ebits[error.xType] for check in checks]
+        self._zRows = [check.ebits[error.zType] for check in checks]
+        
+    def __len__(self):
+        return len(self._rows)
+        
+    def syndrome(self, e):
+        '''
+        Returns the syndrome of the error e (a PauliError).
+        '''
+        packed = (e.ebits[error.xType] << self.length) | e.ebits[error.zType]
+        s = 0
+        for row in self._rows:
+            s = (s << 1) | (gmpy.popcount(packed & row) & 1)
+        return s
+    
+    def syndromes(self, xbits, zbits):
+        '''
+        Returns an array of the syndromes of errors given by arrays of their X
+        and Z parts.  The code must have fewer than 64 qubits.
+        '''
+        if self.length > 63:
+            raise ValueError('Batch syndromes of {0} qubits are not supported'.format(self.length))
+        xbits = numpy.asarray(xbits, dtype=numpy.int64)
+        zbits = numpy.asarray(zbits, dtype=numpy.int64)
+        s = numpy.zeros(xbits.shape, dtype=numpy.int64)
+        for xRow, zRow in zip(self._xRows, self._zRows):
+            s <<= 1
+            s |= _parities((xbits & zRow) ^ (zbits & xRow))
+        return s
+    
+def _parities(values):
+    '''
+    Returns the parity of each of an array of (non-negative) 64-bit integers.
+    '''
+    values = values.copy()
+    for shift in (32, 16, 8, 4, 2, 1):
+        values ^= values >> shift
+    return values & 1
+
+# The number of errors enumerated by each task of minWeightCorrections().
+CORRECTION_CHUNK = 1 << 16
+
+def minWeightCorrections(generators, n):
+    '''
+    Returns an array of minimum-weight corrections for the stabilizer
+    generators of an n-qubit code.  Row s holds the X and Z parts of the
+    correction of syndrome s (see StabilizerCode.syndromeCorrection()).
+    
+    Errors are enumerated breadth-first, in order of increasing weight, until
+    every syndrome has been found.  The first error found for each syndrome is
+    kept, so ties are broken in favor of the last qubits.  The errors of each
+    weight are enumerated concurrently.  If each generator is either an X or a
+    Z operator (i.e., the code is a CSS code), the X and Z parts of the
+    corrections are found separately, each of minimum weight.
+    
+    >>> table = minWeightCorrections([Pauli.X+Pauli.X+Pauli.I, Pauli.I+Pauli.X+Pauli.X], 3)
+    >>> [str(PauliError(3, x, z)) for x, z in table]
+    ['III', 'IIZ', 'ZII', 'IZI']
+    '''
+    generators = tuple(generators)
+    matrix = ParityCheckMatrix(generators)
+    r = len(generators)
+    
+    xMask = _syndromeMask(generators, error.xType)
+    zMask = _syndromeMask(generators, error.zType)
+    if xMask | zMask != (1 << r) - 1:
+        rank = _rank([(g.ebits[error.zType] << n) | g.ebits[error.xType] for g in generators])
+        return _enumerateCorrections(matrix, n, ((1, 0), (0, 1), (1, 1)), 1 << rank)
+    
+    # X errors flip only the syndrome bits of the Z generators, and vice versa.
+    zGenerators = [g.ebits[error.zType] for g in generators if not g.ebits[error.xType]]
+    xGenerators = [g.ebits[error.xType] for g in generators if not g.ebits[error.zType]]
+    xTable = _enumerateCorrections(matrix, n, ((1, 0),), 1 << _rank(zGenerators))
+    zTable = _enumerateCorrections(matrix, n, ((0, 1),), 1 << _rank(xGenerators))
+    syndromes = numpy.arange(1 << r, dtype=numpy.int64)
+    table = numpy.empty((1 << r, 2), dtype=numpy.int64)
+    table[:, 0] = xTable[syndromes & zMask, 0]
+    table[:, 1] = zTable[syndromes & xMask, 1]
+    return table
+
+def _syndromeMask(generators, eType):
+    '''
+    Returns the mask of the syndrome bits of the generators that contain only
+    Paulis of the given type.
+    '''
+    dual = error.dualType(eType)
+    r = len(generators)
+    return sum(1 << (r - 1 - i) for i, g in enumerate(generators) if not g.ebits[dual])
+
+def _rank(rows):
+    '''
+    Returns the rank (over GF(2)) of a list of rows given as bit strings.
+    '''
+    pivots = []
+    for row in rows:
+        for pivot in pivots:
+            row = min(row, row ^ pivot)
+        if row:
+            pivots.append(row)
+    return len(pivots)
+
+def _enumerateCorrections(matrix, n, paulis, reachable):
+    table = numpy.zeros((1 << len(matrix), 2), dtype=numpy.int64)
+    found = numpy.zeros(1 << len(matrix), dtype=bool)
+    count = 0
+    for weight in xrange(n + 1):
+        supports = itertools.combinations(xrange(n), weight)
+        size = max(1, CORRECTION_CHUNK // len(paulis) ** weight)
+        chunks = iter(lambda: list(itertools.islice(supports, size)), [])
+        for syndromes, xbits, zbits in concurrency.map_concurrent(_CorrectionChunk(matrix, paulis, weight), chunks):
+            new = ~found[syndromes]
+            syndromes = syndromes[new]
+            table[syndromes, 0] = xbits[new]
+            table[syndromes, 1] = zbits[new]
+            found[syndromes] = True
+            count += len(syndromes)
+        if count == reachable:
+            break
+    return table
+
+class _CorrectionChunk(object):
+    '''
+    Returns the first error of each syndrome among the errors of the given
+    weight that are supported on a list of sets of qubits.
+    '''
+    
+    def __init__(self, matrix, paulis, weight):
+        self._matrix = matrix
+        self._paulis = paulis
+        self._weight = weight
+        
+    def __call__(self, supports):
+        masks = numpy.left_shift(1, numpy.array(supports, dtype=numpy.int64).reshape(len(supports), self._weight))
+        choices = list(itertools.product(range(len(self._paulis)), repeat=self._weight))
+        choices = numpy.array(choices, dtype=numpy.int64).reshape(len(choices), self._weight)
+        paulis = numpy.array(self._paulis, dtype=numpy.int64)
+        xbits = numpy.zeros((len(supports), len(choices)), dtype=numpy.int64)
+        zbits = numpy.zeros((len(supports), len(choices)), dtype=numpy.int64)
+        for j in range(self._weight):
+            xbits |= masks[:, j, None] * paulis[choices[:, j], 0]
+            zbits |= masks[:, j, None] * paulis[choices[:, j], 1]
+        xbits = xbits.ravel()
+        zbits = zbits.ravel()
+        syndromes, first = numpy.unique(self._matrix.syndromes(xbits, zbits), return_index=True)
+        return syndromes, xbits[first], zbits[first]
+
+def correctionArray(corrections):
+    '''
+    Returns a read-only array of the X and Z parts of the given list of
+    corrections (PauliErrors), as for minWeightCorrections().
+    '''
+    table = numpy.array([(c.ebits[error.xType], c.ebits[error.zType]) for c in corrections],
+                        dtype=numpy.int64).reshape(-1, 2)
+    table.setflags(write=False)
+    return table
+    
 class StabilizerCode(Qecc):
     
     @staticmethod
@@ -80,7 +261,17 @@ class StabilizerCode(Qecc):
 
     
     def getSyndrome(self, e):
-        return self.Syndrome(e, self.stabilizerGenerators())
+        return self.parityCheckMatrix().syndrome(e)
+    
+    def parityCheckMatrix(self):
+        '''
+        Returns the stabilizer generators, compiled as a ParityCheckMatrix.
+        '''
+        try:
+            return self._parityCheckMatrix
+        except AttributeError:
+            self._parityCheckMatrix = ParityCheckMatrix(self.stabilizerGenerators())
+            return self._parityCheckMatrix
     
 #    def hashError(self, e):
 #        return self.Syndrome(e, self.stabilizerGenerators() + self.normalizerGenerators())
@@ -148,10 +339,32 @@ class StabilizerCode(Qecc):
     def syndromeCorrection(self, s):
         '''
         Returns the Pauli recovery operation corresponding to syndrome s.
+        By default, the correction is looked up in correctionTable().
         :param int s: The syndrome. Syndrome bits must be given in descending generator order. 
                       Bit i of s corresponds to self.stabilizerGenerators[self.n - i].
         '''
-        raise NotImplementedError
+        xbits, zbits = self.correctionTable()[s]
+        return PauliError(self.n, int(xbits), int(zbits))
+    
+    def correctionTable(self):
+        '''
+        Returns a read-only array of the corrections of all syndromes.  Row s
+        holds the X and Z parts of syndromeCorrection(s).  By default, the
+        corrections have minimum weight (see minWeightCorrections()).  The
+        table is built once for each set of generators, and saved (see
+        tables.decoderTable()).  Subclasses that override syndromeCorrection()
+        must also override this method (see correctionArray()).
+        '''
+        try:
+            name = self._correctionTableName
+        except AttributeError:
+            generators = [(g.ebits[error.xType], g.ebits[error.zType]) for g in self.stabilizerGenerators()]
+            name = 'corrections.' + hashlib.sha1(repr((self.n, generators))).hexdigest()
+            self._correctionTableName = name
+        return tables.decoderTable(name, self._minWeightCorrections)
+    
+    def _minWeightCorrections(self):
+        return minWeightCorrections(self.stabilizerGenerators(), self.n)
     
     def decodeError(self, e):
         '''
@@ -0,0 +1,81 @@
+'''
+A registry of decoder lookup tables.
+
+Lookup tables, such as the correction of each syndrome, depend only on the
+definition of a code, yet were built for every code object, and again in
+every worker process.  decoderTable() builds each table once, saves it to a
+.npy file in the table directory, and memory-maps the file read-only.  Each
+process then maps a table at most once, and processes share the pages of the
+file.  Tables are read-only numpy arrays.
+
+If fetching is disabled (see cache.enableFetch()), tables are built in memory
+and are not saved.
+'''
+from qfault.util import cache
+import errno
+import logging
+import numpy
+import os
+import tempfile
+
+logger = logging.getLogger('qec.tables')
+
+__all__ = ['decoderTable', 'setTableDir', 'clearTables']
+
+# The tables are kept with the other fetched data (see cache.DataManager).
+_tableDir = os.path.join(os.path.pardir, 'data', 'tables')
+_tables = {}
+
+
+def setTableDir(path):
+    '''
+    Sets the directory of the table files.
+    '''
+    global _tableDir
+    _tableDir = path
+    clearTables()
+
+def clearTables():
+    '''
+    Discards the tables held by this process.  The table files are kept.
+    '''
+    _tables.clear()
+
+def decoderTable(name, build):
+    '''
+    Returns the table with the given name.  If the table is not held by this
+    process, it is mapped from its file or, if there is no file, built by
+    calling build() and saved.  The name must identify the code definition
+    (e.g., 'golay.corrections'), since tables are shared by all callers.
+    '''
+    try:
+        return _tables[name]
+    except KeyError:
+        pass
+
+    if not cache.fetchEnabled:
+        table = numpy.asarray(build())
+        table.setflags(write=False)
+    else:
+        table = _mapTable(name, build)
+    _tables[name] = table
+    return table
+
+def _mapTable(name, build):
+    path = os.path.join(_tableDir, name + '.npy')
+    if not os.path.exists(path):
+        logger.info('Building decoder table %s', name)
+        table = numpy.asarray(build())
+        try:
+            os.makedirs(_tableDir)
+        except OSError as e:
+            # Another process may have made the directory.
+            if errno.EEXIST != e.errno:
+                raise
+        # Write to a temporary file and then rename it, so that processes
+        # that build the same table never read a partial file.
+        handle, temp = tempfile.mkstemp(suffix='.npy', dir=_tableDir)
+        with os.fdopen(handle, 'wb') as f:
+            numpy.save(f, table)
+        os.rename(temp, path)
+    return numpy.load(path, mmap_mode='r')
@@ -0,0 +1,160 @@
+'''
+Batched, reproducible Monte Carlo sampling on the process pool.
+
+Submitting one task per shot costs a round trip to a worker for every shot,
+and workers that draw from the global random module share no well-defined
+state.  sample_batches() instead splits the shots into large batches, each of
+which is sampled by a single call of the sampler with its own random number
+generator.  The generator of each batch is seeded from a master seed and the
+index of the batch, so that the streams of the batches are independent, and
+the result depends only on the master seed and the batch size, not on the
+number of workers or the order in which the batches complete.  (Reductions of
+floating-point values, such as stats.RunningStats, are grouped by worker, and
+so may differ in rounding.)
+
+The results of the batches are combined by a reduction that consumes them one
+at a time, first within each slice of batches on a worker, and then across
+the slices (see concurrency.mapreduce_concurrent()).
+
+>>> def heads(rng, shots):
+...     return sum(rng.random() < 0.5 for _ in xrange(shots))
+>>> first = sample_batches(heads, 1000, seed=1, batch_size=300)
+>>> first == sample_batches(heads, 1000, seed=1, batch_size=300)
+True
+>>> add_tallies([([1, 0], 2, {'a': 1}), ([0, 3], 1, {'a': 1, 'b': 2})])
+([1, 3], 3, {'a': 2, 'b': 2})
+'''
+from qfault.util import concurrency
+import hashlib
+import logging
+import numpy
+import random
+
+logger = logging.getLogger('sim.batch')
+
+__all__ = ['BATCH_SIZE', 'batch_rng', 'add_tallies', 'sample_batches', 'sample_until']
+
+# The default number of shots in each batch.
+BATCH_SIZE = 10000
+
+# The default number of batches sampled between checks of a stopping rule.
+ROUND_BATCHES = 16
+
+
+def _batch_digest(seed, index):
+    return hashlib.sha1('{0}:{1}'.format(seed, index)).digest()
+
+def _master_seed(seed):
+    if None == seed:
+        seed = random.SystemRandom().getrandbits(64)
+        logger.info('Sampling with seed %d', seed)
+    return seed
+
+def batch_rng(seed, index, use_numpy=False):
+    '''
+    Returns the random number generator of the given batch: a random.Random
+    instance or, if use_numpy is True, a numpy.random.RandomState instance.
+    The generator is seeded with a hash of the master seed and the index.
+    '''
+    digest = _batch_digest(seed, index)
+    if use_numpy:
+        return numpy.random.RandomState(numpy.frombuffer(digest, dtype=numpy.uint32))
+    return random.Random(long(digest.encode('hex'), 16))
+
+def add_tallies(tallies):
+    '''
+    Returns the sum of the given tallies.  A tally is a number, or a list,
+    tuple or dictionary of tallies, which are summed element-wise (or
+    key-wise).  The tallies are consumed one at a time.  Tallies of None (e.g.,
+    the reductions of empty slices) are ignored.
+    '''
+    total = None
+    for tally in tallies:
+        if tally is None:
+            continue
+        total = tally if total is None else _add(total, tally)
+    return total
+
+def _add(total, tally):
+    if isinstance(total, dict):
+        total = dict(total)
+        for key, value in tally.iteritems():
+            total[key] = _add(total[key], value) if key in total else value
+        return total
+    if isinstance(total, (list, tuple)):
+        return type(total)(_add(a, b) for a, b in zip(total, tally))
+    return total + tally
+
+
+class _Batch(object):
+    '''
+    Samples the batch with the given index.
+    '''
+
+    def __init__(self, sampler, shots, seed, batch_size, use_numpy):
+        self._sampler = sampler
+        self._shots = shots
+        self._seed = seed
+        self._batch_size = batch_size
+        self._use_numpy = use_numpy
+
+    def __call__(self, index):
+        size = min(self._batch_size, self._shots - index * self._batch_size)
+        return self._sampler(batch_rng(self._seed, index, self._use_numpy), size)
+
+def sample_batches(sampler, shots, seed=None, reduce_func=add_tallies, batch_size=BATCH_SIZE,
+                   use_numpy=False):
+    '''
+    Samples the given number of shots concurrently, in batches.  Returns the
+    reduction of the results of sampler(rng, size) over the batches, in which
+    rng is the generator of the batch (see batch_rng()) and size is its number
+    of shots.
+
+    The sampler must draw only from rng for the result to be repeatable.  It
+    is sent to the workers, so it must be picklable (e.g., a functools.partial
+    of a module-level function).  reduce_func must accept any iterable, and
+    must also reduce its own results (e.g., add_tallies or sum).
+
+    :param seed: (optional) The master seed.  By default, a seed is drawn from
+                 the operating system, and logged.
+    '''
+    seed = _master_seed(seed)
+
+    batches = (shots + batch_size - 1) // batch_size
+    batch = _Batch(sampler, shots, seed, batch_size, use_numpy)
+    return concurrency.mapreduce_concurrent(batch, reduce_func, xrange(batches))
+
+def sample_until(sampler, stop, seed=None, max_shots=None, batch_size=BATCH_SIZE,
+                 round_batches=ROUND_BATCHES, use_numpy=False):
+    '''
+    Samples in rounds of round_batches batches, as for sample_batches(), until
+    stop(total) is True for the sum of the results (see add_tallies()), or
+    max_shots have been sampled.  Returns the sum.
+
+    The batches of each round continue the streams of the previous rounds,
+    and the rule is checked only between rounds, so the result is repeatable
+    for a given seed.  For example, stop may be a stats.NarrowInterval of the
+    failure rate.
+    '''
+    seed = _master_seed(seed)
+
+    total = None
+    start = 0
+    while None == max_shots or start * batch_size < max_shots:
+        stop_index = start + round_batches
+        shots = stop_index * batch_size
+        if None != max_shots:
+            shots = min(shots, max_shots)
+            stop_index = min(stop_index, (shots + batch_size - 1) // batch_size)
+        batch = _Batch(sampler, shots, seed, batch_size, use_numpy)
+        total = add_tallies([total, concurrency.mapreduce_concurrent(batch, add_tallies,
+                                                                     xrange(start, stop_index))])
+        start = stop_index
+        if stop(total):
+            break
+    return total
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
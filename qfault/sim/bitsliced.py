@@ -0,0 +1,185 @@
+'''
+Bit-sliced Monte Carlo simulation of circuit locations.
+
+The functions of sim_utils sample one shot at a time.  Here, many shots are
+sampled at once.  The Pauli frame of each qubit is stored as a row of 64-bit
+words, in which bit j of word i holds the error of shot 64*i + j.  Errors are
+propagated through a CNOT by XORing whole rows, and failures are injected by
+XORing Bernoulli masks, so the cost of each location is nearly independent of
+the number of shots.
+
+The noise model is that of sim_utils: a failed CNOT applies one of the 15
+non-trivial two-qubit Paulis, a failed rest one of the 3 non-trivial Paulis, and
+a failed preparation or measurement a Z (X-basis) or X (Z-basis) error.
+
+>>> from qfault.circuit import location
+>>> from qfault.qec.error import Pauli
+>>> locations = location.Locations([location.prep(Pauli.Z, 'A', 0),
+...                                 location.prep(Pauli.Z, 'A', 1),
+...                                 location.cnot('A', 0, 'A', 1)])
+>>> rates = error_rates(0)
+>>> rates.prepZ = 1
+>>> frame = simulate(locations, rates, 100)
+>>> frame.errors()['X']['A'][:3]
+array([1, 1, 1], dtype=uint64)
+'''
+from qfault.sim.sim_utils import ErrorRates
+import numpy
+
+__all__ = ['Frame', 'simulate', 'error_rates']
+
+WORD_BITS = 64
+
+_one = numpy.uint64(1)
+_shifts = numpy.arange(WORD_BITS, dtype=numpy.uint64)
+
+
+class Frame(object):
+    '''
+    The X and Z errors of a batch of shots, indexed by block name.  The errors
+    on bit i of block b are frame.X[b][i] and frame.Z[b][i], each an array of
+    words of shot bits.
+    '''
+
+    def __init__(self, blocklengths, shots):
+        self.shots = shots
+        self.words = -(-shots // WORD_BITS)
+        self.X = {}
+        self.Z = {}
+        for block, length in blocklengths.iteritems():
+            self.X[block] = numpy.zeros((length, self.words), dtype=numpy.uint64)
+            self.Z[block] = numpy.zeros((length, self.words), dtype=numpy.uint64)
+
+    def errors(self):
+        '''
+        Returns the errors in the form used by sim_utils, except that each
+        block error is an array with one integer for each shot.  For example,
+        errors['X'][block][s] holds the X errors on the block in shot s, with
+        bit i of the integer set if bit i of the block has an error.
+        '''
+        return {'X': dict((block, self._integers(rows)) for block, rows in self.X.iteritems()),
+                'Z': dict((block, self._integers(rows)) for block, rows in self.Z.iteritems())}
+
+    def _integers(self, rows):
+        ints = numpy.zeros(self.words * WORD_BITS, dtype=numpy.uint64)
+        for bit, row in enumerate(rows):
+            ints |= ((row[:, numpy.newaxis] >> _shifts) & _one).reshape(-1) << numpy.uint64(bit)
+        return ints[:self.shots]
+
+    def nontrivial(self):
+        '''
+        Returns a boolean array that indicates, for each shot, whether any bit
+        of any block has an error.
+        '''
+        words = numpy.zeros(self.words, dtype=numpy.uint64)
+        for rows in self.X.values() + self.Z.values():
+            words |= numpy.bitwise_or.reduce(rows, axis=0)
+        return self.unpack(words)
+
+    def unpack(self, words):
+        '''
+        Returns a boolean array that holds the shot bits of the given words,
+        one element for each shot.
+        '''
+        return _unpack(words)[:self.shots]
+
+def _unpack(words):
+    return ((words[:, numpy.newaxis] >> _shifts) & _one).reshape(-1).astype(bool)
+
+def error_rates(p):
+    '''
+    Returns the sim_utils error rates used by the ancilla simulations: CNOTs fail
+    with probability p, preparations and measurements with probability 4p/15,
+    and rests with probability 12p/15.
+    '''
+    rates = ErrorRates()
+    rates.cnot = p
+    rates.prepX = rates.prepZ = rates.measX = rates.measZ = 4/15. * p
+    rates.rest = 12/15. * p
+    return rates
+
+
+def _failures(rng, p, shots):
+    '''
+    Returns the sorted indices of the shots in which a location with failure
+    probability p fails.  Gaps between failures are geometrically distributed,
+    so only the failures themselves are sampled.
+    '''
+    if p <= 0:
+        return numpy.zeros(0, dtype=numpy.int64)
+    expected = shots * p
+    positions = []
+    last = -1
+    while last < shots:
+        gaps = rng.geometric(p, int(expected + 5 * expected ** .5) + 16)
+        sampled = last + numpy.cumsum(gaps)
+        positions.append(sampled)
+        last = sampled[-1]
+    positions = numpy.concatenate(positions)
+    return positions[:numpy.searchsorted(positions, shots)]
+
+def _mask(words, shots):
+    '''
+    Returns the words of shot bits that are set for the given shot indices.
+    '''
+    mask = numpy.zeros(words, dtype=numpy.uint64)
+    numpy.bitwise_or.at(mask, shots // WORD_BITS, _one << (shots % WORD_BITS).astype(numpy.uint64))
+    return mask
+
+def _inject(frame, rng, p, targets, npaulis):
+    '''
+    Fails the location with probability p.  Failed shots receive one of the
+    npaulis non-trivial Paulis, chosen uniformly.  Pauli r (from 1 to npaulis)
+    flips targets[i] whenever bit i of r is set.
+    '''
+    shots = _failures(rng, p, frame.shots)
+    if not len(shots):
+        return
+    if 1 == npaulis:
+        frame_rows, bit = targets[0]
+        frame_rows[bit] ^= _mask(frame.words, shots)
+        return
+    paulis = rng.randint(1, npaulis + 1, len(shots))
+    for i, (frame_rows, bit) in enumerate(targets):
+        flipped = shots[(paulis >> i) & 1 == 1]
+        if len(flipped):
+            frame_rows[bit] ^= _mask(frame.words, flipped)
+
+def simulate(locations, errorRates, shots, rng=numpy.random, frame=None):
+    '''
+    Samples the given locations for a batch of shots and returns the
+    resulting Frame.
+
+    :param locations: The circuit locations (e.g., a Locations object).
+    :param errorRates: The failure probabilities, as for sim_utils.
+    :param int shots: The number of shots.
+    :param rng: (optional) A numpy.random.RandomState, for repeatable samples.
+    :param frame: (optional) The errors prior to the locations, e.g., the
+                  frame returned by a previous call.
+    '''
+    if None == frame:
+        frame = Frame(locations.blocklengths(), shots)
+    X, Z = frame.X, frame.Z
+    for loc in locations:
+        locType = loc['type']
+        block, bit = loc['block1'], loc['bit1']
+        if 'cnot' == locType:
+            block2, bit2 = loc['block2'], loc['bit2']
+            X[block2][bit2] ^= X[block][bit]
+            Z[block][bit] ^= Z[block2][bit2]
+            _inject(frame, rng, errorRates.cnot,
+                    ((X[block], bit), (Z[block], bit), (X[block2], bit2), (Z[block2], bit2)), 15)
+        elif 'rest' == locType:
+            _inject(frame, rng, errorRates.rest, ((X[block], bit), (Z[block], bit)), 3)
+        elif locType in ('prepZ', 'measZ'):
+            _inject(frame, rng, getattr(errorRates, locType), ((X[block], bit),), 1)
+        elif locType in ('prepX', 'measX'):
+            _inject(frame, rng, getattr(errorRates, locType), ((Z[block], bit),), 1)
+        else:
+            raise ValueError('Unsupported location type {0}'.format(locType))
+    return frame
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
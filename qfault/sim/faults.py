@@ -0,0 +1,157 @@
+'''
+Monte Carlo sampling of rare faults.
+
+At low error rates almost every location is fault-free, yet sim_utils draws a
+random number for every location of every shot.  FaultSampler instead draws the
+positions of the faults directly: within each group of locations that fail with
+the same probability p, the number of fault-free locations between consecutive
+faults is geometrically distributed, so that each draw yields one fault.  The
+locations of a batch of shots are treated as a single sequence, and the cost of
+sampling is proportional to the number of faults rather than the number of
+locations.
+
+Faults are not propagated through the circuit for each shot.  Since Pauli
+errors propagate linearly, the error at the end of the circuit is the product
+of the errors that each fault causes on its own, as computed by
+count_locations.propagate_location_errors().  Results are keyed in the same way
+as the counts of count_errors_of_order_k(): one error for each block, optionally
+mapped by block_error_maps (e.g., to syndromes).  As for counting, and unlike
+sim_utils, measurements discard the errors that they do not detect.
+
+>>> from qfault.circuit import location
+>>> from qfault.qec.error import Pauli
+>>> from qfault.sim.bitsliced import error_rates
+>>> locations = location.Locations([location.prep(Pauli.Z, 'A', 0),
+...                                 location.cnot('A', 0, 'B', 0)])
+>>> rates = error_rates(0)
+>>> rates.prepZ = 1
+>>> FaultSampler(locations, rates).sample_counts(10)
+{(X, X): 10}
+'''
+from qfault.counting import count_locations
+from qfault import noise
+from qfault.qec.error import PauliError, xType, zType
+import math
+import random
+
+__all__ = ['FaultSampler']
+
+
+class FaultSampler(object):
+    '''
+    Samples the errors caused by faults at the given locations.
+
+    :param locations: The circuit locations.
+    :param errorRates: The failure probabilities of each type of location, as
+                       for sim_utils.  A failed location suffers one of its
+                       errors (see noise.errorListXZ), chosen uniformly.
+    :param block_order: (optional) An ordered list of block names.
+    :param block_error_maps: (optional) A list of maps, one for each block.
+    :param rng: (optional) A random.Random instance, for repeatable samples.
+    '''
+
+    def __init__(self, locations, errorRates, block_order=None, block_error_maps=None, rng=random):
+        if None == block_order:
+            block_order = locations.blocknames()
+        blocklengths = locations.blocklengths()
+        self._lengths = [blocklengths[name] for name in block_order]
+        self._maps = block_error_maps
+        self._rng = rng
+
+        # The error that each fault causes at the end of the circuit, packed
+        # into a single integer so that products of errors are XORs.
+        propagated = count_locations.propagate_location_errors(locations)
+        self._errors = []
+        groups = {}
+        for i, loc in enumerate(locations):
+            self._errors.append([self._pack([propagated[i][e][name] for name in block_order])
+                                 for e in noise.errorListXZ[loc['type']]])
+            p = getattr(errorRates, loc['type'])
+            if p > 0:
+                groups.setdefault(p, []).append(i)
+
+        self._groups = [(math.log1p(-p) if p < 1 else float('-inf'), indices)
+                        for p, indices in sorted(groups.iteritems())]
+        self._keys = {}
+
+    def _pack(self, block_errors):
+        packed = 0
+        for error, length in zip(block_errors, self._lengths):
+            packed = (((packed << length) | error.ebits[xType]) << length) | error.ebits[zType]
+        return packed
+
+    def _key(self, packed):
+        '''
+        Returns the (mapped) block errors of the packed error.
+        '''
+        try:
+            return self._keys[packed]
+        except KeyError:
+            pass
+
+        errors = []
+        shifted = packed
+        for length in reversed(self._lengths):
+            mask = (1 << length) - 1
+            zbits = shifted & mask
+            xbits = (shifted >> length) & mask
+            shifted >>= 2 * length
+            errors.append(PauliError(length, xbits, zbits))
+        errors.reverse()
+        if None != self._maps:
+            errors = [emap(error) for emap, error in zip(self._maps, errors)]
+        key = self._keys[packed] = tuple(errors)
+        return key
+
+    def faults(self, shots):
+        '''
+        Returns a dictionary of the faults in a batch of shots, indexed by shot.
+        Each entry is a list of (location index, error index) pairs.  Shots
+        without faults are omitted.
+        '''
+        rng = self._rng
+        faulty = {}
+        for log_q, indices in self._groups:
+            n = len(indices)
+            total = n * shots
+            position = -1
+            while True:
+                # The number of fault-free locations before the next fault.
+                position += 1 + int(math.log(1 - rng.random()) / log_q)
+                if position >= total:
+                    break
+                shot, i = divmod(position, n)
+                index = indices[i]
+                fault = (index, int(rng.random() * len(self._errors[index])))
+                faulty.setdefault(shot, []).append(fault)
+        return faulty
+
+    def sample_counts(self, shots):
+        '''
+        Samples a batch of shots.  Returns a dictionary of the number of shots
+        with each error, indexed by error key.
+        '''
+        counts = {}
+        faulty = self.faults(shots)
+        for faults in faulty.itervalues():
+            packed = 0
+            for index, e in faults:
+                packed ^= self._errors[index][e]
+            key = self._key(packed)
+            counts[key] = counts.get(key, 0) + 1
+        if len(faulty) < shots:
+            key = self._key(0)
+            counts[key] = counts.get(key, 0) + shots - len(faulty)
+        return counts
+
+    def sample(self):
+        '''
+        Samples a single shot and returns its error key.
+        '''
+        [key] = self.sample_counts(1)
+        return key
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,137 @@
+'''
+Batched rejection sampling of verified ancilla preparation.
+
+A verified ancilla is prepared by repeating a preparation circuit, e.g., two
+unverified ancillas coupled by transversal CNOTs and measurement of one of them,
+until the measured syndromes are trivial.  Rather than simulating one attempt
+at a time, sample_verified() simulates a batch of attempts at once (see
+bitsliced), computes the syndromes of all of them with whole-word parities, and
+keeps the errors of the accepted attempts.  The number of attempts used for
+each accepted ancilla is recorded, so that acceptance rates and overhead
+follow directly.
+
+The syndromes are given by parity checks: bit masks of the qubits of a block,
+in the bit order of sim_utils.  The checks of a linear syndrome function,
+such as golay.GolayCode.getSyndrome, are obtained by parity_checks().
+
+>>> from qfault.circuit import location
+>>> from qfault.qec.error import Pauli
+>>> from qfault.sim.bitsliced import error_rates
+>>> locations = location.Locations([location.prep(Pauli.Z, 'A', 0),
+...                                 location.meas(Pauli.Z, 'A', 0)])
+>>> samples = sample_verified(locations, error_rates(0), [('A', 'X', [0b1])], 5)
+>>> list(samples.attempts), samples.acceptance()
+([1, 1, 1, 1, 1], 1.0)
+'''
+from qfault.sim import bitsliced
+import numpy
+
+__all__ = ['VerifiedSamples', 'parity_checks', 'syndrome_words', 'sample_verified']
+
+# The default number of attempts simulated at once.
+BATCH_SIZE = 1 << 14
+
+
+def parity_checks(syndrome, n):
+    '''
+    Returns the parity checks of a linear syndrome function of n-bit errors.
+    Check j is the bit mask of the qubits whose errors flip bit j of the
+    syndrome.
+
+    >>> parity_checks(lambda e: (e ^ (e >> 1)) & 0b11, 3)
+    [3, 6]
+    '''
+    columns = [syndrome(1 << i) for i in range(n)]
+    length = max(columns).bit_length()
+    return [sum(1 << i for i, column in enumerate(columns) if (column >> j) & 1)
+            for j in range(length)]
+
+def syndrome_words(rows, checks):
+    '''
+    Returns the syndromes of the errors of a block, given by its rows of a
+    Frame (e.g., frame.X[block]).  Row j of the result holds the words of
+    shot bits of syndrome bit j.
+    '''
+    syndromes = numpy.zeros((len(checks), rows.shape[1]), dtype=numpy.uint64)
+    for j, check in enumerate(checks):
+        qubits = [i for i in range(len(rows)) if (check >> i) & 1]
+        if qubits:
+            syndromes[j] = numpy.bitwise_xor.reduce(rows[qubits], axis=0)
+    return syndromes
+
+
+class VerifiedSamples(object):
+    '''
+    The accepted attempts of a verified preparation.
+
+    :ivar errors: The errors of the accepted attempts, as for Frame.errors().
+    :ivar attempts: The number of attempts used for each accepted ancilla,
+                    including the accepted attempt.
+    '''
+
+    def __init__(self, errors, attempts):
+        self.errors = errors
+        self.attempts = attempts
+
+    def acceptance(self):
+        '''
+        Returns the fraction of the attempts that were accepted.
+        '''
+        return len(self.attempts) / float(self.attempts.sum())
+
+    def __len__(self):
+        return len(self.attempts)
+
+def sample_verified(locations, errorRates, tests, count, batch_size=BATCH_SIZE, rng=numpy.random):
+    '''
+    Simulates attempts of the given preparation circuit until count of them
+    are accepted.  Returns VerifiedSamples.
+
+    Attempts that fail are followed by the next attempt, so the attempts are
+    a single sequence across batches.  The errors of a rejected attempt are
+    discarded.
+
+    :param locations: The locations of one attempt.
+    :param errorRates: The failure probabilities, as for sim_utils.
+    :param tests: A list of (block, eType, checks) tuples, in which eType is
+                  'X' or 'Z'.  An attempt is accepted if the eType errors on
+                  the block violate none of the checks, for every test.
+    :param int count: The number of accepted ancillas.
+    :param rng: (optional) A numpy.random.RandomState, for repeatable samples.
+    '''
+    errors = {'X': {}, 'Z': {}}
+    attempts = []
+    accepted = 0
+    pending = 0
+    while accepted < count:
+        frame = bitsliced.simulate(locations, errorRates, batch_size, rng)
+        rejected = numpy.zeros(frame.words, dtype=numpy.uint64)
+        for block, eType, checks in tests:
+            syndromes = syndrome_words(getattr(frame, eType)[block], checks)
+            rejected |= numpy.bitwise_or.reduce(syndromes, axis=0)
+        positions = numpy.flatnonzero(~frame.unpack(rejected))
+        if not len(positions):
+            pending += batch_size
+            continue
+
+        # The attempts of each accepted ancilla, since the previous one.
+        gaps = numpy.diff(numpy.concatenate(([-1], positions)))
+        gaps[0] += pending
+        pending = batch_size - 1 - positions[-1]
+
+        kept = positions[:count - accepted]
+        attempts.append(gaps[:len(kept)])
+        for eType, blocks in frame.errors().iteritems():
+            for block, ints in blocks.iteritems():
+                errors[eType].setdefault(block, []).append(ints[kept])
+        accepted += len(kept)
+
+    for blocks in errors.values():
+        for block in blocks:
+            blocks[block] = numpy.concatenate(blocks[block])
+    return VerifiedSamples(errors, numpy.concatenate(attempts))
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -0,0 +1,212 @@
+'''
+Benchmarks of performance-critical code, with regression checks.
+
+A benchmark is a named setup function.  The setup function prepares the inputs
+(from a fixed random seed, so that every run does the same work) and returns
+the callable to be timed.  Each benchmark is timed a number of times, with the
+memos of qfault.util.cache cleared before each repeat, and the best time is
+compared against the best time of a baseline run.
+
+>>> bench = Benchmark('sum', lambda: lambda: sum(xrange(1000)), work=1000)
+>>> results = run([bench], repeat=2)
+>>> sorted(results['benchmarks']['sum'])
+['best', 'median', 'rate', 'repeat', 'times', 'work']
+
+Results are written and read as JSON.  A benchmark regresses when its best
+time exceeds the baseline time by more than the threshold fraction, e.g.,
+threshold=0.2 allows runs to be 20% slower than the baseline.
+
+>>> slower = {'benchmarks': {'sum': {'best': 2 * results['benchmarks']['sum']['best']}}}
+>>> [c['name'] for c in compare(slower, results) if c['regressed']]
+['sum']
+>>> [c['name'] for c in compare(slower, results, thresholds={'s*': 1.5}) if c['regressed']]
+[]
+'''
+from qfault.util import cache
+import argparse
+import fnmatch
+import json
+import logging
+import platform
+import re
+import time
+
+__all__ = ['Benchmark', 'run', 'compare', 'read_json', 'write_json', 'main']
+
+logger = logging.getLogger('util.benchmark')
+
+# The default number of times that each benchmark is timed.
+REPEAT = 5
+
+# The default fraction by which a benchmark may be slower than its baseline.
+THRESHOLD = 0.2
+
+
+class Benchmark(object):
+    '''
+    A named benchmark.
+
+    :param str name: The name of the benchmark, e.g., 'convolve.n1000'.
+    :param setup: A function that returns the callable to be timed.  It is
+                  called before each repeat, and is not timed.
+    :param int repeat: (optional) The number of repeats (default is the
+                       repeat count of the run).
+    :param work: (optional) The amount of work done by each call, e.g., the
+                 number of Monte Carlo samples.  Results then include the
+                 rate of work per second.
+    :param bool slow: (optional) Slow benchmarks run only when requested.
+    '''
+
+    def __init__(self, name, setup, repeat=None, work=None, slow=False):
+        self.name = name
+        self.setup = setup
+        self.repeat = repeat
+        self.work = work
+        self.slow = slow
+
+    def __repr__(self):
+        return 'Benchmark({0})'.format(self.name)
+
+    def time(self, repeat):
+        '''
+        Returns the times (in seconds) of each of repeat calls.
+        '''
+        times = []
+        for _ in range(repeat):
+            cache.clearMemos()
+            function = self.setup()
+            start = time.time()
+            function()
+            times.append(time.time() - start)
+        return times
+
+def run(benchmarks, repeat=REPEAT, pattern=None, slow=False):
+    '''
+    Runs the given benchmarks and returns the results.
+
+    :param benchmarks: A list of Benchmark objects.
+    :param int repeat: The number of repeats of benchmarks that do not
+                       specify their own.
+    :param str pattern: (optional) A regular expression.  Only the benchmarks
+                        whose name matches are run.
+    :param bool slow: (optional) Also run slow benchmarks.
+    '''
+    results = {}
+    for bench in benchmarks:
+        if (bench.slow and not slow) or (None != pattern and not re.search(pattern, bench.name)):
+            continue
+
+        times = bench.time(bench.repeat or repeat)
+        result = {'times': times,
+                  'repeat': len(times),
+                  'best': min(times),
+                  'median': sorted(times)[len(times) // 2],
+                  'work': bench.work,
+                  'rate': None}
+        if None != bench.work and result['best']:
+            result['rate'] = bench.work / result['best']
+        logger.info('%s: best=%.4gs median=%.4gs', bench.name, result['best'], result['median'])
+        results[bench.name] = result
+
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'benchmarks': results}
+
+def _threshold(name, threshold, thresholds):
+    for pattern, value in sorted((thresholds or {}).items()):
+        if fnmatch.fnmatchcase(name, pattern):
+            threshold = value
+    return threshold
+
+def compare(results, baseline, threshold=THRESHOLD, thresholds=None):
+    '''
+    Compares the best times of results against those of the baseline.
+    Returns a list with one dictionary for each benchmark that appears in both,
+    ordered by name.  Benchmarks that are missing from either one are ignored.
+
+    :param float threshold: The fraction by which a benchmark may be slower
+                            than the baseline.
+    :param dict thresholds: (optional) Thresholds of individual benchmarks,
+                            indexed by (fnmatch) patterns of benchmark names.
+    '''
+    comparisons = []
+    benchmarks = baseline['benchmarks']
+    for name, result in sorted(results['benchmarks'].iteritems()):
+        if name not in benchmarks:
+            continue
+        limit = _threshold(name, threshold, thresholds)
+        base = benchmarks[name]['best']
+        ratio = result['best'] / base if base else 1.
+        comparisons.append({'name': name,
+                            'best': result['best'],
+                            'baseline': base,
+                            'ratio': ratio,
+                            'threshold': limit,
+                            'regressed': ratio > 1 + limit})
+    return comparisons
+
+def write_json(results, filename):
+    with open(filename, 'w') as f:
+        json.dump(results, f, indent=1, sort_keys=True)
+
+def read_json(filename):
+    with open(filename) as f:
+        return json.load(f)
+
+def _parse_threshold(text):
+    pattern, _, value = text.rpartition('=')
+    return pattern, float(value)
+
+def main(benchmarks, args=None):
+    '''
+    Command line interface.  Runs the benchmarks, optionally writes the results
+    and compares them against a baseline.  Returns 1 if any benchmark regressed,
+    and 0 otherwise.
+    '''
+    parser = argparse.ArgumentParser(description='Runs benchmarks.')
+    parser.add_argument('-o', '--output', help='write the results to this JSON file')
+    parser.add_argument('-b', '--baseline', help='compare against the results in this JSON file')
+    parser.add_argument('-t', '--threshold', action='append', default=[], type=_parse_threshold,
+                        help='allowed slowdown fraction (default {0}), or PATTERN=FRACTION for '
+                             'the benchmarks that match the pattern.  May be repeated.'.format(THRESHOLD))
+    parser.add_argument('-r', '--repeat', type=int, default=REPEAT, help='number of repeats')
+    parser.add_argument('-k', '--pattern', help='run only the benchmarks that match this regular expression')
+    parser.add_argument('--slow', action='store_true', help='also run slow benchmarks')
+    parser.add_argument('-l', '--list', action='store_true', help='list the benchmarks and exit')
+    options = parser.parse_args(args)
+
+    if options.list:
+        for bench in benchmarks:
+            print bench.name + (' (slow)' if bench.slow else '')
+        return 0
+
+    results = run(benchmarks, options.repeat, options.pattern, options.slow)
+    for name, result in sorted(results['benchmarks'].iteritems()):
+        line = '{0:40} {1:10.4f}s'.format(name, result['best'])
+        if None != result['rate']:
+            line += ' {0:12.1f}/s'.format(result['rate'])
+        print line
+
+    if options.output:
+        write_json(results, options.output)
+    if not options.baseline:
+        return 0
+
+    thresholds = dict((pattern, value) for pattern, value in options.threshold if pattern)
+    threshold = THRESHOLD
+    for pattern, value in options.threshold:
+        if not pattern:
+            threshold = value
+
+    regressed = False
+    for c in compare(results, read_json(options.baseline), threshold, thresholds):
+        status = 'REGRESSED' if c['regressed'] else 'ok'
+        print '{0:40} {1:8.2f}x baseline (threshold {2:.2f})  {3}'.format(c['name'], c['ratio'],
+                                                                        1 + c['threshold'], status)
+        regressed |= c['regressed']
+    return int(regressed)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
@@ -12,11 +12,14 @@ import functools
 import copy
 import sys
 import shelve
+from qfault.util import profiling, trace
 
 logger = logging.getLogger('util.cache')
+tracer = trace.get_tracer('util.cache')
 
 fetchEnabled = True
 memoEnabled = True
+_memos = []
 
 def enableFetch(enable=True):
 	global fetchEnabled
@@ -27,6 +30,14 @@ def enableMemo(enable=True):
 	global memoEnabled
 	memoEnabled = enable
 	logger.info('Memos enabled=' + str(memoEnabled))
+	
+def clearMemos():
+	'''
+	Discards the results held by all memoized functions, e.g., so that
+	repeated benchmark runs do the same work.
+	'''
+	for memo in _memos:
+		memo.memo.clear()
 
 
 class memoize(object):
@@ -41,6 +52,7 @@ class memoize(object):
 		'''
 		self.func = function
 		self.memo = {}
+		_memos.append(self)
 		
 	def __call__(self, *args, **kwargs):
 		key = self.get_key(args, kwargs)
@@ -51,8 +63,11 @@ class memoize(object):
 			return self.func(*args, **kwargs)	
 
 		try:
-			return self.getMemo(key)
+			result = self.getMemo(key)
+			profiling.record('memo.hit')
+			return result
 		except KeyError:
+			profiling.record('memo.miss')
 			self.setMemo(key, self.func(*args, **kwargs))
 		return self.getMemo(key)
 	
@@ -60,11 +75,13 @@ class memoize(object):
 		return self.memo.has_key(key)
 	
 	def setMemo(self, key, result):
-		logger.debug('setting memo for {0}'.format(key))
+		if tracer.enabled:
+			tracer.event('setting memo for %s', key)
 		self.memo[key] = result
 		
 	def getMemo(self, key):
-		logger.debug('getting memo for {0}'.format(key))
+		if tracer.enabled:
+			tracer.event('getting memo for %s', key)
 		return copy.copy(self.memo[key])
 	
 	def get_key(self, args, kwargs):
@@ -162,8 +179,10 @@ class fetchable(object):
 		try:
 			data = dm.load(key)
 			self.fetched = True
+			profiling.record('fetch.hit')
 		except IOError:
 			logger.debug('Fetch of {0} failed. Computing from scratch.'.format(key))
+			profiling.record('fetch.miss')
 			data = self.func(*args, **kwargs)
 			dm.save(data, key)
 				
@@ -204,6 +223,61 @@ class fetchable(object):
 		
 	
 
+class fetchableOrders(fetchable):
+	'''
+	Decorator for fetchable instance methods that count up to a maximum fault order.
+	The last positional argument of the method must be the maximum order kMax (an integer).
+	It is not part of the fetch key, so a single file holds the result for all orders.
+	
+	When the file holds a result computed for kMax or larger, the result is truncated
+	to kMax instead of being recomputed.  When it holds a result for a smaller
+	kMax, the method is called with keyword argument previous=<the fetched result>,
+	so that it may compute only the missing orders.  Otherwise previous=None.
+	Methods are free to ignore previous and count from scratch.  The larger result
+	replaces the fetched one.
+	
+	Results must support len() (the number of orders) and up_to(kMax).  Results
+	may contain fewer than kMax+1 orders, e.g., when higher orders are not possible.
+	Objects may define _cacheName() to identify themselves in the fetch key
+	(default is repr()).
+	'''
+	
+	def __call__(self, *args, **kwargs):
+		raise TypeError('fetchableOrders may only be applied to instance methods')
+	
+	def _methodCall(self, obj, *args, **kwargs):
+		try:
+			name = obj._cacheName()
+		except AttributeError:
+			name = repr(obj)
+		
+		kMax = args[-1]
+		key = self.get_key(name + '.' + self.func.func_name, args[:-1], kwargs)
+		args = tuple([obj]) + args
+		if not fetchEnabled:
+			return self.func(*args, **kwargs)
+		
+		dm = DataManager()
+		try:
+			kFetched, previous = dm.load(key)
+			self.fetched = True
+		except IOError:
+			kFetched, previous = -1, None
+			
+		if kFetched >= kMax:
+			logger.debug('Fetched %s (kMax=%s) for kMax=%s', key, kFetched, kMax)
+			profiling.record('fetch.hit')
+			return previous.up_to(kMax)
+		if None != previous:
+			logger.debug('Extending %s from kMax=%s to kMax=%s', key, kFetched, kMax)
+			profiling.record('fetch.extend')
+		else:
+			profiling.record('fetch.miss')
+			
+		data = self.func(*args, previous=previous, **kwargs)
+		dm.save((kMax, data), key)
+		return data
+
 
 class DataManager(object):
 	'''
@@ -224,8 +298,6 @@ class DataManager(object):
 		if not os.path.exists(self.dataDir):
 			os.mkdir(self.dataDir)
 			
-		self.lookup = self.initializeLookup()
-			
 	def initializeLookup(self):
 		filename = self.dataDir + 'datafile-lookup.txt'
 		lookup = shelve.open(filename)
@@ -263,13 +335,18 @@ class DataManager(object):
 		return str(obj)
 	
 	def constructFilename(self, key):
+		# The lookup table is opened for each access.  Lookup tables that
+		# remain open go stale when other DataManagers (e.g., of nested fetchable
+		# calls) add entries, and overwrite those entries when they are closed.
+		lookup = self.initializeLookup()
 		try:
-			lookupVal = self.lookup[key]
-		except KeyError:
-			lookupVal = len(self.lookup)
-			self.lookup[key] = lookupVal
-			# Write the new entry to disk
-			self.lookup.sync() 
+			try:
+				lookupVal = lookup[key]
+			except KeyError:
+				lookupVal = len(lookup)
+				lookup[key] = lookupVal
+		finally:
+			lookup.close()
 		
 		return self.dataDir + 'datafile.' + str(lookupVal) + self.fileExt
 	
@@ -7,14 +7,24 @@ Created on 2010-08-30
 import multiprocessing
 import logging
 from qfault.util import listutils, iteration
+import cPickle
+import cStringIO
 import itertools
+import marshal
+import numpy
+import os
+import sys
+import tempfile
+import types
+import uuid
 
-__all__ = ['enable_concurrency', 'map_concurrent']
+__all__ = ['enable_concurrency', 'use_pool', 'map_concurrent', 'map_unordered', 'broadcast', 'broadcast_value',
+           'ByValue', 'reduce_nested', 'slot_count']
 
 
 logger = logging.getLogger('count_parallel')
 
-def initialize_concurrency(number_of_slots=multiprocessing.cpu_count()):
+def initialize_concurrency(number_of_slots=multiprocessing.cpu_count(), nested=False):
     '''
     Initialize the concurrency module with the given number of 
     slots (processes).  By default, it sets the number of slots
@@ -22,19 +32,46 @@ def initialize_concurrency(number_of_slots=multiprocessing.cpu_count()):
     It is intended that this function be called once, at the
     beginning of execution.  However, it may be called any
     number of times to reset the number of slots.
+    
+    Tasks that run on a process pool make their own concurrent calls
+    serially.  If nested is True, the processes are the workers of a
+    distributed.LocalCluster instead, on which such calls also run
+    concurrently.
     '''
-    global total_slots
+    global _cluster
     
     _enable_concurrent_pickle()
     
+    if None != _cluster:
+        _cluster.close()
+        _cluster = None
+    
     if 0 == number_of_slots:
         pool =DummyPool()
+    elif nested:
+        from qfault.util import distributed
+        logger.info('Configuring cluster of {0} workers'.format(number_of_slots))
+        _cluster = distributed.LocalCluster(number_of_slots)
+        pool = _cluster.coordinator
+        number_of_slots = _cluster.slots
     else:
         logger.info('Configuring pool of {0} workers'.format(number_of_slots))
         pool = multiprocessing.Pool(processes=(number_of_slots))
         
     _set_pool(pool)
     _set_slot_count(max(1,number_of_slots))
+    
+def use_pool(pool, number_of_slots):
+    '''
+    Runs concurrent tasks on the given pool, in place of a local process
+    pool.  The pool must support map(), imap() and imap_unordered() (see,
+    e.g., distributed.Coordinator).  Each call to map_concurrent() and
+    mapreduce_concurrent() is split into number_of_slots tasks.
+    '''
+    _enable_concurrent_pickle()
+    logger.info('Using {0} with {1} slots'.format(type(pool).__name__, number_of_slots))
+    _set_pool(pool)
+    _set_slot_count(max(1, number_of_slots))
 
 class Noop(object):
     
@@ -55,7 +92,7 @@ def map_concurrent(function, collection):
     >>> list(map_concurrent(negate, range(4)))
     [0, -1, -2, -3]
     '''
-    mapped = mapreduce_concurrent(function, Noop(), collection)
+    mapped = mapreduce_concurrent(function, list, collection)
     return itertools.chain(*mapped)
 
 class SliceMapReduce(object):
@@ -65,7 +102,9 @@ class SliceMapReduce(object):
         self._reduce = reduce_func
         
     def __call__(self, _slice):
-        mapped = map(self._map, _slice)
+        # Map lazily so that the reduction can consume the mapped values
+        # one at a time, rather than holding all of them in memory.
+        mapped = itertools.imap(self._map, _slice)
         return self._reduce(mapped)
 
 def mapreduce_concurrent(map_func, reduce_func, iterable):
@@ -75,7 +114,8 @@ def mapreduce_concurrent(map_func, reduce_func, iterable):
     the result according to reduce_func. Behavior
     is equivalent to reduce(map(iterable)), but
     the processing is done concurrently on slices of the
-    input.
+    input.  reduce_func must accept any iterable (not
+    just a list).
     
     Note: If iterable is an iterator or generator, then
     it should not be used anywhere else after calling
@@ -91,14 +131,195 @@ def mapreduce_concurrent(map_func, reduce_func, iterable):
     slice_map = SliceMapReduce(map_func, reduce_func)
     
     pool = _get_pool()
-    map_result = pool.map(slice_map,
-                          iteration.equal_slice_iterators(iterable, 
-                                                          _slot_count()))
+    slices = iteration.equal_slice_iterators(iterable, _slot_count())
+    if not isinstance(pool, DummyPool):
+        # Slice iterators cannot be pickled, so the slices must be
+        # materialized before they are sent to the workers.
+        slices = [list(_slice) for _slice in slices]
+    # The results of the slices are reduced as they arrive, in order.
+    map_result = pool.imap(slice_map, slices)
     return reduce_func(map_result)
+
+class IndexedTask(object):
+    '''
+    Applies a function to an (index, argument) pair, and returns the
+    index along with the result.
+    '''
+    
+    def __init__(self, function):
+        self._function = function
+        
+    def __call__(self, indexed):
+        index, arg = indexed
+        return index, self._function(arg)
+
+def map_unordered(function, iterable):
+    '''
+    Concurrently applies function to each element of the iterable, one
+    element per task.  Returns an iterator over (index, result) pairs, in
+    order of completion.  This suits a moderate number of large, uneven
+    tasks, and allows progress to be reported as tasks complete.
+    
+    >>> initialize_concurrency(0)
+    >>> sorted(map_unordered(abs, [-2, 1]))
+    [(0, 2), (1, 1)]
+    '''
+    pool = _get_pool()
+    return pool.imap_unordered(IndexedTask(function), enumerate(iterable))
+    
+
+# Values that pickle to fewer bytes than this are sent with each task, rather
+# than written to a file.
+BROADCAST_MIN_BYTES = 1 << 16
+
+# Arrays of at least this many bytes are memory-mapped by the workers.
+_MAPPED_MIN_BYTES = 1 << 12
+
+class Broadcast(object):
+    '''
+    A handle to a large, read-only value that is shared with the worker
+    processes.  The value is written to a file once, and each worker loads it
+    at most once, however many tasks refer to it.  Only the handle is pickled
+    with each task.  Numpy arrays that are part of the value (e.g., the arrays of
+    packed count tables, see aggregate.pack()) are written to files of their
+    own and memory-mapped by the workers, so that their contents are shared
+    rather than copied.  Values smaller than BROADCAST_MIN_BYTES are pickled
+    with the handle instead.
+    
+    Use broadcast() to create handles, and broadcast_value() to obtain the value.
+    
+    >>> initialize_concurrency(0)
+    >>> with broadcast([1, 2, 3]) as handle:
+    ...     broadcast_value(handle)
+    [1, 2, 3]
+    '''
+    
+    def __init__(self, value, shared, share=None):
+        self._id = uuid.uuid4().hex
+        self._path = None
+        self._arrays = 0
+        self._inline = False
+        self._value = None
+        if shared:
+            self._share(value if None == share else share(value))
+        _broadcast_values[self._id] = value
+        
+    def _share(self, value):
+        arrays = []
+        def persistent_id(obj):
+            if isinstance(obj, numpy.ndarray) and not obj.dtype.hasobject and obj.nbytes >= _MAPPED_MIN_BYTES:
+                arrays.append(obj)
+                return str(len(arrays) - 1)
+            return None
+        
+        data = cStringIO.StringIO()
+        pickler = cPickle.Pickler(data, cPickle.HIGHEST_PROTOCOL)
+        # Unlike persistent_id, inst_persistent_id is not called for
+        # built-in types, such as the keys and counts of dict tables.
+        pickler.inst_persistent_id = persistent_id
+        pickler.dump(value)
+        if data.tell() + sum(array.nbytes for array in arrays) < BROADCAST_MIN_BYTES:
+            self._inline = True
+            self._value = value
+            return
+        
+        fd, self._path = tempfile.mkstemp(prefix='qfault-broadcast-', suffix='.pkl')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data.getvalue())
+        for i, array in enumerate(arrays):
+            numpy.save(self._arrayPath(i), array)
+            self._arrays += 1
+        
+    def _arrayPath(self, i):
+        return '{0}.{1}.npy'.format(self._path, i)
+        
+    def get(self):
+        try:
+            return _broadcast_values[self._id]
+        except KeyError:
+            pass
+        if self._inline:
+            return self._value
+        return self._load()
+        
+    def _load(self):
+        # Values of jobs that have finished are dropped.
+        for key, path in _broadcast_paths.items():
+            if not os.path.exists(path):
+                del _broadcast_values[key], _broadcast_paths[key]
+                
+        def persistent_load(pid):
+            return numpy.load(self._arrayPath(int(pid)), mmap_mode='r')
+        
+        with open(self._path, 'rb') as f:
+            unpickler = cPickle.Unpickler(f)
+            unpickler.persistent_load = persistent_load
+            value = unpickler.load()
+        _broadcast_values[self._id] = value
+        _broadcast_paths[self._id] = self._path
+        return value
+    
+    def release(self):
+        '''
+        Deletes the shared copy of the value.  The handle may not be used afterward.
+        '''
+        _broadcast_values.pop(self._id, None)
+        self._value = None
+        if None != self._path:
+            # The workers check for the value file, so it is deleted last.
+            for i in range(self._arrays):
+                os.remove(self._arrayPath(i))
+            os.remove(self._path)
+            self._path = None
+            
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.release()
+        
+    def __getstate__(self):
+        if self._inline:
+            return (self._id, None, self._value)
+        if None == self._path:
+            raise RuntimeError('Broadcast value is not shared')
+        return (self._id, self._path, None)
+    
+    def __setstate__(self, state):
+        self._id, self._path, self._value = state
+        self._arrays = 0
+        self._inline = None == self._path
+
+# Broadcast values known to this process, and the files of those that were loaded.
+_broadcast_values = {}
+_broadcast_paths = {}
+
+def broadcast(value, share=None):
+    '''
+    Returns a Broadcast handle for the given value.  The value is shared with
+    the workers only if tasks are run in worker processes.  The handle should be
+    released (or used as a context manager) once the job is complete.
     
+    :param share: (optional) A function that returns the representation of the
+                  value to share with the workers (e.g., one that packs count
+                  tables).  It is called only if the value is shared.
+    '''
+    return Broadcast(value, not isinstance(_get_pool(), DummyPool), share)
 
+def broadcast_value(obj):
+    '''
+    Returns the value of obj if it is a Broadcast handle, or obj otherwise.
+    
+    >>> broadcast_value(3)
+    3
+    '''
+    if isinstance(obj, Broadcast):
+        return obj.get()
+    return obj
+    
 def _enable_concurrent_pickle():
     '''
+    Enables pickling of instance methods.
     Code taken from: http://bytes.com/topic/python/answers/552476-why-cant-you-pickle-instancemethods
     '''
     def _pickle_method(method):
@@ -118,9 +339,126 @@ def _enable_concurrent_pickle():
         return func.__get__(obj, cls)
     
     import copy_reg
-    import types
     copy_reg.pickle(types.MethodType, _pickle_method, _unpickle_method)
+
+class ByValue(object):
+    '''
+    Wraps an object that is sent to the workers (e.g., a key map), so that the
+    functions that it refers to are pickled by value if they cannot be pickled
+    by reference, i.e., lambdas and nested functions (closures).  This applies
+    to functions held by the attributes of other objects, or by closure cells,
+    as well.  Only the pickling of the wrapper is affected.  Unpickling returns
+    the wrapped object itself.
+    
+    >>> def adder(n):
+    ...     return lambda x: x + n
+    >>> cPickle.loads(cPickle.dumps(ByValue(adder(3)), 2))(1)
+    4
+    '''
+    
+    def __init__(self, obj):
+        self._obj = obj
+        
+    def __call__(self, *args, **kwargs):
+        return self._obj(*args, **kwargs)
+    
+    def __reduce__(self):
+        data = cStringIO.StringIO()
+        pickler = cPickle.Pickler(data, cPickle.HIGHEST_PROTOCOL)
+        # cPickle consults inst_persistent_id for the functions that it
+        # cannot pickle by reference.
+        pickler.inst_persistent_id = _function_id
+        pickler.dump(self._obj)
+        return _load_by_value, (data.getvalue(),)
+
+def _function_id(obj):
+    if isinstance(obj, types.FunctionType):
+        return _reduce_function(obj)[1]
+    return None
+
+def _load_by_value(data):
+    unpickler = cPickle.Unpickler(cStringIO.StringIO(data))
+    unpickler.persistent_load = lambda args: _make_function(*args)
+    return unpickler.load()
+
+def _reduce_function(function):
+    '''
+    Reduces a function for pickling by value (see ByValue).  The code is
+    marshaled, the contents of the closure cells are pickled along with the
+    function, and global names are resolved in the module that defined the
+    function.  Code objects are specific to the Python version, and closures
+    that refer to themselves cannot be pickled.
+    '''
+    cells = None
+    if None != function.func_closure:
+        cells = tuple(_cell_contents(cell) for cell in function.func_closure)
+    return _make_function, (marshal.dumps(function.func_code),
+                            function.__module__ or '__main__',
+                            function.func_name,
+                            function.func_defaults,
+                            cells,
+                            function.func_dict or None)
+
+def reduce_nested(obj, protocol):
+    '''
+    Reduces an instance of a class that is defined within another class.
+    cPickle cannot find such classes by name, so they should use this function
+    as their __reduce_ex__ method.  Instances of module-level classes are
+    reduced as usual.  Only one level of nesting is supported.
+    '''
+    cls = type(obj)
+    module = sys.modules[cls.__module__]
+    if getattr(module, cls.__name__, None) is cls:
+        return object.__reduce_ex__(obj, protocol)
+    for outer in vars(module).values():
+        if isinstance(outer, type) and vars(outer).get(cls.__name__) is cls:
+            return _new_nested, (cls.__module__, outer.__name__, cls.__name__), obj.__dict__
+    raise cPickle.PicklingError("Can't find {0} in module {1}".format(cls, cls.__module__))
+
+def _new_nested(module, outer, name):
+    __import__(module)
+    cls = getattr(getattr(sys.modules[module], outer), name)
+    return cls.__new__(cls)
+
+class _EmptyCell(object):
+    '''
+    Stands in for the contents of a closure cell that has not been assigned.
+    '''
+
+def _cell_contents(cell):
+    try:
+        return cell.cell_contents
+    except ValueError:
+        return _EmptyCell()
+
+def _make_cell(value):
+    if isinstance(value, _EmptyCell):
+        return _empty_cell()
+    return (lambda: value).func_closure[0]
+
+def _empty_cell():
+    if False:
+        value = None
+    return (lambda: value).func_closure[0]
+
+def _make_function(code, module, name, defaults, cells, attributes):
+    __import__(module)
+    closure = None
+    if None != cells:
+        closure = tuple(_make_cell(value) for value in cells)
+    function = types.FunctionType(marshal.loads(code), sys.modules[module].__dict__,
+                                  name, defaults, closure)
+    if attributes:
+        function.__dict__.update(attributes)
+    return function
     
+def slot_count():
+    '''
+    Returns the number of slots, i.e., the number of tasks into which
+    map_concurrent() and mapreduce_concurrent() split their input.
+    '''
+    return _slot_count()
+
 def _set_slot_count(count):
     global _num_slots
     _num_slots = count
@@ -130,12 +468,17 @@ def _slot_count():
     return _num_slots
 
 def _get_pool():
-    global _the_pool
+    # A process pool can only be used by the process that created it.  Tasks
+    # that run in its workers make their concurrent calls serially.  (See
+    # distributed.LocalCluster for a pool that supports nested tasks.)
+    if os.getpid() != _pool_pid:
+        _set_pool(DummyPool())
     return _global_pool
 
 def _set_pool(pool):
-    global _global_pool
+    global _global_pool, _pool_pid
     _global_pool = pool
+    _pool_pid = os.getpid()
     
 
 class DummyPool(object):
@@ -165,6 +508,18 @@ class DummyPool(object):
         Equivalent of `map()` builtin
         '''
         return map(func, iterable)
+    
+    def imap(self, func, iterable, chunksize=1):
+        '''
+        Equivalent of `itertools.imap()`
+        '''
+        return itertools.imap(func, iterable)
+    
+    def imap_unordered(self, func, iterable, chunksize=1):
+        '''
+        Equivalent of `itertools.imap()`
+        '''
+        return itertools.imap(func, iterable)
 
 class DummyResult(object):
     
@@ -179,6 +534,8 @@ class DummyResult(object):
     
     
 _global_pool = DummyPool()
+_pool_pid = os.getpid()
+_cluster = None
 _num_slots = 1
 
 if __name__ == '__main__':
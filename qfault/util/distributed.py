@@ -0,0 +1,398 @@
+'''
+Multi-node execution of concurrent tasks.
+
+A Coordinator serves a queue of tasks over TCP (see multiprocessing.managers).
+Worker processes, on any host that can reach the coordinator, take tasks from
+the queue and return the results.  The coordinator can be used in place of the
+process pool of the concurrency module, so map_concurrent() and
+mapreduce_concurrent() scale past a single node without any change to their
+callers:
+
+>>> coordinator = Coordinator(('', 50000), 'secret')    # doctest: +SKIP
+>>> concurrency.use_pool(coordinator, 64)               # doctest: +SKIP
+
+and on each node (e.g., in a batch job script):
+
+    python -m qfault.util.distributed coordinator-host:50000 secret
+
+If a job makes no progress for task_timeout seconds, e.g., because a worker
+was lost, its outstanding tasks are handed out again, up to the given number
+of retries.  Results are reduced as they arrive.
+
+Tasks may themselves make concurrent calls.  Their subtasks are queued with
+the coordinator, and a worker that waits for subtasks runs queued tasks in the
+meantime, so nested calls neither deadlock nor hold up workers.  This allows,
+e.g., component-level and subset-level counting to run concurrently.
+
+Task functions and arguments must be picklable.  Broadcast values and spilled
+count tables (see concurrency.broadcast() and counting.aggregate) are stored in
+files in the temporary directory, so remote workers require TMPDIR to be a
+shared file system.
+
+LocalCluster runs a coordinator and its workers on the local host, for testing.
+'''
+from multiprocessing.managers import BaseManager
+from qfault.util import concurrency
+import Queue
+import cPickle
+import logging
+import multiprocessing
+import os
+import sys
+import threading
+import time
+import traceback
+import uuid
+
+logger = logging.getLogger('util.distributed')
+
+__all__ = ['Coordinator', 'LocalCluster', 'RemoteError', 'run_worker']
+
+# Default number of seconds without progress after which tasks are handed
+# out again, and the number of times that a task may be handed out again.
+TASK_TIMEOUT = 3600
+RETRIES = 3
+
+
+class RemoteError(Exception):
+    '''
+    A task raised an exception on a worker.  The message contains the
+    remote traceback.
+    '''
+
+
+class _WorkerManager(BaseManager):
+    pass
+
+_WorkerManager.register('get_tasks')
+_WorkerManager.register('get_results')
+_WorkerManager.register('get_workers')
+
+
+class _Results(object):
+    '''
+    The result queues of the jobs in progress.  Results of jobs that are
+    no longer in progress are discarded.
+    '''
+
+    def __init__(self):
+        self._queues = {}
+        self._lock = threading.Lock()
+
+    def open(self, job):
+        with self._lock:
+            self._queues[job] = Queue.Queue()
+
+    def release(self, job):
+        with self._lock:
+            self._queues.pop(job, None)
+
+    def put(self, job, result):
+        with self._lock:
+            queue = self._queues.get(job)
+        if None != queue:
+            queue.put(result)
+
+    def get(self, job, timeout):
+        with self._lock:
+            queue = self._queues[job]
+        return queue.get(timeout=timeout)
+
+
+class _TaskPool(object):
+    '''
+    Runs jobs on the workers of a coordinator.  Supports the parts of the
+    multiprocessing.Pool interface that are used by the concurrency module
+    (map, imap, imap_unordered and apply).  Jobs must be submitted from
+    a single thread.
+    '''
+
+    # How often to check for lost tasks, in seconds.
+    _POLL_SECONDS = 1
+
+    def __init__(self, tasks, results, task_timeout, retries, help=None):
+        '''
+        :param tasks: The task queue.
+        :param results: The _Results of the coordinator.
+        :param task_timeout: See Coordinator.
+        :param int retries: See Coordinator.
+        :param help: (optional) Called while waiting for results.  Returns True
+                     if it did some work, and False otherwise.
+        '''
+        self._tasks = tasks
+        self._results = results
+        self.task_timeout = task_timeout
+        self.retries = retries
+        self._help = help
+
+    def imap(self, func, iterable, chunksize=1):
+        '''
+        Equivalent of `itertools.imap()`.  Results are returned in order,
+        as soon as they are available.
+        '''
+        results = {}
+        expected = 0
+        for index, result in self._run(func, iterable):
+            results[index] = result
+            while expected in results:
+                yield results.pop(expected)
+                expected += 1
+
+    def imap_unordered(self, func, iterable, chunksize=1):
+        '''
+        Like imap(), but results are returned in order of completion.
+        '''
+        return (result for _, result in self._run(func, iterable))
+
+    def map(self, func, iterable, chunksize=None):
+        '''
+        Equivalent of `map()` builtin
+        '''
+        return list(self.imap(func, iterable))
+
+    def apply(self, func, args=(), kwds={}):
+        '''
+        Equivalent of `apply()` builtin
+        '''
+        return self.map(_Apply(func, kwds), [args])[0]
+
+    def _run(self, func, iterable):
+        job = uuid.uuid4().hex
+        self._results.open(job)
+        try:
+            pending = {}
+            for index, arg in enumerate(iterable):
+                payload = cPickle.dumps((func, arg), cPickle.HIGHEST_PROTOCOL)
+                pending[index] = [payload, 0]
+                self._submit(job, index, pending[index])
+
+            logger.debug('Job %s: %s tasks', job, len(pending))
+            progress = time.time()
+            while pending:
+                try:
+                    timeout = 0 if self._help else self._POLL_SECONDS
+                    index, ok, value = self._results.get(job, timeout)
+                except Queue.Empty:
+                    if not (self._help and self._help()):
+                        progress = self._resubmit_lost(job, pending, progress)
+                    continue
+
+                # Retried tasks may return more than once.
+                if index not in pending:
+                    continue
+                if not ok:
+                    raise RemoteError(value)
+                del pending[index]
+                progress = time.time()
+                yield index, cPickle.loads(value)
+        finally:
+            self._results.release(job)
+
+    def _submit(self, job, index, task):
+        task[1] += 1
+        self._tasks.put((job, index, task[0]))
+
+    def _resubmit_lost(self, job, pending, progress):
+        if time.time() - progress < self.task_timeout:
+            return progress
+        for index, task in pending.iteritems():
+            if task[1] > self.retries:
+                raise RemoteError('Task {0} of job {1} was lost {2} times'.format(index, job, task[1]))
+            logger.warning('Task %s of job %s timed out; retrying', index, job)
+            self._submit(job, index, task)
+        return time.time()
+
+
+class Coordinator(_TaskPool):
+    '''
+    Hands out tasks to remote workers.  The coordinator is a pool (see
+    _TaskPool) that may be installed with concurrency.use_pool().
+    '''
+
+    def __init__(self, address=('', 0), authkey=None, task_timeout=TASK_TIMEOUT, retries=RETRIES):
+        '''
+        :param address: The (host, port) on which to listen.  Port 0 selects a free port.
+        :param str authkey: The key that workers must present.  Default is a random key.
+        :param task_timeout: The number of seconds without progress on a job after
+                             which its outstanding tasks are handed out again.
+        :param int retries: The number of times a task may be handed out again.
+        '''
+        if None == authkey:
+            authkey = os.urandom(16)
+        self.authkey = authkey
+
+        tasks = Queue.Queue()
+        results = _Results()
+        self._workers = Queue.Queue()
+
+        class Manager(BaseManager):
+            pass
+        Manager.register('get_tasks', callable=lambda: tasks)
+        Manager.register('get_results', callable=lambda: results)
+        Manager.register('get_workers', callable=lambda: self._workers)
+
+        self._server = Manager(address=address, authkey=authkey).get_server()
+        self.address = self._server.address
+        thread = threading.Thread(target=self._server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        logger.info('Coordinator listening on %s:%s', *self.address)
+
+        super(Coordinator, self).__init__(tasks, results, task_timeout, retries)
+
+    def workers(self):
+        '''
+        Returns the number of workers that have connected so far.
+        '''
+        return self._workers.qsize()
+
+    def close(self, workers=None):
+        '''
+        Tells workers to exit.
+
+        :param int workers: (optional) The number of workers to stop.  Default
+                            is the number of workers that have connected.
+        '''
+        if None == workers:
+            workers = self.workers()
+        for _ in range(workers):
+            self._tasks.put(None)
+
+
+class _Apply(object):
+
+    def __init__(self, func, kwds):
+        self._func = func
+        self._kwds = kwds
+
+    def __call__(self, args):
+        return self._func(*args, **self._kwds)
+
+
+def _execute(task, results):
+    job, index, payload = task
+    try:
+        func, arg = cPickle.loads(payload)
+        result = (True, cPickle.dumps(func(arg), cPickle.HIGHEST_PROTOCOL))
+    except Exception:
+        result = (False, traceback.format_exc())
+    results.put(job, (index,) + result)
+
+class _Helper(object):
+    '''
+    Runs a queued task, if there is one, while a task of the worker waits
+    for the results of its subtasks.
+    '''
+
+    # How long to wait for a task, in seconds.
+    _WAIT_SECONDS = 0.05
+
+    def __init__(self, tasks, results):
+        self._tasks = tasks
+        self._results = results
+
+    def __call__(self):
+        try:
+            task = self._tasks.get(True, self._WAIT_SECONDS)
+        except Queue.Empty:
+            return False
+        if None == task:
+            # Leave the stop request for the main loop of a worker.
+            self._tasks.put(None)
+            return False
+        _execute(task, self._results)
+        return True
+
+
+def run_worker(address, authkey, slots=multiprocessing.cpu_count()):
+    '''
+    Runs tasks from the coordinator at the given address until told to stop,
+    or until the coordinator can no longer be reached.
+
+    Concurrent calls made by a task are split into the given number of
+    subtasks, which are queued with the coordinator like any other task.
+    While it waits for the results, the worker runs queued tasks (its own
+    subtasks, or any other), so that waiting tasks do not hold up workers.
+    '''
+    manager = _WorkerManager(address=address, authkey=authkey)
+    manager.connect()
+    tasks = manager.get_tasks()
+    results = manager.get_results()
+    manager.get_workers().put(os.getpid())
+
+    # Tasks run as they would in a pool worker process; in particular, spilled
+    # count tables that are returned belong to the coordinator (see aggregate).
+    process = multiprocessing.current_process()
+    if not process.daemon:
+        process.daemon = True
+    nested = _TaskPool(tasks, results, TASK_TIMEOUT, RETRIES, help=_Helper(tasks, results))
+    concurrency.use_pool(nested, slots)
+
+    while True:
+        try:
+            task = tasks.get()
+        except (EOFError, IOError):
+            logger.info('Lost connection to coordinator %s:%s', *address)
+            return
+        if None == task:
+            return
+        _execute(task, results)
+
+
+class LocalCluster(object):
+    '''
+    A coordinator with worker processes on the local host.  Within a with
+    statement, the cluster is used by the concurrency module.  Unlike a
+    multiprocessing.Pool, the cluster runs nested concurrent calls concurrently
+    (see run_worker()).
+
+    >>> with LocalCluster(2):                                    # doctest: +SKIP
+    ...     concurrency.mapreduce_concurrent(abs, sum, [-1, -2])
+    3
+    '''
+
+    def __init__(self, workers=multiprocessing.cpu_count(), slots=None, **kwargs):
+        '''
+        :param int workers: The number of worker processes.
+        :param int slots: (optional) The number of slices per job, including
+                          nested jobs.  Default is four times the number of workers.
+        :param kwargs: Passed to Coordinator.
+        '''
+        self.coordinator = Coordinator(('127.0.0.1', 0), **kwargs)
+        self.slots = slots or 4 * workers
+        self._processes = [multiprocessing.Process(target=run_worker,
+                                                   args=(self.coordinator.address,
+                                                         self.coordinator.authkey,
+                                                         self.slots))
+                           for _ in range(workers)]
+        for process in self._processes:
+            process.daemon = True
+            process.start()
+
+    def processes(self):
+        return list(self._processes)
+
+    def close(self):
+        self.coordinator.close(len(self._processes))
+        for process in self._processes:
+            process.join(5)
+            if process.is_alive():
+                process.terminate()
+
+    def __enter__(self):
+        concurrency.use_pool(self.coordinator, self.slots)
+        return self
+
+    def __exit__(self, *exc_info):
+        concurrency.initialize_concurrency(0)
+        self.close()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) not in (3, 4):
+        print 'usage: python -m qfault.util.distributed HOST:PORT AUTHKEY [SLOTS]'
+        sys.exit(2)
+    logging.basicConfig(level=logging.INFO)
+    host, port = sys.argv[1].rsplit(':', 1)
+    slots = int(sys.argv[3]) if 4 == len(sys.argv) else multiprocessing.cpu_count()
+    run_worker((host, int(port)), sys.argv[2], slots)
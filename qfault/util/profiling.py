@@ -0,0 +1,215 @@
+'''
+Low-overhead profiling of counting runs.
+
+When profiling is enabled, each call to a profiled method (see profiled()) or
+section() is recorded in a tree of calls.  Each node of the tree holds, for one
+call path, the number of calls, the wall and CPU time, the largest growth of
+resident memory over a single call, and metrics such as table sizes and cache
+hits (see record()).  The tree may be written as JSON, or as folded stacks
+for flame graph tools (e.g., flamegraph.pl or speedscope).
+
+When profiling is disabled (the default), profiled methods and record() only
+test a flag, so profiling may be left in place in production code.
+
+>>> enable()
+>>> with section('outer'):
+...     with section('inner'):
+...         record('entries', 5)
+>>> report()['children'][0]['children'][0]['metrics']
+{'entries': 5}
+>>> enable(False); reset()
+
+Only the calling process is profiled.  The CPU time and memory of pool workers
+are not included, although the wall time spent waiting for them is.
+
+Resident memory is read from /proc/self/statm.  Where /proc is not available,
+the peak resident memory of the process is used instead, so that the growth
+only reflects new peaks.
+'''
+import functools
+import json
+import resource
+import time
+
+__all__ = ['enable', 'enabled', 'reset', 'section', 'record', 'profiled',
+           'report', 'write_json', 'write_folded']
+
+_enabled = False
+
+def enable(enabled=True):
+    '''
+    Enables (or disables) profiling.
+    '''
+    global _enabled
+    _enabled = enabled
+
+def enabled():
+    return _enabled
+
+
+class _Node(object):
+
+    __slots__ = ('name', 'children', 'calls', 'wall', 'cpu', 'rss_growth', 'metrics')
+
+    def __init__(self, name):
+        self.name = name
+        self.children = {}
+        self.calls = 0
+        self.wall = 0.
+        self.cpu = 0.
+        self.rss_growth = 0
+        self.metrics = {}
+
+    def child(self, name):
+        try:
+            return self.children[name]
+        except KeyError:
+            node = self.children[name] = _Node(name)
+            return node
+
+    def as_dict(self):
+        children = sorted((child.as_dict() for child in self.children.itervalues()),
+                          key=lambda child: -child['wall'])
+        wall = self.wall
+        if self is _root:
+            wall = sum(child['wall'] for child in children)
+        return {'name': self.name,
+                'calls': self.calls,
+                'wall': wall,
+                'self_wall': wall - sum(child['wall'] for child in children),
+                'cpu': self.cpu,
+                'rss_growth_kb': self.rss_growth,
+                'metrics': dict(self.metrics),
+                'children': children}
+
+_root = _Node('root')
+_stack = [_root]
+
+def reset():
+    '''
+    Discards everything recorded so far.
+    '''
+    global _root
+    _root = _Node('root')
+    _stack[:] = [_root]
+
+
+class section(object):
+    '''
+    A context manager that records the enclosed code as a call to the given name,
+    within the enclosing section.
+    '''
+
+    __slots__ = ('_name', '_node', '_wall', '_cpu', '_rss')
+
+    def __init__(self, name):
+        self._name = name
+        self._node = None
+
+    def __enter__(self):
+        if _enabled:
+            self._node = _stack[-1].child(self._name)
+            self._node.calls += 1
+            _stack.append(self._node)
+            self._wall = time.time()
+            self._cpu = time.clock()
+            self._rss = _rss_kb()
+        return self
+
+    def __exit__(self, *exc_info):
+        node = self._node
+        if None == node:
+            return
+        node.wall += time.time() - self._wall
+        node.cpu += time.clock() - self._cpu
+        node.rss_growth = max(node.rss_growth, _rss_kb() - self._rss)
+        _stack.pop()
+        self._node = None
+
+_PAGE_KB = resource.getpagesize() // 1024
+
+def _rss_kb():
+    '''
+    Returns the resident memory of the process, in kB.
+    '''
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * _PAGE_KB
+    except IOError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def record(metric, value=1):
+    '''
+    Adds value to the given metric of the current section.
+    '''
+    if _enabled:
+        metrics = _stack[-1].metrics
+        metrics[metric] = metrics.get(metric, 0) + value
+
+def _entries(result):
+    return sum(len(countsK) for countsK in result.counts)
+
+def profiled(method):
+    '''
+    Decorator for component methods.  Each call is recorded in a section named
+    after the class and identifier() of the component, and the method.  The
+    number of entries of count results that are passed to, or returned by, the
+    method are recorded as the input_entries and output_entries metrics.
+    Calls of overridden methods (through super()) are part of the overriding call.
+    '''
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if not _enabled:
+            return method(self, *args, **kwargs)
+
+        name = '{0}[{1}].{2}'.format(type(self).__name__,
+                                     self.identifier().hexdigest()[:8],
+                                     method.__name__)
+        if _stack[-1].name == name:
+            return method(self, *args, **kwargs)
+        with section(name):
+            for arg in args + tuple(kwargs.values()):
+                if hasattr(arg, 'counts'):
+                    record('input_entries', _entries(arg))
+            result = method(self, *args, **kwargs)
+            if hasattr(result, 'counts'):
+                record('output_entries', _entries(result))
+        return result
+
+    return wrapper
+
+def report():
+    '''
+    Returns the call tree as nested dictionaries.  Times are in seconds,
+    and memory is in kilobytes.
+    '''
+    return _root.as_dict()
+
+def write_json(filename):
+    '''
+    Writes the call tree (see report()) to the given file, as JSON.
+    '''
+    with open(filename, 'w') as f:
+        json.dump(report(), f, indent=1)
+
+def write_folded(filename):
+    '''
+    Writes the call tree to the given file as folded stacks, i.e., one line
+    per call path with the wall time (in microseconds) spent in the last
+    call of the path, excluding nested sections.
+    '''
+    def lines(node, path):
+        path = path + (node['name'],)
+        yield '{0} {1}\n'.format(';'.join(path), int(round(1e6 * node['self_wall'])))
+        for child in node['children']:
+            for line in lines(child, path):
+                yield line
+
+    with open(filename, 'w') as f:
+        for child in report()['children']:
+            f.writelines(lines(child, ()))
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
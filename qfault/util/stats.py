@@ -35,4 +35,118 @@ def stdProduct(stds, vals):
 	varTerms = [(prod*s/vals[i])**2 for i,s in enumerate(stds)]
 	return math.sqrt(sum(varTerms))
 		
-	
\ No newline at end of file
+	
+
+class RunningStats(object):
+	'''
+	Streaming mean and variance of a sample (Welford's method).  Values are
+	added one at a time, so that memory does not grow with the sample.
+	Partial statistics (e.g., from different workers) are combined with + or
+	merge().
+	
+	>>> s = RunningStats([1, 2, 3])
+	>>> s.mean, s.std()
+	(2.0, 1.0)
+	>>> t = s + RunningStats([4, 5])
+	>>> t.n, t.mean, t.std() == std([1, 2, 3, 4, 5])
+	(5, 3.0, True)
+	'''
+	
+	def __init__(self, sample=()):
+		self.n = 0
+		self.mean = 0.
+		self.m2 = 0.
+		self.update(sample)
+		
+	@classmethod
+	def fromCounts(cls, successes, n):
+		'''
+		Returns the statistics of n values of 0 or 1, of which successes are 1.
+		'''
+		s = cls()
+		s.n = n
+		if n:
+			s.mean = successes / float(n)
+			s.m2 = n * s.mean * (1 - s.mean)
+		return s
+		
+	def add(self, x):
+		self.n += 1
+		delta = x - self.mean
+		self.mean += delta / self.n
+		self.m2 += delta * (x - self.mean)
+		
+	def update(self, sample):
+		for x in sample:
+			self.add(x)
+			
+	def merge(self, other):
+		'''
+		Adds the values of other to this sample.
+		'''
+		n = self.n + other.n
+		if not n:
+			return
+		delta = other.mean - self.mean
+		self.mean += delta * other.n / n
+		self.m2 += other.m2 + delta**2 * self.n * other.n / n
+		self.n = n
+		
+	def __add__(self, other):
+		s = RunningStats()
+		s.merge(self)
+		s.merge(other)
+		return s
+	
+	def std(self):
+		return math.sqrt(self.m2 / (self.n - 1))
+	
+	def stdErr(self):
+		return stdErr(self.std(), self.n)
+	
+	def interval(self, z=1.96):
+		'''
+		Returns the (normal approximation) confidence interval of the mean,
+		with z standard errors on each side.
+		'''
+		halfWidth = z * self.stdErr()
+		return self.mean - halfWidth, self.mean + halfWidth
+	
+	def getStats(self):
+		'''
+		Returns the mean, standard deviation and 95% error, as for getStats().
+		'''
+		return self.mean, self.std(), err95(self.stdErr())
+	
+	def __repr__(self):
+		return 'RunningStats(n={0}, mean={1:.6g}, m2={2:.6g})'.format(self.n, self.mean, self.m2)
+	
+
+class NarrowInterval(object):
+	'''
+	A sequential stopping rule.  Returns True for statistics (a RunningStats)
+	whose confidence interval has a half-width of at most halfWidth, or, if
+	relative is True, of at most halfWidth times the mean.  Samples of fewer
+	than minSamples values never stop, nor, for the relative rule, samples
+	with a mean of zero (e.g., no failures yet).
+	
+	>>> stop = NarrowInterval(0.5, relative=True, minSamples=10)
+	>>> stop(RunningStats.fromCounts(0, 1000)), stop(RunningStats.fromCounts(20, 1000))
+	(False, True)
+	'''
+	
+	def __init__(self, halfWidth, relative=False, z=1.96, minSamples=100):
+		self.halfWidth = halfWidth
+		self.relative = relative
+		self.z = z
+		self.minSamples = minSamples
+		
+	def __call__(self, stats):
+		if stats.n < max(self.minSamples, 2):
+			return False
+		target = self.halfWidth
+		if self.relative:
+			if not stats.mean:
+				return False
+			target *= abs(stats.mean)
+		return self.z * stats.stdErr() <= target
@@ -0,0 +1,145 @@
+'''
+Tracing of hot code paths.
+
+Debug logging of count results formats entire count tables whenever DEBUG is
+enabled, and messages that are formatted eagerly cost time even when it is not.
+A tracer is cheap to leave in hot code instead: call sites test the enabled
+attribute of the tracer, so a disabled tracer costs a single attribute lookup.
+
+>>> tracer = get_tracer('example')
+>>> if tracer.enabled:
+...     tracer.event('counts=%s', {'a': 1})
+
+Tracers write to the logger of the same name, at DEBUG level.  Count tables
+and count results in the arguments of an event are written as summaries with a
+limited number of entries (see summarize()), and events may be sampled.
+
+>>> enable('example', sample=2)
+>>> tracer.enabled
+True
+>>> enable(False)
+'''
+import itertools
+import logging
+
+__all__ = ['get_tracer', 'enable', 'summarize', 'Tracer']
+
+# The number of entries of a count table that are included in a summary.
+MAX_ENTRIES = 5
+
+_tracers = {}
+_enabled = []
+
+def get_tracer(name):
+    '''
+    Returns the tracer with the given name, creating it if necessary.
+    '''
+    try:
+        return _tracers[name]
+    except KeyError:
+        tracer = _tracers[name] = Tracer(name)
+        tracer._configure()
+        return tracer
+
+def enable(prefix='', sample=1):
+    '''
+    Enables the tracers whose names start with the given prefix, including
+    tracers created later.  The loggers of these tracers are set to the DEBUG
+    level while the tracers are enabled.  Pass False to disable all tracers.
+
+    :param str prefix: The prefix of the tracer names, e.g., 'counting'.
+    :param int sample: (optional) Write only one in every sample events of
+                       each message.
+    '''
+    if False is prefix:
+        del _enabled[:]
+    else:
+        _enabled.append((prefix, sample))
+    for tracer in _tracers.itervalues():
+        tracer._configure()
+
+
+class Tracer(object):
+    '''
+    Writes events to a logger.  Use get_tracer() to obtain instances.
+    '''
+
+    def __init__(self, name):
+        self.name = name
+        self.enabled = False
+        self._logger = logging.getLogger(name)
+        self._sample = 1
+        self._seen = {}
+        self._level = logging.NOTSET
+
+    def _configure(self):
+        was_enabled = self.enabled
+        self.enabled = False
+        for prefix, sample in _enabled:
+            if self.name.startswith(prefix):
+                self.enabled = True
+                self._sample = sample
+
+        # The level of the logger is restored when the tracer is disabled.
+        if self.enabled and not was_enabled:
+            self._level = self._logger.level
+            self._logger.setLevel(logging.DEBUG)
+        elif was_enabled and not self.enabled:
+            self._logger.setLevel(self._level)
+
+    def event(self, msg, *args):
+        '''
+        Writes the message, with summaries of the arguments, to the logger.
+        Call only when the tracer is enabled.
+        '''
+        seen = self._seen.get(msg, 0)
+        self._seen[msg] = seen + 1
+        if seen % self._sample:
+            return
+        self._logger.debug(msg, *[_Summary(arg) for arg in args])
+
+
+class _Summary(object):
+    '''
+    Summarizes its argument only if the event is actually written.
+    '''
+
+    def __init__(self, obj):
+        self._obj = obj
+
+    def __str__(self):
+        return summarize(self._obj)
+
+def summarize(obj, max_entries=None):
+    '''
+    Returns a string representation of obj, in which count results, lists of
+    count tables, and count tables are shortened to the number of entries of
+    each table, and its first max_entries entries (default MAX_ENTRIES).
+
+    >>> summarize({(0,): 3, (1,): 2}, 1)
+    '{2 entries: (0,): 3, ...}'
+    >>> summarize([{0: 1}, {}])
+    '[{1 entries: 0: 1}, {0 entries}]'
+    '''
+    if None == max_entries:
+        max_entries = MAX_ENTRIES
+    if hasattr(obj, 'counts') and hasattr(obj, 'blocks'):
+        return 'CountResult(blocks={0}, counts={1})'.format(list(obj.blocks),
+                                                            summarize(obj.counts, max_entries))
+    if isinstance(obj, (list, tuple)) and obj and all(hasattr(item, 'iteritems') for item in obj):
+        return '[' + ', '.join(summarize(counts, max_entries) for counts in obj) + ']'
+    if hasattr(obj, 'iteritems') and hasattr(obj, '__len__'):
+        entries = ['{0!r}: {1!r}'.format(key, value)
+                   for key, value in itertools.islice(obj.iteritems(), max_entries)]
+        if len(obj) > max_entries:
+            entries.append('...')
+        text = '{0} entries'.format(len(obj))
+        if entries:
+            text += ': ' + ', '.join(entries)
+        return '{' + text + '}'
+    return str(obj)
+
+
+if __name__ == '__main__':
+    import doctest
+    doctest.testmod()
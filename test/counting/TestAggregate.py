@@ -0,0 +1,202 @@
+from qfault.circuit import location
+from qfault.counting import aggregate
+from qfault.counting.convolve import convolve_counts, convolve_dict, convolve_dict_tuples
+from qfault.counting.count_locations import count_errors_of_order_k, map_counts
+from qfault.counting.result import CountResult, CountResultBuilder
+from qfault.noise import CountingNoiseModelXZ
+from qfault.qec.error import Pauli
+from qfault.util import concurrency
+import cPickle
+import functools
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+
+
+def _locations():
+    return location.Locations([location.prep(Pauli.Z, 'A', 0),
+                               location.prep(Pauli.X, 'B', 0),
+                               location.cnot('A', 0, 'B', 0),
+                               location.rest('A', 0),
+                               location.cnot('B', 0, 'A', 0),
+                               location.meas(Pauli.X, 'B', 0)])
+
+def _tuple_key(errors):
+    return tuple((e.ebits['X'] << 1) | e.ebits['Z'] for e in errors)
+
+
+class TestSpilling(unittest.TestCase):
+
+    def setUp(self):
+        concurrency.initialize_concurrency(0)
+
+    def tearDown(self):
+        aggregate.set_memory_budget(None)
+
+    def _compare(self, func):
+        aggregate.set_memory_budget(None)
+        expected = func()
+        aggregate.set_memory_budget(3)
+        return expected, func()
+
+    def testCountErrors(self):
+        locations = _locations()
+        noise = CountingNoiseModelXZ()
+        for k in range(1, 4):
+            expected, spilled = self._compare(lambda: count_errors_of_order_k(k, locations, noise))
+            assert isinstance(spilled, aggregate.MergedCounts)
+            assert dict(spilled.iteritems()) == expected
+
+    def testMapCounts(self):
+        counts = [{(i, j): i * j + 1 for i in range(5) for j in range(5)}]
+        keymap = lambda key: None if 0 == key[0] else (key[0] % 3, key[1])
+        expected, spilled = self._compare(lambda: map_counts(counts, keymap, drop_rejected=True))
+        assert dict(spilled[0].iteritems()) == expected[0]
+        assert None not in expected[0]
+
+    def testConvolveCounts(self):
+        counts1 = [{(i, 0): 1 for i in range(4)}, {(i, 1): i for i in range(4)}]
+        counts2 = [{(0, 0): 1}, {(i, j): 2 for i in range(4) for j in range(2)}]
+        convolve = functools.partial(convolve_dict_tuples, [2, 1], [2, 1])
+        run = lambda: convolve_counts(counts1, counts2, convolve_fcn=convolve)
+        expected, spilled = self._compare(run)
+        assert len(expected) == len(spilled)
+        for exp, spill in zip(expected, spilled):
+            assert dict(spill.iteritems()) == exp
+
+    def testBuilderSpills(self):
+        aggregate.set_memory_budget(3)
+        builder = CountResultBuilder(1, ('a',))
+        builder.add_counts([{(i,): i for i in range(10)}])
+        builder.add_counts([{(i,): 1 for i in range(5)}])
+        counts = builder.build().counts
+        assert isinstance(counts[0], aggregate.MergedCounts)
+        assert dict(counts[0].iteritems()) == {(i,): i + (i < 5) for i in range(10)}
+
+    def testRunsAreReleased(self):
+        aggregate.set_memory_budget(3)
+        counts = aggregate.collect(((i,), 1) for i in range(10))
+        runs = counts._runs
+        assert all(os.path.exists(run) for run in runs)
+        del counts
+        assert not any(os.path.exists(run) for run in runs)
+
+    def testReprIdentifiesContent(self):
+        aggregate.set_memory_budget(3)
+        counts1 = aggregate.collect(((i,), 1) for i in range(10))
+        counts2 = aggregate.collect(((i,), 2) for i in range(10))
+        counts3 = aggregate.collect(((i,), 1) for i in reversed(range(10)))
+        assert len(counts1._runs) == len(counts2._runs)
+        assert repr(counts1) != repr(counts2)
+        assert repr(counts1) == repr(counts3)
+
+    def testGet(self):
+        # Runs of several records each.
+        aggregate.set_memory_budget(6)
+        aggregate._RECORD_SIZE, recordSize = 2, aggregate._RECORD_SIZE
+        try:
+            builder = aggregate.new_counts()
+            for i in range(40):
+                builder[(i % 13,)] = builder.get((i % 13,), 0) + i
+            builder.pop((5,), None)
+            counts = aggregate.finalize(builder)
+        finally:
+            aggregate._RECORD_SIZE = recordSize
+        expected = dict(counts.iteritems())
+        assert (5,) not in expected
+        for i in range(15):
+            assert expected.get((i,)) == counts.get((i,))
+        assert 'none' == counts.get((5,), 'none')
+
+    def testConvolveReadsSpilledOnce(self):
+        aggregate.set_memory_budget(4)
+        counts1 = aggregate.collect(((i,), 1) for i in range(10))
+        counts2 = aggregate.collect(((i,), i) for i in range(8))
+        reads = []
+        readRun = aggregate.MergedCounts._read_run
+        def countingRead(index, path):
+            reads.append(path)
+            return readRun(index, path)
+        aggregate.MergedCounts._read_run = staticmethod(countingRead)
+        try:
+            convolved = convolve_dict(counts1, counts2, keyOp=lambda a, b: a + b)
+        finally:
+            aggregate.MergedCounts._read_run = staticmethod(readRun)
+        expected = convolve_dict(dict(counts1.iteritems()), dict(counts2.iteritems()), keyOp=lambda a, b: a + b)
+        assert expected == dict(convolved.iteritems())
+        # counts2 is read once, and counts1 once for each of the two blocks.
+        assert len(counts2._runs) + 2 * len(counts1._runs) == len(reads)
+
+    def testPickleCopiesRuns(self):
+        store = tempfile.mkdtemp()
+        aggregate.set_store_dir(store)
+        try:
+            aggregate.set_memory_budget(600)
+            counts = aggregate.collect(((i,), i) for i in range(1000))
+            pickled = cPickle.dumps(CountResult([{(0,): 1}, counts], ('a',)), 2)
+            expected = dict(counts.iteritems())
+            del counts
+            loaded = cPickle.loads(pickled).counts
+            assert {(0,): 1} == loaded[0]
+            assert isinstance(loaded[1], aggregate.MergedCounts)
+            assert expected == dict(loaded[1].iteritems())
+            assert all(run.startswith(store) for run in loaded[1]._runs)
+            assert len(loaded[1]._runs) == len(os.listdir(store))
+            # The pickle holds the paths of the runs, not their entries.
+            assert len(pickled) < len(cPickle.dumps(expected, 2))
+        finally:
+            aggregate.set_store_dir(os.path.join(os.path.pardir, 'data', 'runs'))
+            shutil.rmtree(store)
+
+
+_COUNT_SCRIPT = '''
+from qfault.counting import aggregate
+from qfault.counting.component.transversal import TransCnot
+from qfault.noise import CountingNoiseModelXZ
+from qfault.qec.ed422 import ED412Code
+from qfault.qec.error import Pauli
+from qfault.util import cache
+import sys
+cache.enableMemo(False)
+aggregate.set_memory_budget(int(sys.argv[1]) or None)
+kGood = {Pauli.X: 2, Pauli.Z: 2, Pauli.Y: 2}
+cnot = TransCnot(kGood, ED412Code(), ED412Code())
+noiseModels = {pauli: CountingNoiseModelXZ() for pauli in (Pauli.X, Pauli.Z, Pauli.Y)}
+result = cnot.count(noiseModels, Pauli.Y)
+print sorted(sorted(countsK.iteritems()) for countsK in result.counts)
+'''
+
+class TestSpilledCache(unittest.TestCase):
+    '''
+    Spilled counts that are cached must be usable by later processes.
+    '''
+
+    def setUp(self):
+        # The data directory is relative to the working directory.
+        self._tmp = tempfile.mkdtemp()
+        self._work = os.path.join(self._tmp, 'work')
+        os.mkdir(self._work)
+
+    def tearDown(self):
+        shutil.rmtree(self._tmp)
+
+    def _count(self, budget):
+        env = dict(os.environ)
+        root = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+        env['PYTHONPATH'] = os.pathsep.join([root, env.get('PYTHONPATH', '')])
+        return subprocess.check_output([sys.executable, '-c', _COUNT_SCRIPT, str(budget)],
+                                       cwd=self._work, env=env)
+
+    def testFetchInNewProcess(self):
+        spilled = self._count(3)
+        assert self._count(3) == spilled
+        assert os.listdir(os.path.join(self._tmp, 'data'))
+        shutil.rmtree(os.path.join(self._tmp, 'data'))
+        assert self._count(0) == spilled
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+from fixtures import cnots, sympy_noise_models
+from qfault.counting.budget import count_to_budget
+from qfault.qec.error import Pauli
+from qfault.util import cache, concurrency
+import unittest
+
+
+class TestCountToBudget(unittest.TestCase):
+
+    def setUp(self):
+        cache.enableFetch(False)
+        concurrency.initialize_concurrency(0)
+        self.component = cnots(3)
+        self.noiseModels = sympy_noise_models()
+
+    def tearDown(self):
+        cache.enableFetch(True)
+
+    def testStopsEarly(self):
+        budgeted = count_to_budget(self.component, self.noiseModels, Pauli.Y, 1e-3, [1e-5, 1e-4])
+        assert budgeted.converged
+        assert budgeted.k < 3
+        assert budgeted.tail <= 1e-3
+        assert len(budgeted.result.counts) == budgeted.k + 1
+        assert len(budgeted.contributions) == budgeted.k + 1
+
+    def testCountsMatchDirectCount(self):
+        budgeted = count_to_budget(self.component, self.noiseModels, Pauli.Y, 1e-9, [1e-4])
+        expected = self.component.count(self.noiseModels, Pauli.Y, kMax=budgeted.k)
+        assert budgeted.result.counts == expected.counts
+
+    def testCountsOnce(self):
+        orders = []
+        count = self.component.count
+        def recordingCount(noiseModels, pauli, inputResult=None, kMax=None):
+            orders.append(kMax)
+            return count(noiseModels, pauli, inputResult, kMax)
+        self.component.count = recordingCount
+
+        budgeted = count_to_budget(self.component, self.noiseModels, Pauli.Y, 1e-3, [1e-5, 1e-4])
+        assert [budgeted.k] == orders
+
+    def testStopsAtKMax(self):
+        budgeted = count_to_budget(self.component, self.noiseModels, Pauli.Y, 0, [1e-3], kMax=1)
+        assert not budgeted.converged
+        assert 1 == budgeted.k
+
+
+if __name__ == "__main__":
+    unittest.main()
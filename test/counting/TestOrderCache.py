@@ -0,0 +1,100 @@
+from fixtures import cnots, counting_noise_models
+from qfault.counting.component.transversal import TransCnot
+from qfault.qec.error import Pauli
+from qfault.util import cache, concurrency
+import functools
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class RecordingCnot(TransCnot):
+    '''
+    A transversal CNOT that records the orders that it counts.
+    '''
+
+    def __init__(self, kGood, code1, code2, counted, kMins=None):
+        super(RecordingCnot, self).__init__(kGood, code1, code2)
+        self.counted = counted
+        self.kMins = kMins
+
+    def count(self, noiseModels, pauli, inputResult=None, kMax=None, kMin=0):
+        if None != self.kMins and None != inputResult:
+            self.kMins.append(kMin)
+        return super(RecordingCnot, self).count(noiseModels, pauli, inputResult, kMax, kMin)
+
+    def _countOrder(self, noiseModels, pauli, k):
+        self.counted.append(k)
+        return super(RecordingCnot, self)._countOrder(noiseModels, pauli, k)
+
+
+class TestOrderCache(unittest.TestCase):
+
+    def setUp(self):
+        concurrency.initialize_concurrency(0)
+        cache.enableFetch(True)
+        cache.enableMemo(False)
+
+        # The data directory is relative to the working directory.
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self._tmp, 'work'))
+        os.chdir(os.path.join(self._tmp, 'work'))
+
+        self.noiseModels = counting_noise_models()
+        self.counted = []
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self._tmp)
+        cache.enableMemo(True)
+
+    def _component(self, k):
+        return cnots(k, num=1, cnot=functools.partial(RecordingCnot, counted=self.counted))
+
+    def testSmallerKMaxIsTruncated(self):
+        component = self._component(3)
+        full = component.count(self.noiseModels, Pauli.Y, kMax=3)
+        del self.counted[:]
+        partial = component.count(self.noiseModels, Pauli.Y, kMax=1)
+        assert [] == self.counted
+        assert full.counts[:2] == partial.counts
+
+    def testLargerKGoodIsExtended(self):
+        self._component(1).count(self.noiseModels, Pauli.Y)
+        assert [0, 1] == self.counted
+        del self.counted[:]
+        result = self._component(2).count(self.noiseModels, Pauli.Y)
+        assert [2] == self.counted
+        assert 3 == len(result)
+
+    def testCompositeIsExtended(self):
+        kMins = []
+        component = cnots(3, cnot=functools.partial(RecordingCnot, counted=self.counted, kMins=kMins))
+        component.count(self.noiseModels, Pauli.Y, kMax=1)
+        del self.counted[:]
+        del kMins[:]
+        result = component.count(self.noiseModels, Pauli.Y, kMax=3)
+
+        # Only the new orders of the leaves are counted, and the last CNOT
+        # convolves only the orders that the cached result lacks.
+        assert [2, 3] == self.counted
+        assert [0, 2] == kMins
+
+        cache.enableFetch(False)
+        expected = cnots(3).count(self.noiseModels, Pauli.Y, kMax=3)
+        cache.enableFetch(True)
+        assert expected.counts == result.counts
+
+    def testFetchedResultIsReadOnly(self):
+        component = self._component(1)
+        component.count(self.noiseModels, Pauli.Y)
+        fetched = component.count(self.noiseModels, Pauli.Y)
+        self.assertRaises(TypeError, fetched.counts.__setitem__, 0, {})
+        self.assertRaises(TypeError, fetched.counts.append, {})
+        assert 2 == len(component.count(self.noiseModels, Pauli.Y).counts)
+
+
+if __name__ == "__main__":
+    unittest.main()
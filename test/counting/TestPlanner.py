@@ -0,0 +1,85 @@
+from fixtures import cnots, counting_noise_models
+from qfault.counting import aggregate, convolve, planner
+from qfault.counting.convolve import convolve_dict, convolve_dict_dense
+from qfault.qec.error import Pauli
+from qfault.util import cache, concurrency
+import random
+import unittest
+
+
+class TestPlanner(unittest.TestCase):
+
+    def setUp(self):
+        cache.enableFetch(False)
+        concurrency.initialize_concurrency(0)
+        self.component = cnots(1)
+        self.noiseModels = counting_noise_models()
+
+    def tearDown(self):
+        cache.enableFetch(True)
+        convolve.set_convolution_backend('sparse')
+        aggregate.set_memory_budget(None)
+
+    def testSizesAreUpperBounds(self):
+        plan = planner.plan(self.component, self.noiseModels, Pauli.Y, cpus=1)
+        result = self.component.count(self.noiseModels, Pauli.Y)
+        estimated = plan.steps[-1].sizes
+        assert len(estimated) == len(result.counts)
+        for size, countsK in zip(estimated, result.counts):
+            assert len(countsK) <= size
+
+    def testRepeatedComponentIsCached(self):
+        plan = planner.plan(self.component, self.noiseModels, Pauli.Y, cpus=1)
+        counts = [step for step in plan.steps if 'count' == step.kind]
+        assert [step.cached for step in counts] == [False, True]
+        assert 1 == plan.cache_hits
+
+    def testKMaxBoundsCounts(self):
+        bounded = planner.plan(cnots(3), self.noiseModels, Pauli.Y, kMax=1, cpus=1)
+        plan = planner.plan(self.component, self.noiseModels, Pauli.Y, cpus=1)
+        for step, expected in zip(bounded.steps, plan.steps):
+            assert expected.sizes == step.sizes
+            assert expected.configs == step.configs
+        assert plan.seconds == bounded.seconds
+
+    def testSpillWhenMemoryIsShort(self):
+        plan = planner.plan(self.component, self.noiseModels, Pauli.Y, memory=1000, cpus=1)
+        assert None != plan.spill_entries
+        plan.apply()
+        assert aggregate.memory_budget() == plan.spill_entries
+        assert convolve.convolution_backend() == plan.backend
+
+    def testNoSpillByDefault(self):
+        plan = planner.plan(self.component, self.noiseModels, Pauli.Y, cpus=1)
+        assert None == plan.spill_entries
+
+    def testWorkersInheritSettings(self):
+        steps = [planner.Step('count', 'count', [1], seconds=100, entries=10**9)]
+        plan = planner.Plan(self.component, Pauli.Y, steps, planner.Rates(), memory=10**9, cpus=2)
+        assert 1 == plan.workers
+        assert None != plan.spill_entries
+        try:
+            plan.apply()
+            pool = concurrency._get_pool()
+            assert plan.spill_entries == pool.apply(aggregate.memory_budget)
+            assert plan.backend == pool.apply(convolve.convolution_backend)
+        finally:
+            concurrency.initialize_concurrency(0)
+
+
+class TestDenseConvolution(unittest.TestCase):
+
+    def testMatchesSparse(self):
+        rand = random.Random(5)
+        counts1 = {rand.randrange(256): rand.randrange(1, 10) for _ in range(40)}
+        counts2 = {rand.randrange(256): rand.randrange(1, 10) for _ in range(60)}
+        assert convolve_dict_dense(counts1, counts2, 8) == convolve_dict(counts1, counts2)
+
+    def testLargeCountsFallBack(self):
+        counts1 = {1: 2**40}
+        counts2 = {2: 2**40, 3: 1}
+        assert convolve_dict_dense(counts1, counts2, 2) == {3: 2**80, 2: 2**40}
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,95 @@
+from qfault.counting.component.base import ParallelComponent
+from qfault.counting.count_locations import map_counts
+from qfault.counting.key import KeyPermuter, IdentityManipulator, KeyExtender
+from qfault.counting.result import CountResult, CountResultBuilder
+from qfault.util.cache import memoize
+from copy import copy
+import cPickle
+import unittest
+
+
+class TestBlockPermutation(unittest.TestCase):
+
+    counts = [{(0, 0, 0): 1}, {(1, 2, 3): 2, (4, 5, 6): 3}]
+    blocks = ('a', 'b', 'c')
+
+    def testRotateSharesCounts(self):
+        result = CountResult(self.counts, self.blocks)
+        rotated = result.rotate(1).rotate(1)
+        assert rotated._counts is self.counts
+        assert rotated.blocks == ('c', 'a', 'b')
+        assert rotated.counts == [{(0, 0, 0): 1}, {(3, 1, 2): 2, (6, 4, 5): 3}]
+
+    def testFullRotationIsIdentity(self):
+        result = CountResult(self.counts, self.blocks)
+        rotated = result.rotate(2).rotate(-2)
+        assert rotated._permutation is None
+        assert rotated.blocks == self.blocks
+
+    def testRotationMatchesTupleRotator(self):
+        for rotation in (1, 2, -1, -2):
+            rotator = ParallelComponent.TupleRotator(rotation)
+            expected = map_counts(self.counts, rotator)
+            result = CountResult(self.counts, self.blocks).rotate(rotation)
+            assert result.counts == expected
+            assert result.blocks == rotator(self.blocks)
+
+    def testPermuterIsMetadata(self):
+        permuter = KeyPermuter(IdentityManipulator(), [2, 0, 1])
+        result = CountResult(self.counts, self.blocks).map_keys(permuter)
+        assert result._counts is self.counts
+        assert result.counts == map_counts(self.counts, permuter)
+
+    def testMapKeysAppliesPermutation(self):
+        extender = KeyExtender(IdentityManipulator(), 1, 0)
+        result = CountResult(self.counts, self.blocks).rotate(1)
+        mapped = result.map_keys(extender, ('d',) + result.blocks)
+        expected = map_counts(map_counts(self.counts, ParallelComponent.TupleRotator(1)), extender)
+        assert mapped.counts == expected
+
+    def testPickleStoresLogicalCounts(self):
+        result = CountResult(self.counts, self.blocks).rotate(1)
+        unpickled = cPickle.loads(cPickle.dumps(result, 2))
+        assert unpickled._permutation is None
+        assert unpickled.counts == result.counts
+        assert unpickled.blocks == result.blocks
+
+
+class TestImmutability(unittest.TestCase):
+
+    def testReadOnlyAttributes(self):
+        result = CountResult([{(0,): 1}], ('a',))
+        self.assertRaises(AttributeError, setattr, result, 'counts', [])
+        self.assertRaises(AttributeError, setattr, result, 'blocks', ())
+
+    def testCopyIsShared(self):
+        result = CountResult([{(0,): 1}], ('a',))
+        assert copy(result) is result
+
+    def testMemoHitIsReadOnly(self):
+        @memoize
+        def count():
+            return CountResult([{(0,): 1}], ('a',))
+        count()
+        result = count()
+        self.assertRaises(TypeError, result.counts.__setitem__, 0, {})
+        self.assertRaises(TypeError, result.counts.extend, [{}])
+        assert count().counts == [{(0,): 1}]
+
+    def testBuilderDoesNotAlterSource(self):
+        counts = [{(0,): 1}, {(1,): 2}]
+        result = CountResult(counts, ('a',))
+        builder = result.builder()
+        builder.discard((0,))
+        builder.add(1, (1,), 1)
+        assert builder.build().counts == [{}, {(1,): 3}]
+        assert result.counts == [{(0,): 1}, {(1,): 2}]
+
+    def testBuilderShift(self):
+        builder = CountResultBuilder(2, ('a',))
+        builder.add_counts([{(0,): 1}, {(1,): 1}], shift=1)
+        assert builder.build().counts == [{}, {(0,): 1}]
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,102 @@
+from fixtures import cnots, counting_noise_models
+from qfault.circuit import location
+from qfault.counting import sampling
+from qfault.counting.count_locations import count_errors_of_order_k
+from qfault.counting.sweep import countable_leaves
+from qfault.noise import CountingNoiseModelXZ
+from qfault.qec.error import Pauli
+from qfault.util import cache
+import random
+import unittest
+
+
+def _locations():
+    locs = []
+    for bit in range(4):
+        locs += [location.prep(Pauli.Z, 'A', bit), location.prep(Pauli.X, 'B', bit)]
+    for bit in range(4):
+        locs += [location.cnot('B', bit, 'A', bit), location.rest('B', bit)]
+    for bit in range(4):
+        locs += [location.meas(Pauli.Z, 'A', bit)]
+    return location.Locations(locs, 'test')
+
+
+class TestSampling(unittest.TestCase):
+
+    def setUp(self):
+        cache.enableFetch(False)
+
+    def tearDown(self):
+        cache.enableFetch(True)
+        cache.clearMemos()
+
+    def testExactOrders(self):
+        locations = _locations()
+        noise = CountingNoiseModelXZ()
+        estimate = sampling.sample_errors_of_order_k(2, locations, noise, samples=1000)
+        assert count_errors_of_order_k(2, locations, noise) == estimate.counts
+        assert 0 == estimate.samples
+        assert (estimate.total, estimate.total) == estimate.interval()
+
+    def testEstimate(self):
+        locations = _locations()
+        noise = CountingNoiseModelXZ()
+        exact = count_errors_of_order_k(3, locations, noise)
+        estimate = sampling.sample_errors_of_order_k(3, locations, noise, samples=500,
+                                                     rng=random.Random(1))
+        assert 500 == estimate.samples
+        assert set(estimate.counts) <= set(exact)
+        assert abs(sum(estimate.counts.values()) - estimate.total) < 1e-6 * estimate.total
+
+        total = sum(exact.values())
+        low, high = estimate.interval(z=4)
+        assert low < total < high
+        assert estimate.total_stderr < 0.2 * total
+
+    def testRepeatable(self):
+        estimates = [sampling.sample_errors_of_order_k(3, _locations(), CountingNoiseModelXZ(),
+                                                       samples=100, rng=random.Random(7))
+                     for _ in range(2)]
+        assert estimates[0].counts == estimates[1].counts
+
+    def testEstimateOrders(self):
+        noiseModels = counting_noise_models()
+        expected = cnots(2).count(noiseModels, Pauli.Y)
+
+        # The CNOTs are identical, so they are estimated once.
+        cache.clearMemos()
+        component = cnots(2)
+        estimates = sampling.estimate_orders(component, noiseModels, Pauli.Y, kExact=1, samples=4,
+                                             rng=random.Random(2))
+        [orders] = estimates.values()
+        assert [0, 0, 4] == [order.samples for order in orders]
+
+        result = component.count(noiseModels, Pauli.Y)
+        assert expected.counts[:2] == result.counts[:2]
+        assert expected.counts[2] != result.counts[2]
+
+    def testEstimatesAreNotSaved(self):
+        noiseModels = counting_noise_models()
+        expected = cnots(2).count(noiseModels, Pauli.Y)
+
+        cache.clearMemos()
+        component = cnots(2)
+        sampling.estimate_orders(component, noiseModels, Pauli.Y, kExact=1, samples=4,
+                                 rng=random.Random(2))
+        cache.clearMemos()
+        cache.enableFetch(True)
+        self.assertRaises(RuntimeError, component.count, noiseModels, Pauli.Y)
+        assert expected.counts == cnots(2).count(noiseModels, Pauli.Y).counts
+
+        for leaf in countable_leaves(component):
+            leaf.clearSeeds()
+        assert expected.counts == component.count(noiseModels, Pauli.Y).counts
+
+    def testFetchEnabled(self):
+        cache.enableFetch(True)
+        self.assertRaises(RuntimeError, sampling.estimate_orders, cnots(2), counting_noise_models(),
+                          Pauli.Y, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+from fixtures import cnots, counting_noise_models
+from qfault.counting import sweep
+from qfault.qec.error import Pauli
+from qfault.util import cache, concurrency
+import unittest
+
+
+def _build(params):
+    return {'cnots': cnots(params['k'])}, counting_noise_models()
+
+
+class TestSweep(unittest.TestCase):
+
+    def setUp(self):
+        cache.enableFetch(False)
+
+    def tearDown(self):
+        cache.enableFetch(True)
+        cache.enableMemo(True)
+        concurrency.initialize_concurrency(0)
+
+    def _sweep(self):
+        progress = []
+        points = sweep.sweep(_build, sweep.grid(k=[1, 2]), paulis=[Pauli.Y],
+                             progress=lambda done, total: progress.append((done, total)))
+
+        # The CNOTs are identical, so only orders 0, 1 and 2 of a single
+        # component are counted.
+        assert [(1, 3), (2, 3), (3, 3)] == progress
+
+        # The seeded counts are released once the grid points are counted.
+        for point in points:
+            assert all({} == leaf._seeded for leaf in sweep.countable_leaves(point.components['cnots']))
+
+        cache.enableMemo(False)
+        for point in points:
+            components, noiseModels = _build(point.params)
+            expected = components['cnots'].count(noiseModels, Pauli.Y)
+            assert expected.counts == point.results[('cnots', Pauli.Y)].counts
+
+    def testSharedComponents(self):
+        # The named components of the second point are equal to the second
+        # component of the first point, so they are counted once.
+        counted = []
+        def build(params):
+            components = {'a': cnots(params['k']), 'b': cnots(2)}
+            for name, component in components.iteritems():
+                count = component.count
+                def recordingCount(noiseModels, pauli, count=count, k=params['k'], name=name):
+                    counted.append((k, name))
+                    return count(noiseModels, pauli)
+                component.count = recordingCount
+            return components, counting_noise_models()
+
+        concurrency.initialize_concurrency(0)
+        points = sweep.sweep(build, sweep.grid(k=[1, 2]), paulis=[Pauli.Y])
+        assert [(1, 'a'), (1, 'b')] == counted
+        assert points[1].results[('a', Pauli.Y)] is points[0].results[('b', Pauli.Y)]
+
+    def testSerial(self):
+        concurrency.initialize_concurrency(0)
+        self._sweep()
+
+    def testPool(self):
+        concurrency.initialize_concurrency(2)
+        self._sweep()
+
+    def testNested(self):
+        concurrency.initialize_concurrency(2, nested=True)
+        self._sweep()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,125 @@
+from fixtures import cnots, counting_noise_models, sympy_noise_models
+from qfault.circuit import location
+from qfault.counting import probability, truncation
+from qfault.counting.component.base import PostselectionFilter
+from qfault.counting.convolve import convolve_counts, convolve_dict_tuples
+from qfault.counting.count_locations import map_counts
+from qfault.counting.key import IdentityManipulator, KeyManipulator
+from qfault.counting.result import CountResult
+from qfault.counting.truncation import REMAINDER, TopN, WeightFraction
+from qfault.noise import Bound, NoiseModelXZSympy
+from qfault.qec.error import Pauli
+from qfault.util import cache, concurrency
+import cPickle
+import functools
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class TestTruncation(unittest.TestCase):
+
+    counts = [{(0,): 1}, {(i,): i + 1 for i in range(8)}]
+
+    def setUp(self):
+        concurrency.initialize_concurrency(0)
+
+    def testTotalCountPreserved(self):
+        for policy in (TopN(3), WeightFraction(0.3)):
+            truncated = truncation.truncate_counts(self.counts, policy)
+            for countsK, truncatedK in zip(self.counts, truncated):
+                assert sum(countsK.values()) == sum(truncatedK.values())
+                for key, count in truncatedK.iteritems():
+                    assert REMAINDER is key or countsK[key] == count
+
+    def testRemainderIsPickledAsSingleton(self):
+        assert cPickle.loads(cPickle.dumps(REMAINDER, 2)) is REMAINDER
+
+    def testMapCountsPreservesRemainder(self):
+        truncated = truncation.truncate_counts(self.counts, TopN(2))
+        mapped = map_counts(truncated, lambda key: (key[0] % 2,))
+        assert mapped[1] == {(1,): 8, (0,): 7, REMAINDER: 21}
+
+    def testConvolutionIsConservative(self):
+        convolve = functools.partial(convolve_dict_tuples, [3], [3])
+        full = convolve_counts(self.counts, self.counts, convolve_fcn=convolve)
+        truncated = truncation.truncate_counts(self.counts, TopN(3))
+        partial = convolve_counts(truncated, truncated, convolve_fcn=convolve)
+        for fullK, partialK in zip(full, partial):
+            assert sum(fullK.values()) == sum(partialK.values())
+            for key, count in partialK.iteritems():
+                assert REMAINDER is key or count <= fullK[key]
+
+    def testPostselectionKeepsRemainder(self):
+        result = CountResult(self.counts, ('a',)).truncate(TopN(2))
+        filtered = _RejectOdd().count({}, None, result)
+        assert filtered.counts == [{(0,): 1}, {(6,): 7, REMAINDER: 21}]
+
+    def testBoundsOfRemainder(self):
+        locations = location.Locations([location.cnot('A', 0, 'B', 0)])
+        noise = NoiseModelXZSympy()
+        truncated = [{(0,): 1}, {(1,): 5, REMAINDER: 4}]
+        for bound, count in ((Bound.UpperBound, 9), (Bound.LowerBound, 5)):
+            pr = probability.counts_as_poly(truncated, locations, noise, bound, keys=[(1,)])
+            expected = probability.counts_as_poly([{}, {(1,): count}], locations, noise, bound)
+            assert abs(pr(1e-3) - expected(1e-3)) < 1e-15
+
+    def testPrAcceptRejectsRemainder(self):
+        noiseModels = sympy_noise_models()
+        exact = CountResult(self.counts, ('a',))
+        truncated = exact.truncate(TopN(2))
+        prExact = _RejectOdd().prAccept(noiseModels, exact, 1)
+        prTruncated = _RejectOdd().prAccept(noiseModels, truncated, 1)
+
+        # The odd keys (total count 2+4+6+8=20) are rejected.  After truncation,
+        # key 7 (count 8) and the entire bucket (count 21) are counted as rejected.
+        likelihood = noiseModels[Pauli.Y].likelyhood(Bound.UpperBound)
+        assert abs(prExact(1e-3) - prTruncated(1e-3) - 9 * likelihood(1e-3)) < 1e-12
+
+
+class TestTruncatedCache(unittest.TestCase):
+
+    def setUp(self):
+        concurrency.initialize_concurrency(0)
+        cache.enableFetch(True)
+        cache.enableMemo(False)
+
+        # The data directory is relative to the working directory.
+        self._cwd = os.getcwd()
+        self._tmp = tempfile.mkdtemp()
+        os.mkdir(os.path.join(self._tmp, 'work'))
+        os.chdir(os.path.join(self._tmp, 'work'))
+
+    def tearDown(self):
+        os.chdir(self._cwd)
+        shutil.rmtree(self._tmp)
+        cache.enableMemo(True)
+        truncation.set_truncation_policy(None)
+
+    def testExactCountsAreNotFetchedTruncated(self):
+        component = cnots(2, num=1)
+        noiseModels = counting_noise_models()
+
+        truncation.set_truncation_policy(TopN(2))
+        truncated = component.count(noiseModels, Pauli.Y)
+        assert REMAINDER in truncated.counts[1]
+
+        truncation.set_truncation_policy(None)
+        exact = component.count(noiseModels, Pauli.Y)
+        assert all(REMAINDER not in countsK for countsK in exact.counts)
+
+
+class _RejectOdd(PostselectionFilter):
+
+    def keyPropagator(self, subPropagator=IdentityManipulator()):
+        return _OddRejecter(subPropagator)
+
+class _OddRejecter(KeyManipulator):
+
+    def _manipulate(self, key):
+        return None if key[0] % 2 else key
+
+
+if __name__ == "__main__":
+    unittest.main()
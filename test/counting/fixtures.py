@@ -0,0 +1,38 @@
+'''
+Components and noise models shared by the counting tests.
+'''
+from qfault.counting.component.base import SequentialComponent
+from qfault.counting.component.transversal import TransCnot
+from qfault.noise import CountingNoiseModelXZ, NoiseModelXSympy, NoiseModelZSympy, NoiseModelXZSympy
+from qfault.qec.ed422 import ED412Code
+from qfault.qec.error import Pauli
+
+
+def k_good(k):
+    '''
+    Returns a kGood dictionary with the value k for every Pauli.
+    '''
+    return {Pauli.X: k, Pauli.Z: k, Pauli.Y: k}
+
+def cnots(k, num=2, cnot=TransCnot):
+    '''
+    Returns a sequence of num transversal CNOTs on two [[4,1,2]] blocks,
+    with kGood k.  cnot(kGood, code1, code2) constructs each CNOT.
+    '''
+    kGood = k_good(k)
+    code = ED412Code()
+    return SequentialComponent(kGood, [cnot(kGood, code, code) for _ in range(num)])
+
+def counting_noise_models():
+    '''
+    Returns noise models, indexed by Pauli, that count each fault with weight one.
+    '''
+    return {pauli: CountingNoiseModelXZ() for pauli in (Pauli.X, Pauli.Z, Pauli.Y)}
+
+def sympy_noise_models():
+    '''
+    Returns noise models, indexed by Pauli, that support probability bounds.
+    '''
+    return {Pauli.X: NoiseModelXSympy(),
+            Pauli.Z: NoiseModelZSympy(),
+            Pauli.Y: NoiseModelXZSympy()}
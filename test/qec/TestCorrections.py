@@ -0,0 +1,122 @@
+from qfault.counting.key import SyndromeKeyDecoder
+from qfault.qec import qecc, tables
+from qfault.qec.ed422 import ED412Code
+from qfault.qec.error import Pauli, PauliError, xType, zType
+from qfault.util import bits, concurrency
+import numpy
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class _FiveQubitCode(qecc.StabilizerCode):
+    '''
+    The [[5,1,3]] code, which is not a CSS code.
+    '''
+
+    def __init__(self):
+        super(_FiveQubitCode, self).__init__('[[5,1,3]]', 5, 1, 3)
+
+    def stabilizerGenerators(self):
+        return tuple(PauliError.fromstring(s) for s in ('XZZXI', 'IXZZX', 'XIXZZ', 'ZXIXZ'))
+
+    def logicalOperators(self):
+        return ({xType: PauliError.fromstring('XXXXX'), zType: PauliError.fromstring('ZZZZZ')},)
+
+class _SteaneCode(qecc.CssCode):
+
+    def __init__(self):
+        super(_SteaneCode, self).__init__('[[7,1,3]]', 7, 1, 3)
+
+    def stabilizerGenerators(self):
+        checks = ('IIIXXXX', 'IXXIIXX', 'XIXIXIX')
+        return tuple(PauliError.fromstring(s) for s in checks) + \
+               tuple(PauliError.fromstring(s.replace('X', 'Z')) for s in checks)
+
+    def logicalOperators(self):
+        return ({xType: Pauli.X ** 7, zType: Pauli.Z ** 7},)
+
+def _allErrors(n):
+    return [PauliError(n, x, z) for x in range(1 << n) for z in range(1 << n)]
+
+def _oldDecode(code, key):
+    # Decoding by explicit commutation checks, for comparison.
+    normalizers = code.normalizerGenerators()
+    e = code.syndromeCorrection(key >> len(normalizers))
+    commutations = bits.listToBits(not e.commutesWith(check) for check in normalizers)
+    return (key & ((1 << len(normalizers)) - 1)) ^ commutations
+
+
+class TestCorrections(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        tables.setTableDir(self.dir)
+
+    def tearDown(self):
+        tables.setTableDir(os.path.join(os.path.pardir, 'data', 'tables'))
+        concurrency.initialize_concurrency(0)
+        shutil.rmtree(self.dir)
+
+    def assertMinimal(self, code):
+        minWeights = {}
+        for e in _allErrors(code.n):
+            s = code.getSyndrome(e)
+            minWeights[s] = min(minWeights.get(s, code.n), e.weight())
+        table = qecc.minWeightCorrections(code.stabilizerGenerators(), code.n)
+        assert 1 << len(code.stabilizerGenerators()) == len(table)
+        for s, (x, z) in enumerate(table):
+            e = PauliError(code.n, int(x), int(z))
+            assert s == code.getSyndrome(e)
+            assert minWeights[s] == e.weight()
+
+    def testFiveQubitCode(self):
+        self.assertMinimal(_FiveQubitCode())
+
+    def testSteaneCode(self):
+        code = _SteaneCode()
+        table = qecc.minWeightCorrections(code.stabilizerGenerators(), code.n)
+        for s, (x, z) in enumerate(table):
+            assert s == code.getSyndrome(PauliError(7, int(x), int(z)))
+            assert 1 >= bits.weight(int(x)) and 1 >= bits.weight(int(z))
+
+    def testED412(self):
+        assert [(0, 0), (1, 0), (0, 1), (1, 1)] == \
+            [tuple(row) for row in qecc.minWeightCorrections(ED412Code().stabilizerGenerators(), 4)]
+
+        # The gauge corrections differ from the hand-written corrections by
+        # stabilizers.
+        code = ED412Code(gaugeType=xType)
+        table = qecc.minWeightCorrections(code.stabilizerGenerators(), code.n)
+        for s, (x, z) in enumerate(table):
+            e = PauliError(4, int(x), int(z)) * code.syndromeCorrection(s)
+            assert 0 == code.getSyndrome(e)
+            assert all(e.commutesWith(norm) for norm in code.normalizerGenerators())
+
+    def testConcurrent(self):
+        code = _FiveQubitCode()
+        serial = qecc.minWeightCorrections(code.stabilizerGenerators(), code.n)
+        concurrency.initialize_concurrency(2)
+        assert (serial == qecc.minWeightCorrections(code.stabilizerGenerators(), code.n)).all()
+
+    def testSaved(self):
+        table = _FiveQubitCode().correctionTable()
+        assert not table.flags.writeable
+        assert 1 == len(os.listdir(self.dir))
+        tables.clearTables()
+        assert (table == _FiveQubitCode().correctionTable()).all()
+        code = _FiveQubitCode()
+        assert 0b0100 == code.getSyndrome(code.syndromeCorrection(0b0100))
+
+    def testDecoder(self):
+        for code in (_FiveQubitCode(), _SteaneCode(), ED412Code(gaugeType=zType)):
+            decoder = SyndromeKeyDecoder(code)
+            nKeys = 1 << (len(code.stabilizerGenerators()) + len(code.normalizerGenerators()))
+            decoded = [_oldDecode(code, key) for key in range(nKeys)]
+            assert decoded == [decoder.decode(key) for key in range(nKeys)]
+            assert decoded == list(decoder.decodeKeys(numpy.arange(nKeys)))
+
+
+if __name__ == "__main__":
+    unittest.main()
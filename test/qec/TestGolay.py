@@ -0,0 +1,46 @@
+from qfault.circuit import location
+from qfault.qec import golay
+from qfault.qec.error import Pauli
+from qfault.qec.golay import GolayCode
+from qfault.sim import bitsliced
+from qfault.util import cache
+import numpy
+import random
+import unittest
+
+
+class TestGolaySyndrome(unittest.TestCase):
+
+    def testTables(self):
+        rng = random.Random(0)
+        patterns = [0, (1 << 23) - 1] + [1 << i for i in range(23)] + [rng.getrandbits(23) for _ in range(1000)]
+        for e in patterns:
+            assert golay.divideByGenerator(e) == GolayCode.getSyndrome(e)
+
+    def testBatch(self):
+        patterns = numpy.random.RandomState(0).randint(0, 1 << 23, 1000)
+        syndromes = GolayCode.getSyndromes(patterns)
+        assert [GolayCode.getSyndrome(int(e)) for e in patterns] == list(syndromes)
+
+    def testFrameErrors(self):
+        # The errors of a bit-sliced frame are unsigned.
+        locations = location.Locations([location.prep(Pauli.Z, 'A', bit) for bit in range(23)])
+        rates = bitsliced.error_rates(0.5)
+        errors = bitsliced.simulate(locations, rates, 100, numpy.random.RandomState(1)).errors()['X']['A']
+        assert [GolayCode.getSyndrome(int(e)) for e in errors] == list(GolayCode.getSyndromes(errors))
+
+    def testMinErrors(self):
+        cache.enableFetch(False)
+        try:
+            mins = golay.calcMinErrors()
+        finally:
+            cache.enableFetch(True)
+        assert 3189 == mins[0][1]
+        assert 0 == mins[0][0]
+        for e in (1, 0b11 << 5, 0b10101 << 10):
+            syndrome = GolayCode.getSyndrome(e)
+            assert e == mins[syndrome][bin(e).count('1') & 1]
+
+
+if __name__ == "__main__":
+    unittest.main()
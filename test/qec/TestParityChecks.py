@@ -0,0 +1,51 @@
+from qfault.counting.key import SyndromeKeyGenerator
+from qfault.qec.ed422 import ED412Code
+from qfault.qec.error import Pauli, PauliError, xType, zType
+from qfault.qec.qecc import ParityCheckMatrix, StabilizerCode
+import numpy
+import random
+import unittest
+
+
+def _errors(n, count, seed=0):
+    rng = random.Random(seed)
+    return [PauliError(n, rng.getrandbits(n), rng.getrandbits(n)) for _ in range(count)]
+
+
+class TestParityCheckMatrix(unittest.TestCase):
+
+    def testMatchesCommutation(self):
+        generators = _errors(16, 12, seed=4)
+        checks = ParityCheckMatrix(generators)
+        assert len(generators) == len(checks)
+        for e in _errors(16, 200):
+            assert StabilizerCode.Syndrome(e, generators) == checks.syndrome(e)
+
+    def testBatch(self):
+        code = ED412Code(gaugeType=xType)
+        checks = ParityCheckMatrix(code.stabilizerGenerators() + code.normalizerGenerators())
+        errors = _errors(4, 100, seed=1)
+        syndromes = checks.syndromes([e.ebits[xType] for e in errors], [e.ebits[zType] for e in errors])
+        assert [checks.syndrome(e) for e in errors] == list(syndromes)
+
+    def testWideBatch(self):
+        checks = ParityCheckMatrix([PauliError(64, 1 << 63, 0)])
+        assert 1 == checks.syndrome(PauliError(64, 0, 1 << 63))
+        self.assertRaises(ValueError, checks.syndromes, [0], [0])
+
+    def testGetSyndrome(self):
+        code = ED412Code()
+        for e in _errors(4, 50, seed=2):
+            assert StabilizerCode.Syndrome(e, code.stabilizerGenerators()) == code.getSyndrome(e)
+
+    def testKeyGenerator(self):
+        generator = SyndromeKeyGenerator(ED412Code(gaugeType=xType))
+        errors = _errors(4, 50, seed=3)
+        keys = generator.get_keys(numpy.array([e.ebits[xType] for e in errors]),
+                                  numpy.array([e.ebits[zType] for e in errors]))
+        assert [generator(e) for e in errors] == list(keys)
+        assert generator(Pauli.I ** 4) == 0
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,65 @@
+from qfault.qec import tables
+from qfault.qec.golay import GolayCode, GolayZero
+from qfault.qec.error import Pauli
+from qfault.util import cache
+import numpy
+import os
+import shutil
+import tempfile
+import unittest
+
+
+class _Build(object):
+
+    def __init__(self):
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return numpy.arange(10)
+
+
+class TestTables(unittest.TestCase):
+
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        tables.setTableDir(self.dir)
+
+    def tearDown(self):
+        tables.setTableDir(os.path.join(os.path.pardir, 'data', 'tables'))
+        cache.enableFetch(True)
+        shutil.rmtree(self.dir)
+
+    def testBuiltOnce(self):
+        build = _Build()
+        table = tables.decoderTable('test', build)
+        assert table is tables.decoderTable('test', build)
+        assert os.path.exists(os.path.join(self.dir, 'test.npy'))
+
+        # Another process maps the saved table.
+        tables.clearTables()
+        mapped = tables.decoderTable('test', build)
+        assert isinstance(mapped, numpy.memmap)
+        assert not mapped.flags.writeable
+        assert range(10) == list(mapped)
+        assert 1 == build.calls
+
+    def testFetchDisabled(self):
+        cache.enableFetch(False)
+        build = _Build()
+        table = tables.decoderTable('test', build)
+        assert not table.flags.writeable
+        assert not os.listdir(self.dir)
+        assert table is tables.decoderTable('test', build)
+        assert 1 == build.calls
+
+    def testGolayShared(self):
+        zero = GolayZero()
+        assert zero.corrections is GolayCode().corrections
+        assert list(zero.corrections) == GolayCode.generateCorrectionsTable()
+        e = 0b101 << 7
+        assert e == GolayCode().getCorrection(e, Pauli.X)
+
+
+if __name__ == "__main__":
+    unittest.main()
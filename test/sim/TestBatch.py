@@ -0,0 +1,84 @@
+from qfault.circuit import location
+from qfault.qec.error import Pauli
+from qfault.sim import batch, bitsliced
+from qfault.util import concurrency, stats
+import functools
+import unittest
+
+
+def _tally(rng, shots):
+    heads = sum(rng.random() < 0.5 for _ in xrange(shots))
+    return [heads, shots - heads], {'shots': shots}
+
+def _coin(p, rng, shots):
+    return stats.RunningStats.fromCounts(sum(rng.random() < p for _ in xrange(shots)), shots)
+
+def _failures(locations, errorRates, rng, shots):
+    return int(bitsliced.simulate(locations, errorRates, shots, rng).nontrivial().sum())
+
+
+class TestBatch(unittest.TestCase):
+
+    def tearDown(self):
+        concurrency.initialize_concurrency(0)
+
+    def testTallies(self):
+        result = batch.sample_batches(_tally, 1050, seed=3, batch_size=100)
+        assert 1050 == sum(result[0])
+        assert {'shots': 1050} == result[1]
+
+    def testIndependentOfWorkers(self):
+        concurrency.initialize_concurrency(0)
+        serial = batch.sample_batches(_tally, 5000, seed=3, batch_size=700)
+        concurrency.initialize_concurrency(2)
+        assert serial == batch.sample_batches(_tally, 5000, seed=3, batch_size=700)
+        assert serial != batch.sample_batches(_tally, 5000, seed=4, batch_size=700)
+
+    def testStreamsDiffer(self):
+        draws = [batch.batch_rng(3, index).random() for index in range(2)]
+        assert draws[0] != draws[1]
+        assert draws[0] == batch.batch_rng(3, 0).random()
+        assert batch.batch_rng(3, 0, use_numpy=True).randint(1 << 30) != \
+            batch.batch_rng(3, 1, use_numpy=True).randint(1 << 30)
+
+    def testNumpyStreams(self):
+        locations = location.Locations([location.prep(Pauli.Z, 'A', 0), location.rest('A', 0)])
+        sampler = functools.partial(_failures, locations, bitsliced.error_rates(0.1))
+        concurrency.initialize_concurrency(2)
+        failures = batch.sample_batches(sampler, 20000, seed=5, batch_size=3000, use_numpy=True)
+        assert failures == batch.sample_batches(sampler, 20000, seed=5, batch_size=3000, use_numpy=True)
+        # Roughly 4p/15 + 12p/15 * (1 - 4p/15) of the shots fail.
+        assert abs(failures / 20000. - 0.1045) < 0.01
+
+    def testSampleUntil(self):
+        stop = stats.NarrowInterval(0.1, relative=True)
+        result = batch.sample_until(functools.partial(_coin, 0.1), stop, seed=2, batch_size=100,
+                                    round_batches=4)
+        # The interval narrows to 10% after about 3500 shots.
+        assert stop(result)
+        assert 0 == result.n % 400
+        assert result.n < 10000
+        assert not stop(batch.sample_until(functools.partial(_coin, 0.1), stop, seed=2, max_shots=1050,
+                                           batch_size=100, round_batches=4))
+
+    def testSampleUntilRepeatable(self):
+        stop = stats.NarrowInterval(0.2, relative=True)
+        concurrency.initialize_concurrency(0)
+        serial = batch.sample_until(functools.partial(_coin, 0.05), stop, seed=3, batch_size=50)
+        concurrency.initialize_concurrency(2)
+        parallel = batch.sample_until(functools.partial(_coin, 0.05), stop, seed=3, batch_size=50)
+        # The partial statistics are merged in a different order.
+        assert serial.n == parallel.n
+        self.assertAlmostEqual(serial.mean, parallel.mean)
+
+    def testMaxShots(self):
+        result = batch.sample_until(functools.partial(_coin, 0.5), lambda total: False, seed=1,
+                                    max_shots=1050, batch_size=100, round_batches=4)
+        assert 1050 == result.n
+
+    def testNoShots(self):
+        assert None == batch.sample_batches(_tally, 0, seed=1)
+
+
+if __name__ == "__main__":
+    unittest.main()
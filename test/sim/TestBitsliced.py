@@ -0,0 +1,71 @@
+from fixtures import serial_frequencies, two_block_locations
+from qfault.circuit import location
+from qfault.qec.error import Pauli
+from qfault.sim import bitsliced
+import collections
+import numpy
+import random
+import unittest
+
+
+class TestBitsliced(unittest.TestCase):
+
+    def testPropagation(self):
+        rates = bitsliced.error_rates(0)
+        rates.prepZ = rates.prepX = 1
+        frame = bitsliced.simulate(two_block_locations(), rates, 130)
+        errors = frame.errors()
+        # The X error from the preparation of A0 propagates to B0.
+        assert [0b01] == list(set(errors['X']['A']))
+        assert [0b1] == list(set(errors['X']['B']))
+        assert [0b10] == list(set(errors['Z']['A']))
+        assert [0] == list(set(errors['Z']['B']))
+        assert 130 == len(errors['X']['A'])
+        assert frame.nontrivial().all()
+
+    def testNoFailures(self):
+        frame = bitsliced.simulate(two_block_locations(), bitsliced.error_rates(0), 100)
+        assert not frame.nontrivial().any()
+
+    def testAlwaysFails(self):
+        # Every shot fails at every location, with uniformly chosen Paulis.
+        rates = bitsliced.error_rates(1)
+        rates.cnot = rates.rest = 1
+        frame = bitsliced.simulate(location.Locations([location.rest('A', 0)]), rates, 30000,
+                                   numpy.random.RandomState(0))
+        errors = frame.errors()
+        paulis = collections.Counter(zip(errors['X']['A'], errors['Z']['A']))
+        assert 3 == len(paulis)
+        assert all(abs(n - 10000) < 500 for n in paulis.values())
+
+    def testMatchesSerial(self):
+        locations = two_block_locations()
+        rates = bitsliced.error_rates(0.1)
+        shots = 20000
+
+        random.seed(0)
+        serial = serial_frequencies(locations, rates, shots)
+
+        errors = bitsliced.simulate(locations, rates, shots, numpy.random.RandomState(0)).errors()
+        sliced = collections.Counter(zip(*[errors[e][b] for e in 'XZ' for b in 'AB']))
+
+        for key in set(serial) | set(sliced):
+            p = (serial[key] + sliced[key]) / (2. * shots)
+            sigma = (2 * p * (1 - p) / shots) ** .5
+            assert abs(serial[key] - sliced[key]) / float(shots) < 5 * sigma + 1e-3, key
+
+    def testContinueFrame(self):
+        locations = location.Locations([location.prep(Pauli.Z, 'A', 0)])
+        rates = bitsliced.error_rates(0)
+        rates.prepZ = 1
+        frame = bitsliced.simulate(locations, rates, 10)
+        frame = bitsliced.simulate(locations, rates, 10, frame=frame)
+        assert not frame.nontrivial().any()
+
+    def testUnsupportedLocation(self):
+        locations = location.Locations([{'type': 'hadamard', 'block1': 'A', 'bit1': 0}])
+        self.assertRaises(ValueError, bitsliced.simulate, locations, bitsliced.error_rates(0.1), 10)
+
+
+if __name__ == "__main__":
+    unittest.main()
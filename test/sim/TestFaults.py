@@ -0,0 +1,78 @@
+from fixtures import serial_frequencies, two_block_locations
+from qfault.qec.error import Pauli, xType, zType
+from qfault.sim import bitsliced
+from qfault.sim.faults import FaultSampler
+import collections
+import random
+import unittest
+
+
+def _reversed_bits(bits, length):
+    # Counting keys hold qubit 0 in the most significant bit, sim_utils in the least.
+    return sum(((bits >> (length - 1 - i)) & 1) << i for i in range(length))
+
+
+class _CountingRandom(random.Random):
+
+    def random(self):
+        self.calls = getattr(self, 'calls', 0) + 1
+        return random.Random.random(self)
+
+
+class TestFaults(unittest.TestCase):
+
+    def testNoFaults(self):
+        sampler = FaultSampler(two_block_locations(), bitsliced.error_rates(0), block_order=['A', 'B'])
+        assert {} == sampler.faults(1000)
+        assert {(Pauli.I ** 2, Pauli.I): 1000} == sampler.sample_counts(1000)
+
+    def testMatchesSerial(self):
+        locations = two_block_locations()
+        rates = bitsliced.error_rates(0.1)
+        shots = 20000
+
+        random.seed(0)
+        serial = collections.Counter()
+        for (xa, xb, za, zb), n in serial_frequencies(locations, rates, shots).iteritems():
+            # As for counting, measurements discard the errors that they do not detect.
+            serial[(xa & 0b01, xb, za, zb & 0b0)] += n
+
+        sampler = FaultSampler(locations, rates, block_order=['A', 'B'], rng=random.Random(0))
+        sampled = collections.Counter()
+        for (a, b), n in sampler.sample_counts(shots).iteritems():
+            key = tuple(_reversed_bits(e.ebits[t], len(e)) for t in (xType, zType) for e in (a, b))
+            sampled[key] += n
+        assert shots == sum(sampled.values())
+
+        for key in set(serial) | set(sampled):
+            p = (serial[key] + sampled[key]) / (2. * shots)
+            sigma = (2 * p * (1 - p) / shots) ** .5
+            assert abs(serial[key] - sampled[key]) / float(shots) < 5 * sigma + 1e-3, key
+
+    def testCostScalesWithFaults(self):
+        rng = _CountingRandom(1)
+        sampler = FaultSampler(two_block_locations(), bitsliced.error_rates(1e-4), rng=rng)
+        faulty = sampler.faults(100000)
+        nfaults = sum(len(faults) for faults in faulty.itervalues())
+        assert 0 < nfaults < 100
+        # One draw for the position and one for the error of each fault, and
+        # one draw past the end of each of the three groups of locations.
+        assert 2 * nfaults + 3 == rng.calls
+
+    def testRepeatable(self):
+        rates = bitsliced.error_rates(0.01)
+        counts = [FaultSampler(two_block_locations(), rates, rng=random.Random(5)).sample_counts(1000)
+                  for _ in range(2)]
+        assert counts[0] == counts[1]
+
+    def testBlockErrorMaps(self):
+        rates = bitsliced.error_rates(0)
+        rates.prepZ = 1
+        sampler = FaultSampler(two_block_locations(), rates, block_order=['B', 'A'],
+                               block_error_maps=[len, lambda e: e.ebits[xType]])
+        # The X error on A0 (the most significant bit) propagates to B0.
+        assert (1, 0b10) == sampler.sample()
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,70 @@
+from qfault.circuit import location
+from qfault.qec.error import Pauli
+from qfault.qec.golay import GolayCode
+from qfault.sim import bitsliced, verify
+from qfault.util import bits
+import numpy
+import random
+import unittest
+
+
+def _repetition():
+    # Two three-qubit |000> ancillas, with the X errors of A checked by B.
+    locs = [location.prep(Pauli.Z, block, bit) for block in 'AB' for bit in range(3)]
+    for bit in range(3):
+        locs += [location.cnot('A', bit, 'B', bit), location.meas(Pauli.Z, 'B', bit)]
+    return location.Locations(locs)
+
+_checks = [0b011, 0b110]
+
+
+class TestVerify(unittest.TestCase):
+
+    def testParityChecks(self):
+        checks = verify.parity_checks(GolayCode.getSyndrome, 23)
+        assert 11 == len(checks)
+        rng = random.Random(0)
+        for _ in range(100):
+            e = rng.getrandbits(23)
+            syndrome = sum(bits.parity(e & check) << j for j, check in enumerate(checks))
+            assert GolayCode.getSyndrome(e) == syndrome
+
+    def testNoFaults(self):
+        samples = verify.sample_verified(_repetition(), bitsliced.error_rates(0), [('B', 'X', _checks)], 100)
+        assert 100 == len(samples)
+        assert (1 == samples.attempts).all()
+        assert not samples.errors['X']['A'].any()
+
+    def testAccepted(self):
+        rates = bitsliced.error_rates(0.05)
+        samples = verify.sample_verified(_repetition(), rates, [('B', 'X', _checks)], 5000,
+                                         batch_size=1000, rng=numpy.random.RandomState(0))
+        assert 5000 == len(samples.errors['X']['B'])
+        syndromes = [samples.errors['X']['B'] & numpy.uint64(check) for check in _checks]
+        assert all(bits.parity(int(s)) == 0 for syndrome in syndromes for s in syndrome)
+        assert samples.acceptance() < 1
+
+    def testAcceptanceRate(self):
+        # A preparation and a measurement, which are rejected if exactly one fails.
+        locations = location.Locations([location.prep(Pauli.Z, 'A', 0), location.meas(Pauli.Z, 'A', 0)])
+        rates = bitsliced.error_rates(0.3)
+        q = rates.prepZ
+        expected = 1 - 2 * q * (1 - q)
+        # Small batches, so that the attempts of many ancillas span batches.
+        samples = verify.sample_verified(locations, rates, [('A', 'X', [1])], 20000, batch_size=7,
+                                         rng=numpy.random.RandomState(1))
+        assert 20000 == len(samples)
+        assert abs(samples.acceptance() - expected) < 0.01
+        assert abs(samples.attempts.mean() - 1 / expected) < 0.02
+
+    def testRepeatable(self):
+        rates = bitsliced.error_rates(0.05)
+        samples = [verify.sample_verified(_repetition(), rates, [('B', 'X', _checks)], 500,
+                                          batch_size=100, rng=numpy.random.RandomState(2))
+                   for _ in range(2)]
+        assert (samples[0].attempts == samples[1].attempts).all()
+        assert (samples[0].errors['Z']['A'] == samples[1].errors['Z']['A']).all()
+
+
+if __name__ == "__main__":
+    unittest.main()
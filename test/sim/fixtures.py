@@ -0,0 +1,38 @@
+'''
+Circuits and reference simulations shared by the simulation tests.
+'''
+from qfault.circuit import location
+from qfault.qec.error import Pauli
+from qfault.sim import sim_utils
+import collections
+
+
+def two_block_locations():
+    '''
+    Returns a small two-block circuit with every kind of location.
+    '''
+    return location.Locations([location.prep(Pauli.Z, 'A', 0),
+                               location.prep(Pauli.X, 'A', 1),
+                               location.cnot('A', 1, 'A', 0),
+                               location.rest('B', 0),
+                               location.cnot('A', 0, 'B', 0),
+                               location.meas(Pauli.Z, 'B', 0),
+                               location.meas(Pauli.X, 'A', 1)])
+
+def serial_frequencies(locations, rates, shots):
+    '''
+    Simulates the locations one shot at a time with sim_utils and returns
+    the frequency of each (XA, XB, ZA, ZB) error tuple.
+    '''
+    functions = {'prepX': sim_utils.prepX, 'prepZ': sim_utils.prepZ, 'rest': sim_utils.rest,
+                 'measX': sim_utils.measX, 'measZ': sim_utils.measZ}
+    frequencies = collections.Counter()
+    for _ in xrange(shots):
+        errors = {'X': collections.defaultdict(int), 'Z': collections.defaultdict(int)}
+        for loc in locations:
+            if 'cnot' == loc['type']:
+                sim_utils.cnot(rates, errors, loc['block1'], loc['bit1'], loc['block2'], loc['bit2'])
+            else:
+                functions[loc['type']](rates, errors, loc['block1'], loc['bit1'])
+        frequencies[tuple(errors[e][b] for e in 'XZ' for b in 'AB')] += 1
+    return frequencies
@@ -0,0 +1,80 @@
+from qfault.util import benchmark, cache
+from qfault.util.benchmark import Benchmark
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+@cache.memoize
+def _square(x):
+    return x * x
+
+
+class TestBenchmark(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def testRun(self):
+        setups = []
+        benchmarks = [Benchmark('a.fast', lambda: setups.append('fast') or (lambda: None), work=10),
+                      Benchmark('a.once', lambda: setups.append('once') or (lambda: None), repeat=1),
+                      Benchmark('b.slow', lambda: setups.append('slow') or (lambda: None), slow=True)]
+        results = benchmark.run(benchmarks, repeat=2, pattern='^a')
+        assert ['a.fast', 'a.once'] == sorted(results['benchmarks'])
+        assert ['fast', 'fast', 'once'] == setups
+
+        result = results['benchmarks']['a.fast']
+        assert 2 == len(result['times'])
+        assert result['best'] == min(result['times'])
+        assert None == results['benchmarks']['a.once']['rate']
+
+        results = benchmark.run(benchmarks, repeat=1, slow=True)
+        assert ['a.fast', 'a.once', 'b.slow'] == sorted(results['benchmarks'])
+
+    def testMemosAreCleared(self):
+        calls = []
+        def setup():
+            calls.append(_square.hasMemo(_square.get_key((3,), {})))
+            return lambda: _square(3)
+        benchmark.run([Benchmark('memo', setup)], repeat=2)
+        assert [False, False] == calls
+
+    def testCompare(self):
+        def results(**best):
+            return {'benchmarks': dict((name, {'best': t}) for name, t in best.iteritems())}
+
+        baseline = results(count=1., convolve=1., missing=1.)
+        compared = benchmark.compare(results(count=1.1, convolve=1.3, added=5.), baseline)
+        assert ['convolve', 'count'] == [c['name'] for c in compared]
+        assert [True, False] == [c['regressed'] for c in compared]
+
+        compared = benchmark.compare(results(count=1.1, convolve=1.3), baseline, threshold=0.05,
+                                     thresholds={'conv*': 0.5})
+        assert [False, True] == [c['regressed'] for c in compared]
+        assert [0.5, 0.05] == [c['threshold'] for c in compared]
+
+    def testMain(self):
+        delay = [0.]
+        def setup():
+            return lambda: time.sleep(delay[0])
+        benchmarks = [Benchmark('sleep', setup, repeat=1)]
+
+        filename = os.path.join(self.tmpdir, 'baseline.json')
+        assert 0 == benchmark.main(benchmarks, ['-o', filename])
+        baseline = benchmark.read_json(filename)
+        baseline['benchmarks']['sleep']['best'] = 0.01
+        benchmark.write_json(baseline, filename)
+
+        delay[0] = 0.02
+        assert 1 == benchmark.main(benchmarks, ['-b', filename])
+        assert 0 == benchmark.main(benchmarks, ['-b', filename, '-t', 's*=10'])
+
+
+if __name__ == "__main__":
+    unittest.main()
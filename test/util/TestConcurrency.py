@@ -0,0 +1,128 @@
+from qfault.circuit import location
+from qfault.counting import aggregate, count_locations
+from qfault.counting.component.base import ParallelComponent
+from qfault.counting.count_locations import count_errors_of_order_k
+from qfault.noise import CountingNoiseModelXZ
+from qfault.qec.error import Pauli
+from qfault.util import concurrency
+import cPickle
+import numpy
+import os
+import unittest
+
+
+def _is_memmap(handle):
+    return isinstance(concurrency.broadcast_value(handle), numpy.memmap)
+
+def _sum(handle):
+    return sum(concurrency.broadcast_value(handle))
+
+def _packed_items(handle):
+    [table] = concurrency.broadcast_value(handle)
+    return isinstance(table._keys, numpy.memmap), sorted(table.iteritems())
+
+
+class TestBroadcast(unittest.TestCase):
+
+    def setUp(self):
+        concurrency.initialize_concurrency(2)
+
+    def tearDown(self):
+        concurrency.initialize_concurrency(0)
+
+    def testHandleIsSmall(self):
+        value = range(100000)
+        with concurrency.broadcast(value) as handle:
+            assert len(cPickle.dumps(handle, 2)) < 200
+            pool = concurrency._get_pool()
+            assert [sum(value)] * 4 == pool.map(_sum, [handle] * 4)
+
+    def testArraysAreMemoryMapped(self):
+        with concurrency.broadcast(numpy.arange(100000)) as handle:
+            assert concurrency._get_pool().apply(_is_memmap, (handle,))
+
+    def testCountsArePacked(self):
+        counts = {(i, i % 7): i for i in range(10000)}
+        with concurrency.broadcast([counts], share=lambda value: map(aggregate.pack, value)) as handle:
+            assert [counts] == concurrency.broadcast_value(handle)
+            assert (True, sorted(counts.iteritems())) == concurrency._get_pool().apply(_packed_items, (handle,))
+
+    def testSmallValueIsSentWithTasks(self):
+        with concurrency.broadcast([1, 2]) as handle:
+            assert None == handle._path
+            assert [3] == concurrency._get_pool().map(_sum, [handle])
+
+    def testReleaseDeletesFile(self):
+        handle = concurrency.broadcast(range(100000))
+        path = handle._path
+        assert os.path.exists(path)
+        handle.release()
+        assert not os.path.exists(path)
+
+    def testSerialIsNotShared(self):
+        concurrency.initialize_concurrency(0)
+        with concurrency.broadcast([1]) as handle:
+            assert None == handle._path
+            assert [1] == concurrency.broadcast_value(handle)
+
+    def testCountsMatchSerial(self):
+        locations = location.Locations([location.prep(Pauli.Z, 'A', 0),
+                                        location.cnot('A', 0, 'B', 0),
+                                        location.rest('A', 0),
+                                        location.meas(Pauli.X, 'B', 0)])
+        noise = CountingNoiseModelXZ()
+        concurrent = count_errors_of_order_k(2, locations, noise)
+        concurrency.initialize_concurrency(0)
+        assert count_errors_of_order_k(2, locations, noise) == concurrent
+
+
+def _offset_filter(offset, modulus):
+    def accept(key):
+        return 0 == (key[0] + offset) % modulus
+    return lambda key: accept(key) and key or None
+
+def _self_reference():
+    if False:
+        later = None
+    def f():
+        return later
+    return f
+
+
+class TestClosures(unittest.TestCase):
+
+    def setUp(self):
+        concurrency.initialize_concurrency(2)
+
+    def tearDown(self):
+        concurrency.initialize_concurrency(0)
+        count_locations.CONCURRENT_MAP_MIN = 50000
+
+    def testClosureRunsInWorker(self):
+        keymap = _offset_filter(1, 3)
+        keys = [(i,) for i in range(9)]
+        assert map(keymap, keys) == concurrency._get_pool().map(concurrency.ByValue(keymap), keys)
+
+    def testOnlyWrappedFunctionsArePickledByValue(self):
+        self.assertRaises(cPickle.PicklingError, cPickle.dumps, _offset_filter(1, 3), 2)
+
+    def testEmptyCell(self):
+        f = cPickle.loads(cPickle.dumps(concurrency.ByValue(_self_reference()), 2))
+        self.assertRaises(NameError, f)
+
+    def testNestedClass(self):
+        rotator = ParallelComponent.TupleRotator(1)
+        copied = cPickle.loads(cPickle.dumps(rotator, 2))
+        assert type(rotator) is type(copied)
+        assert (2, 3, 1) == copied((1, 2, 3))
+
+    def testMapCountsConcurrently(self):
+        counts = [{(i, i % 5): i for i in range(100)}, {(1, 2): 3}]
+        keymap = _offset_filter(1, 3)
+        serial = count_locations.map_counts(counts, keymap, drop_rejected=True)
+        count_locations.CONCURRENT_MAP_MIN = 10
+        assert serial == count_locations.map_counts(counts, keymap, drop_rejected=True)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,100 @@
+from qfault.circuit import location
+from qfault.counting.count_locations import count_errors_of_order_k
+from qfault.noise import CountingNoiseModelXZ
+from qfault.qec.error import Pauli
+from qfault.util import concurrency, distributed
+import functools
+import operator
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+
+def _fail(arg):
+    raise ValueError(arg)
+
+class _LoseOnce(object):
+    '''
+    Kills the worker that first runs the task for the given argument.
+    '''
+
+    def __init__(self, marker, lost):
+        self.marker = marker
+        self.lost = lost
+
+    def __call__(self, arg):
+        if arg == self.lost and not os.path.exists(self.marker):
+            open(self.marker, 'w').close()
+            os._exit(1)
+        return -arg
+
+
+def _nested_sum(n):
+    negate = functools.partial(operator.mul, -1)
+    return concurrency.mapreduce_concurrent(negate, sum, range(n))
+
+def _nested_pids(n):
+    return set(concurrency.map_concurrent(_pid, range(n)))
+
+def _pid(_):
+    time.sleep(0.01)
+    return os.getpid()
+
+
+class TestLocalCluster(unittest.TestCase):
+
+    def tearDown(self):
+        concurrency.initialize_concurrency(0)
+
+    def testMapReduce(self):
+        negate = functools.partial(operator.mul, -1)
+        with distributed.LocalCluster(2):
+            assert range(0, -20, -1) == list(concurrency.map_concurrent(negate, range(20)))
+            assert -190 == concurrency.mapreduce_concurrent(negate, sum, range(20))
+            assert [(0, 2), (1, 1)] == sorted(concurrency.map_unordered(abs, [-2, 1]))
+
+    def testCountsMatchSerial(self):
+        locations = location.Locations([location.prep(Pauli.Z, 'A', 0),
+                                        location.cnot('A', 0, 'B', 0),
+                                        location.rest('A', 0),
+                                        location.meas(Pauli.X, 'B', 0)])
+        noise = CountingNoiseModelXZ()
+        expected = count_errors_of_order_k(2, locations, noise)
+        with distributed.LocalCluster(2):
+            assert expected == count_errors_of_order_k(2, locations, noise)
+
+    def testNestedCalls(self):
+        # Every worker waits on subtasks, which must be run by the waiting
+        # workers themselves.
+        with distributed.LocalCluster(2, slots=4) as cluster:
+            sums = cluster.coordinator.map(_nested_sum, range(10, 18))
+            assert [-n * (n - 1) / 2 for n in range(10, 18)] == sums
+
+    def testNestedCallsAreConcurrent(self):
+        concurrency.initialize_concurrency(2, nested=True)
+        pids = concurrency._get_pool().apply(_nested_pids, (100,))
+        # The idle worker takes subtasks of the busy one.
+        assert 2 == len(pids)
+        assert os.getpid() not in pids
+
+    def testRemoteError(self):
+        with distributed.LocalCluster(1) as cluster:
+            self.assertRaises(distributed.RemoteError, cluster.coordinator.map, _fail, [1])
+            # The worker survives the failed task.
+            assert [3] == cluster.coordinator.map(abs, [-3])
+
+    def testLostTaskIsRetried(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            task = _LoseOnce(os.path.join(tmpdir, 'lost'), 3)
+            with distributed.LocalCluster(2, task_timeout=2) as cluster:
+                assert [-i for i in range(6)] == cluster.coordinator.map(task, range(6))
+                assert 1 == sum(process.is_alive() for process in cluster.processes())
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    unittest.main()
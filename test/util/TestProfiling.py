@@ -0,0 +1,97 @@
+from qfault.counting.component.base import SequentialComponent
+from qfault.counting.component.transversal import TransCnot
+from qfault.noise import CountingNoiseModelXZ
+from qfault.qec.ed422 import ED412Code
+from qfault.qec.error import Pauli
+from qfault.util import cache, profiling
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+
+def _find(node, prefix):
+    return [child for child in node['children'] if child['name'].startswith(prefix)]
+
+
+class TestProfiling(unittest.TestCase):
+
+    def setUp(self):
+        cache.enableFetch(False)
+        profiling.reset()
+        profiling.enable()
+
+    def tearDown(self):
+        profiling.enable(False)
+        profiling.reset()
+        cache.enableFetch(True)
+
+    def _count(self):
+        kGood = {Pauli.X: 2, Pauli.Z: 2, Pauli.Y: 2}
+        code = ED412Code()
+        cnots = SequentialComponent(kGood, [TransCnot(kGood, code, code), TransCnot(kGood, code, code)])
+        noiseModels = {pauli: CountingNoiseModelXZ() for pauli in (Pauli.X, Pauli.Z, Pauli.Y)}
+        return cnots.count(noiseModels, Pauli.Y)
+
+    def testComponentTree(self):
+        result = self._count()
+        tree = profiling.report()
+        [sequential] = _find(tree, 'SequentialComponent')
+        [cnot] = _find(sequential, 'TransCnot')
+
+        # The CNOTs are identical, so they share a node.
+        assert 2 == cnot['calls']
+        assert sequential['wall'] >= cnot['wall']
+        assert sequential['rss_growth_kb'] >= 0 and cnot['rss_growth_kb'] >= 0
+
+        entries = sum(len(countsK) for countsK in result.counts)
+        assert entries == sequential['metrics']['output_entries']
+
+        # Each CNOT has four locations, so 4 + 6 subsets of orders 1 and 2.
+        assert 2 * (4 + 6) == cnot['metrics']['k_subsets']
+        assert 2 == cnot['metrics']['convolutions']
+        assert 0 < cnot['metrics']['convolution_products']
+
+    def testRssGrowth(self):
+        with profiling.section('outer'):
+            with profiling.section('allocate'):
+                table = bytearray(64 << 20)
+                table[::4096] = 'x' * len(table[::4096])
+            del table
+        [outer] = profiling.report()['children']
+        [allocate] = outer['children']
+        assert allocate['rss_growth_kb'] >= 32 << 10
+        if os.path.exists('/proc/self/statm'):
+            # The table is freed before the outer section ends.
+            assert outer['rss_growth_kb'] < allocate['rss_growth_kb']
+
+    def testDisabled(self):
+        profiling.enable(False)
+        self._count()
+        profiling.record('entries')
+        assert [] == profiling.report()['children']
+
+    def testReports(self):
+        with profiling.section('outer'):
+            with profiling.section('inner'):
+                profiling.record('entries', 3)
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'profile.json')
+            profiling.write_json(filename)
+            with open(filename) as f:
+                assert profiling.report() == json.load(f)
+
+            filename = os.path.join(tmpdir, 'profile.folded')
+            profiling.write_folded(filename)
+            with open(filename) as f:
+                stacks = [line.split()[0] for line in f]
+            assert ['outer', 'outer;inner'] == stacks
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,42 @@
+from qfault.util import stats
+import random
+import unittest
+
+
+class TestRunningStats(unittest.TestCase):
+
+    def testMatchesGetStats(self):
+        rng = random.Random(0)
+        sample = [rng.gauss(3, 2) for _ in range(1000)]
+        running = stats.RunningStats(sample)
+        for expected, actual in zip(stats.getStats(sample), running.getStats()):
+            self.assertAlmostEqual(expected, actual)
+
+    def testMerge(self):
+        rng = random.Random(1)
+        sample = [rng.random() for _ in range(300)]
+        parts = [stats.RunningStats(sample[i:i + 70]) for i in range(0, 300, 70)]
+        merged = sum(parts, stats.RunningStats())
+        assert 300 == merged.n
+        self.assertAlmostEqual(stats.mean(sample), merged.mean)
+        self.assertAlmostEqual(stats.std(sample), merged.std())
+
+    def testFromCounts(self):
+        counts = stats.RunningStats.fromCounts(7, 40)
+        values = stats.RunningStats([1] * 7 + [0] * 33)
+        self.assertAlmostEqual(values.mean, counts.mean)
+        self.assertAlmostEqual(values.std(), counts.std())
+        assert 0 == stats.RunningStats.fromCounts(0, 0).mean
+
+    def testNarrowInterval(self):
+        stop = stats.NarrowInterval(0.01, minSamples=10)
+        assert not stop(stats.RunningStats.fromCounts(3, 5))
+        assert not stop(stats.RunningStats.fromCounts(50, 100))
+        assert stop(stats.RunningStats.fromCounts(5000, 100000))
+        relative = stats.NarrowInterval(0.2, relative=True)
+        assert not relative(stats.RunningStats.fromCounts(0, 10 ** 6))
+        assert relative(stats.RunningStats.fromCounts(100, 10 ** 6))
+
+
+if __name__ == "__main__":
+    unittest.main()
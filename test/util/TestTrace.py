@@ -0,0 +1,79 @@
+from qfault.counting.component.base import SequentialComponent
+from qfault.counting.component.transversal import TransCnot
+from qfault.noise import CountingNoiseModelXZ
+from qfault.qec.ed422 import ED412Code
+from qfault.qec.error import Pauli
+from qfault.util import cache, trace
+import logging
+import unittest
+
+
+class _Records(logging.Handler):
+
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.messages = []
+
+    def emit(self, record):
+        self.messages.append(record.getMessage())
+
+
+class _Unprintable(object):
+
+    def __str__(self):
+        raise AssertionError('formatted while tracing was disabled')
+
+
+class TestTrace(unittest.TestCase):
+
+    def setUp(self):
+        self.records = _Records()
+        logging.getLogger('test.trace').addHandler(self.records)
+        logging.getLogger('counting.component').addHandler(self.records)
+
+    def tearDown(self):
+        trace.enable(False)
+        logging.getLogger('test.trace').removeHandler(self.records)
+        logging.getLogger('counting.component').removeHandler(self.records)
+
+    def testDisabled(self):
+        tracer = trace.get_tracer('test.trace')
+        assert not tracer.enabled
+        logging.getLogger('test.trace').setLevel(logging.DEBUG)
+        if tracer.enabled:
+            tracer.event('%s', _Unprintable())
+        assert [] == self.records.messages
+
+    def testSampling(self):
+        trace.enable('test.', sample=3)
+        tracer = trace.get_tracer('test.trace')
+        for i in range(7):
+            tracer.event('event %s', i)
+        assert ['event 0', 'event 3', 'event 6'] == self.records.messages
+
+    def testSummary(self):
+        table = {(i,): i for i in range(1000)}
+        summary = trace.summarize([table, {}], max_entries=2)
+        assert summary.startswith('[{1000 entries: ')
+        assert summary.endswith(', ...}, {0 entries}]')
+        assert len(summary) < 100
+
+    def testComponentResults(self):
+        cache.enableFetch(False)
+        try:
+            trace.enable('counting')
+            kGood = {Pauli.Y: 2}
+            code = ED412Code()
+            cnots = SequentialComponent(kGood, [TransCnot(kGood, code, code), TransCnot(kGood, code, code)])
+            noiseModels = {pauli: CountingNoiseModelXZ() for pauli in (Pauli.X, Pauli.Z, Pauli.Y)}
+            cnots.count(noiseModels, Pauli.Y)
+        finally:
+            cache.enableFetch(True)
+
+        results = [message for message in self.records.messages if 'result=' in message]
+        assert results
+        assert all(len(message) < 2000 for message in results)
+
+
+if __name__ == "__main__":
+    unittest.main()